@@ -1,9 +1,9 @@
-import os
 import pyodbc
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from shapely.geometry import Polygon
+from similarity_kernel import angle_basis, close_loop, pairwise_iou, upper_triangle_pairs
+from vector_store import CONNECTION_STRING, refresh_vector_store
 from dotenv import load_dotenv
 import streamlit as st
 from io import BytesIO
@@ -14,18 +14,6 @@ from io import BytesIO
 
 load_dotenv()  # Load .env file if present
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CONNECTION_STRING = (
-    f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-    f"SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};"
-    f"UID={DB_USER};PWD={DB_PASSWORD}"
-)
-
 
 ##################################
 # 2. DATA FETCH & PREPROCESSING  #
@@ -33,47 +21,25 @@ CONNECTION_STRING = (
 
 def get_user_data():
     """
-    Connect to the DB and retrieve normalized user audio features.
-    The table columns are assumed as:
-      [0: display_name, 1: user_id, 2..10: norm_* features]
+    Load the normalized user audio features from the shared vector store,
+    refreshed from the DB, and fetch only the display names from the DB.
+    Returns the display names (the user_id where a user has none) and the
+    (N, 9) feature vectors, in the same order.
     """
-    conn = pyodbc.connect(CONNECTION_STRING)
+    store = refresh_vector_store()
+    user_ids = store.user_ids.tolist()
 
-    query = """
-    SELECT 
-        display_name,
-        user_id,
-        norm_danceability,
-        norm_energy,
-        norm_loudness,
-        norm_speechiness,
-        norm_acousticness,
-        norm_instrumentalness,
-        norm_liveness,
-        norm_valence,
-        norm_tempo
-    FROM NormalizedUserAudioFeaturesWithNames
-    """
-    cursor = conn.cursor()
-    cursor.execute(query)
-    data = cursor.fetchall()
-    conn.close()
+    conn = pyodbc.connect(CONNECTION_STRING)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, display_name FROM Users")
+        names = {row[0]: row[1] for row in cursor.fetchall()}
+    finally:
+        conn.close()
 
-    # Parse results
     # 'display_names' will be used in the UI (the front end)
-    # 'vectors' will hold the 9 audio features only
-    display_names = []
-    vectors = []
-
-    for row in data:
-        display_name = row[0]
-        # user_id   = row[1]  # if you need the user_id for anything else, store it separately
-        features   = list(row[2:])  # the 9 feature columns from index 2 to 10
-
-        display_names.append(display_name)
-        vectors.append(features)
-
-    return display_names, vectors
+    display_names = [names.get(user_id) or user_id for user_id in user_ids]
+    return display_names, np.asarray(store.vectors)
 
 
 #########################
@@ -83,68 +49,21 @@ def get_user_data():
 # Example feature weights
 feature_weights = np.array([0.2, 0.2, 0.1, 0.1, 0.1, 0.1, 0.1, 0.05, 0.05])
 
-def polar_to_cartesian(radii, angles):
-    """
-    Convert polar coordinates (r, θ) to Cartesian (x, y).
-    radii: array of radial lengths
-    angles: array of angles in radians
-    """
-    x = radii * np.cos(angles)
-    y = radii * np.sin(angles)
-    return np.column_stack((x, y))
-
-def calculate_polygon(radii):
-    """
-    Create a closed polygon from the given radii by:
-    1. Spreading angles equally around 2π
-    2. Converting to (x, y)
-    3. Building a Shapely Polygon
-    """
-    n = len(radii)
-    angles = np.linspace(0, 2*np.pi, n, endpoint=False)
-
-    # Close the loop by repeating the first radius
-    radii_closed = np.append(radii, radii[0])
-    angles_closed = np.append(angles, angles[0])
-
-    points = polar_to_cartesian(radii_closed, angles_closed)
-    polygon = Polygon(points)
-    return polygon
-
-def intersection_over_union_area(poly1, poly2):
-    """
-    Compute IoU = intersection_area / union_area for two polygons.
-    """
-    intersection_area = poly1.intersection(poly2).area
-    union_area = poly1.union(poly2).area
-    if union_area == 0.0:  # Degenerate case
-        return 0.0
-    return intersection_area / union_area
-
 def compute_area_similarity_table(display_names, raw_vectors):
     """
     Given display_names and raw feature vectors, compute the IoU-based
     similarity for all pairs. Returns a DataFrame with columns:
       "User 1", "User 2", "Similarity (%)"
     """
-    weighted_vectors = [np.array(v) * feature_weights for v in raw_vectors]
-    n = len(display_names)
-    results = []
-
-    for i in range(n):
-        poly_i = calculate_polygon(weighted_vectors[i])
-        for j in range(i+1, n):
-            poly_j = calculate_polygon(weighted_vectors[j])
-            iou = intersection_over_union_area(poly_i, poly_j)
-            similarity_pct = iou * 100.0
-
-            results.append({
-                "User 1": display_names[i],
-                "User 2": display_names[j],
-                "Similarity (%)": round(similarity_pct, 2)
-            })
-
-    df = pd.DataFrame(results)
+    weighted_vectors = np.array(raw_vectors, dtype=np.float64) * feature_weights
+    first, second, iou = upper_triangle_pairs(pairwise_iou(weighted_vectors))
+    names = np.asarray(display_names, dtype=object)
+
+    df = pd.DataFrame({
+        "User 1": names[first],
+        "User 2": names[second],
+        "Similarity (%)": np.round(iou * 100.0, 2),
+    })
     return df
 
 
@@ -157,10 +76,8 @@ def plot_radar_chart(display_name, user_vector, ax, color="blue"):
     Plots a single user's radar polygon on the given polar Axes.
     'display_name' is shown in the legend label.
     """
-    n = len(user_vector)
-    angles = np.linspace(0, 2*np.pi, n, endpoint=False)
-    angles = np.append(angles, angles[0])  # close the loop
-    r = np.append(user_vector, user_vector[0])
+    _, angles, _, _, _ = angle_basis(len(user_vector))  # closed loop of axis angles
+    r = close_loop(user_vector)
 
     ax.plot(angles, r, color=color, label=f"{display_name}")
     ax.fill(angles, r, color=color, alpha=0.25)
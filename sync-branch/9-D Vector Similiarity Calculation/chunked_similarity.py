@@ -0,0 +1,134 @@
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+from similarity_kernel import AREA_METRICS, radar_area, radar_intersection_area
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#####################################
+# Packed Upper-Triangle Pair Scores #
+#####################################
+
+# All-pairs scores for N users are stored as a flat float32 file of the N(N-1)/2
+# pairs i < j in row-major order: row i holds (i, i+1) ... (i, N-1) and starts at
+# pair_offset(i). A block of consecutive rows is therefore one contiguous slice
+# of the file, so workers write their blocks straight into a shared memmap and
+# nothing but block bounds crosses process boundaries.
+
+# Chunking settings (override through .env)
+SIMILARITY_WORKERS = int(os.getenv("SIMILARITY_WORKERS", os.cpu_count() or 1))  # Worker processes
+SIMILARITY_CHUNK_PAIRS = int(os.getenv("SIMILARITY_CHUNK_PAIRS", 500000))  # Pairs per block; each block allocates a few (pairs, n) float64 arrays
+PAIR_SCORES_FILE = os.getenv("SIMILARITY_PAIR_SCORES_FILE", "similarity_pair_scores.f32")  # Packed upper triangle of the last all-pairs run
+
+# Worker state, set once per process by _init_worker
+_worker_radii = None
+_worker_areas = None
+_worker_scores = None
+_worker_metric = None
+
+
+def pair_count(n_users):
+    """Number of pairs i < j."""
+    return n_users * (n_users - 1) // 2
+
+
+def pair_offset(row, n_users):
+    """Position of pair (row, row + 1) in the packed upper triangle."""
+    return row * (2 * n_users - row - 1) // 2
+
+
+def plan_row_blocks(n_users, pairs_per_block=SIMILARITY_CHUNK_PAIRS):
+    """
+    Splits the rows into consecutive blocks of roughly `pairs_per_block` pairs each.
+    Early rows have more pairs, so blocks get taller towards the end.
+
+    Returns:
+        list: (start_row, stop_row) tuples.
+    """
+    blocks = []
+    start = 0
+    while start < n_users - 1:
+        rows = max(1, pairs_per_block // (n_users - 1 - start))
+        stop = min(start + rows, n_users - 1)
+        blocks.append((start, stop))
+        start = stop
+    return blocks
+
+
+def upper_triangle_block_indices(start, stop, n_users):
+    """
+    (i, j) indices of the pairs stored for rows [start, stop), in packed order.
+
+    Returns:
+        tuple: (rows, columns) arrays, both of length pair_offset(stop) - pair_offset(start).
+    """
+    rows = np.arange(start, stop)
+    columns = np.arange(start + 1, n_users)
+    mask = columns[None, :] > rows[:, None]
+    return np.broadcast_to(rows[:, None], mask.shape)[mask], np.broadcast_to(columns[None, :], mask.shape)[mask]
+
+
+def open_pair_scores(path, n_users, mode="r"):
+    """Memory-maps a packed upper-triangle score file for `n_users` users."""
+    return np.memmap(path, dtype=np.float32, mode=mode, shape=(max(pair_count(n_users), 1),))
+
+
+def _init_worker(radii, path, metric):
+    global _worker_radii, _worker_areas, _worker_scores, _worker_metric
+    _worker_radii = radii
+    _worker_areas = radar_area(radii)
+    _worker_scores = open_pair_scores(path, len(radii), mode="r+")
+    _worker_metric = AREA_METRICS[metric]
+
+
+def _score_block(start, stop):
+    """Scores rows [start, stop) against every later row and writes them into the shared file."""
+    n_users = len(_worker_radii)
+    rows, columns = upper_triangle_block_indices(start, stop, n_users)
+    intersection = radar_intersection_area(_worker_radii[rows], _worker_radii[columns])
+    scores = _worker_metric(intersection, _worker_areas[rows], _worker_areas[columns])
+    _worker_scores[pair_offset(start, n_users):pair_offset(stop, n_users)] = scores
+    _worker_scores.flush()
+    return len(scores)
+
+
+def compute_pair_scores(radii, path=PAIR_SCORES_FILE, metric="iou", workers=SIMILARITY_WORKERS, pairs_per_block=SIMILARITY_CHUNK_PAIRS):
+    """
+    Computes every pair score into a packed float32 upper-triangle file, block by block
+    across worker processes. Memory per worker depends on `pairs_per_block`, not on N.
+
+    Args:
+        radii (np.ndarray): Weighted vectors, shape (N, n).
+        path (str): Output file, overwritten.
+        metric (str): Any key of AREA_METRICS.
+        workers (int): Worker processes.
+        pairs_per_block (int): Pairs scored per task.
+
+    Returns:
+        np.memmap: The scores, read-only, length N(N-1)/2.
+    """
+    radii = np.ascontiguousarray(radii, dtype=np.float64)
+    n_users = len(radii)
+    # Size the file up front so every worker can open it in place
+    open_pair_scores(path, n_users, mode="w+").flush()
+
+    blocks = plan_row_blocks(n_users, pairs_per_block)
+    if blocks:
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker, initargs=(radii, path, metric)) as executor:
+            list(executor.map(_score_block, *zip(*blocks)))
+    return open_pair_scores(path, n_users)[:pair_count(n_users)]
+
+
+def iter_pair_chunks(user_ids, scores, pairs_per_chunk=SIMILARITY_CHUNK_PAIRS):
+    """
+    Streams a packed score file as (user_1, user_2, score) arrays, one block of rows at a time.
+
+    Yields:
+        tuple: (user_1, user_2, scores) NumPy arrays.
+    """
+    user_ids = np.asarray(user_ids, dtype=object)
+    n_users = len(user_ids)
+    for start, stop in plan_row_blocks(n_users, pairs_per_chunk):
+        rows, columns = upper_triangle_block_indices(start, stop, n_users)
+        yield user_ids[rows], user_ids[columns], np.asarray(scores[pair_offset(start, n_users):pair_offset(stop, n_users)])
@@ -0,0 +1,147 @@
+import pyodbc
+import numpy as np
+import logging
+import os
+import sys
+import time
+from similarity_kernel import FEATURE_WEIGHTS, pairwise_iou
+from match_index import MATCH_INDEX_FILE, MatchIndex
+from vector_store import CONNECTION_STRING, VectorStore
+from match_writer import MATCH_WRITE_BATCH_SIZE, ordered_pair, pair_rows, replace_match_rates, upsert_match_rates
+from chunked_similarity import compute_pair_scores, iter_pair_chunks
+from personal_type_clustering import PERSONAL_TYPE_MODEL_FILE, PersonalTypeModel, write_user_clusters
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Incremental job settings (override through .env)
+MATCH_SNAPSHOT_FILE = os.getenv("MATCH_SNAPSHOT_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "match_snapshot.npz"))
+MATCH_REFRESH_INTERVAL = float(os.getenv("MATCH_REFRESH_INTERVAL", 10))  # Seconds between checks with --watch
+
+def load_snapshot(path=MATCH_SNAPSHOT_FILE):
+    """
+    Reads the feature vectors the pair table was last computed from.
+
+    Returns:
+        dict: user_id -> normalized vector; empty if no snapshot exists yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with np.load(path, allow_pickle=False) as data:
+        return dict(zip(data["user_ids"].tolist(), data["vectors"]))
+
+def save_snapshot(user_ids, vectors, path=MATCH_SNAPSHOT_FILE):
+    """Writes the vectors the pair table now reflects, replacing the previous snapshot atomically."""
+    temp_path = f"{path}.tmp.npz"
+    np.savez(temp_path, user_ids=np.array(user_ids, dtype=str), vectors=vectors)
+    os.replace(temp_path, path)
+
+def find_changed_users(user_ids, vectors, snapshot):
+    """
+    Compares current vectors with the snapshot.
+
+    Returns:
+        tuple: (changed_rows, removed_user_ids). `changed_rows` indexes `user_ids` for
+        new users and users whose vector differs; removed users are in the snapshot only.
+    """
+    changed_rows = [
+        row for row, user_id in enumerate(user_ids)
+        if user_id not in snapshot or not np.array_equal(snapshot[user_id], vectors[row], equal_nan=True)
+    ]
+    listed = set(user_ids)
+    removed_user_ids = [user_id for user_id in snapshot if user_id not in listed]
+    return np.array(changed_rows, dtype=np.int64), removed_user_ids
+
+def changed_pair_batches(user_ids, radii, changed_rows, block_size=MATCH_WRITE_BATCH_SIZE):
+    """
+    Recomputes every pair that involves a changed user, a block of changed users at a time.
+    A pair of two changed users is produced once.
+
+    Yields:
+        list: (user_id1, user_id2, final_match_rate_percentage) rows.
+    """
+    changed = np.zeros(len(user_ids), dtype=bool)
+    changed[changed_rows] = True
+    columns = np.arange(len(user_ids))
+    rows_per_block = max(1, block_size // max(len(user_ids), 1))
+
+    for start in range(0, len(changed_rows), rows_per_block):
+        rows = changed_rows[start:start + rows_per_block]
+        # A user with missing features scores NaN; the rate column is NOT NULL, so it is stored as 0
+        percentages = np.round(np.nan_to_num(pairwise_iou(radii[rows], radii), nan=0.0) * 100, 2)
+        # Skip self-pairs, and pairs of two changed users from the side with the larger row
+        keep = ~(changed[None, :] & (columns[None, :] <= rows[:, None]))
+        row_index, column_index = np.nonzero(keep)
+        yield [
+            (*ordered_pair(user_ids[rows[i]], user_ids[j]), float(percentages[i, j]))
+            for i, j in zip(row_index, column_index)
+        ]
+
+def refresh_changed_matches(conn, store, snapshot_path=MATCH_SNAPSHOT_FILE, index_path=MATCH_INDEX_FILE):
+    """
+    Recomputes match rates for users whose NormalizedUserAudioFeatures row changed since the last run,
+    writes only those pairs, brings the match index up to date and gives those users a personal type.
+
+    Args:
+        conn (pyodbc.Connection): Database connection for the refresh and the pair writes.
+        store (VectorStore): Vector store, refreshed from the database first.
+
+    Returns:
+        tuple: (changed users, removed users, pair rows written).
+    """
+    cursor = conn.cursor()
+    store.refresh(cursor)
+    user_ids = store.user_ids.tolist()
+    vectors = store.vectors.astype(np.float64)
+
+    snapshot = load_snapshot(snapshot_path)
+    changed_rows, removed_user_ids = find_changed_users(user_ids, vectors, snapshot)
+    if len(changed_rows) == 0 and not removed_user_ids:
+        return 0, 0, 0
+
+    radii = vectors * FEATURE_WEIGHTS
+    if not snapshot:
+        # First run: every pair is new, so every row of the table is replaced at once
+        scores = compute_pair_scores(radii)
+        written = replace_match_rates((pair_rows(*chunk) for chunk in iter_pair_chunks(user_ids, scores)), cursor, conn)
+    else:
+        written = upsert_match_rates(changed_pair_batches(user_ids, radii, changed_rows), cursor, conn, removed_user_ids)
+
+    if os.path.exists(index_path):
+        index = MatchIndex.load(index_path)
+        index.sync(user_ids, vectors)
+    else:
+        index = MatchIndex(user_ids, vectors)
+    index.save(index_path)
+
+    # Type new and changed users with the saved centroids; refits are left to personal_type_clustering.py
+    if len(changed_rows) and os.path.exists(PERSONAL_TYPE_MODEL_FILE):
+        personal_types = PersonalTypeModel.load(PERSONAL_TYPE_MODEL_FILE).assign(vectors[changed_rows])
+        write_user_clusters([(user_ids[row], str(personal_type)) for row, personal_type in zip(changed_rows, personal_types)], cursor, conn)
+
+    # Saved last, so a failure above leaves these users changed and the next run redoes them
+    save_snapshot(user_ids, vectors, snapshot_path)
+
+    logger.info(f"Recomputed matches for {len(changed_rows)} users ({written} pairs), removed {len(removed_user_ids)} users.")
+    return len(changed_rows), len(removed_user_ids), written
+
+def main():
+    """Runs one incremental refresh, or keeps checking every MATCH_REFRESH_INTERVAL seconds with --watch."""
+    watch = '--watch' in sys.argv
+    conn = pyodbc.connect(CONNECTION_STRING)
+    store = VectorStore.open()
+    try:
+        while True:
+            changed, removed, written = refresh_changed_matches(conn, store)
+            if changed or removed or not watch:
+                print(f"Match rates refreshed: {changed} users changed, {removed} removed, {written} pairs written.")
+            if not watch:
+                break
+            time.sleep(MATCH_REFRESH_INTERVAL)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
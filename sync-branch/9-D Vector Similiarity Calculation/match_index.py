@@ -0,0 +1,231 @@
+import numpy as np
+import logging
+import os
+from threading import RLock
+from similarity_kernel import FEATURE_WEIGHTS, AREA_METRICS, radar_area, radar_intersection_area
+from vector_store import refresh_vector_store
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Index settings (override through .env)
+MATCH_INDEX_FILE = os.getenv("MATCH_INDEX_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "match_index.npz"))
+MATCH_INDEX_BRUTE_FORCE_LIMIT = int(os.getenv("MATCH_INDEX_BRUTE_FORCE_LIMIT", 20000))  # Up to this many users every query scores everyone
+MATCH_INDEX_CANDIDATES = int(os.getenv("MATCH_INDEX_CANDIDATES", 1000))  # Ball-tree neighbours re-ranked by exact IoU per query
+MATCH_INDEX_REBUILD_FRACTION = float(os.getenv("MATCH_INDEX_REBUILD_FRACTION", 0.05))  # Share of changed users that triggers a tree rebuild
+MATCH_INDEX_LEAF_SIZE = 40
+
+class MatchIndex:
+    """
+    Top-K radar-IoU search over user feature vectors.
+
+    Up to `brute_force_limit` users a query scores every user with the closed-form
+    kernel, which is exact and takes a few milliseconds. Above that, a ball tree
+    over the weighted vectors proposes the `candidates` nearest users in Euclidean
+    distance and only those are scored exactly. Users added or changed since the
+    tree was built are always scored exactly, and the tree is rebuilt once they
+    exceed `rebuild_fraction` of the index.
+    """
+
+    def __init__(self, user_ids=(), vectors=None, weights=FEATURE_WEIGHTS, metric="iou",
+                 brute_force_limit=MATCH_INDEX_BRUTE_FORCE_LIMIT, candidates=MATCH_INDEX_CANDIDATES,
+                 rebuild_fraction=MATCH_INDEX_REBUILD_FRACTION):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.metric = metric
+        self.brute_force_limit = brute_force_limit
+        self.candidates = candidates
+        self.rebuild_fraction = rebuild_fraction
+        self._lock = RLock()
+
+        vectors = np.empty((0, len(self.weights))) if vectors is None else np.asarray(vectors, dtype=np.float64)
+        self.user_ids = list(user_ids)
+        self._positions = {user_id: row for row, user_id in enumerate(self.user_ids)}
+        if len(self._positions) != len(self.user_ids):
+            raise ValueError("User IDs in a match index must be unique.")
+        self._vectors = vectors.copy()
+        self._radii = vectors * self.weights
+        self._areas = radar_area(self._radii)
+        self._active = np.ones(len(self.user_ids), dtype=bool)
+        self._tree = None
+        self._dirty = set()  # Rows whose vector is not (or no longer) in the tree
+        self._rebuild()
+
+    def __len__(self):
+        return int(self._active.sum())
+
+    def __contains__(self, user_id):
+        row = self._positions.get(user_id)
+        return row is not None and bool(self._active[row])
+
+    def _rebuild(self):
+        """Rebuilds the ball tree from the active rows, or drops it while brute force is enough."""
+        self._dirty.clear()
+        if len(self) <= self.brute_force_limit:
+            self._tree = None
+            return
+        from sklearn.neighbors import BallTree
+        self._tree_rows = np.flatnonzero(self._active)
+        self._tree = BallTree(self._radii[self._tree_rows], leaf_size=MATCH_INDEX_LEAF_SIZE)
+        logger.info(f"Built match index ball tree over {len(self._tree_rows)} users.")
+
+    def _candidate_rows(self, radii):
+        if self._tree is None:
+            return np.flatnonzero(self._active)
+        count = min(self.candidates, len(self._tree_rows))
+        _, nearest = self._tree.query(radii[None, :], k=count)
+        rows = np.union1d(self._tree_rows[nearest[0]], np.fromiter(self._dirty, dtype=np.int64, count=len(self._dirty)))
+        return rows[self._active[rows]]
+
+    def query_vector(self, vector, k=5, exclude=None):
+        """
+        The `k` best matches for a normalized feature vector.
+
+        Args:
+            vector (array-like): Normalized features, shape (n,).
+            k (int): Matches returned.
+            exclude (str): User ID to leave out, normally the user being matched.
+
+        Returns:
+            list: (user_id, score) tuples, best match first.
+        """
+        radii = np.asarray(vector, dtype=np.float64) * self.weights
+        with self._lock:
+            rows = self._candidate_rows(radii)
+            if exclude is not None and exclude in self._positions:
+                rows = rows[rows != self._positions[exclude]]
+            if len(rows) == 0 or k <= 0:
+                return []
+
+            intersection = radar_intersection_area(radii[None, :], self._radii[rows])
+            scores = AREA_METRICS[self.metric](intersection, radar_area(radii), self._areas[rows])
+            k = min(k, len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [(self.user_ids[rows[i]], float(scores[i])) for i in best]
+
+    def query(self, user_id, k=5):
+        """
+        The `k` best matches for an indexed user, never including the user themselves.
+
+        Raises:
+            KeyError: If the user is not in the index.
+        """
+        with self._lock:
+            if user_id not in self:
+                raise KeyError(user_id)
+            vector = self._vectors[self._positions[user_id]]
+            return self.query_vector(vector, k, exclude=user_id)
+
+    def _apply(self, user_ids, vectors):
+        """Writes vectors for known and new users without rebuilding; returns the rows that changed."""
+        changed, new_ids, new_vectors = [], [], []
+        for user_id, vector in zip(user_ids, vectors):
+            row = self._positions.get(user_id)
+            if row is None:
+                new_ids.append(user_id)
+                new_vectors.append(vector)
+            elif not (self._active[row] and np.array_equal(self._vectors[row], vector)):
+                self._vectors[row] = vector
+                self._radii[row] = vector * self.weights
+                self._areas[row] = radar_area(self._radii[row])
+                self._active[row] = True
+                changed.append(row)
+
+        if new_ids:
+            # One reallocation for every new user instead of one per user
+            first = len(self.user_ids)
+            new_vectors = np.asarray(new_vectors, dtype=np.float64).reshape(len(new_ids), len(self.weights))
+            self.user_ids.extend(new_ids)
+            self._positions.update((user_id, first + offset) for offset, user_id in enumerate(new_ids))
+            self._vectors = np.vstack([self._vectors, new_vectors])
+            self._radii = np.vstack([self._radii, new_vectors * self.weights])
+            self._areas = np.append(self._areas, radar_area(new_vectors * self.weights))
+            self._active = np.append(self._active, np.ones(len(new_ids), dtype=bool))
+            changed.extend(range(first, len(self.user_ids)))
+
+        self._dirty.update(changed)
+        return changed
+
+    def upsert(self, user_id, vector):
+        """Adds a user or replaces their vector; returns True if the index changed."""
+        with self._lock:
+            changed = self._apply([user_id], [np.asarray(vector, dtype=np.float64)])
+            if changed:
+                self._maybe_rebuild()
+            return bool(changed)
+
+    def remove(self, user_id):
+        """Drops a user from the results; returns True if they were indexed."""
+        with self._lock:
+            if user_id not in self:
+                return False
+            self._active[self._positions[user_id]] = False
+            self._maybe_rebuild()
+            return True
+
+    def _maybe_rebuild(self):
+        brute_force = len(self) <= self.brute_force_limit
+        if (self._tree is None) != brute_force or len(self._dirty) > self.rebuild_fraction * len(self):
+            self._rebuild()
+
+    def sync(self, user_ids, vectors):
+        """
+        Brings the index in line with a full listing of users and their normalized vectors:
+        changed and new users are upserted, users missing from the listing are removed.
+
+        Returns:
+            tuple: (changed, removed) user counts.
+        """
+        user_ids = list(user_ids)
+        vectors = np.asarray(vectors, dtype=np.float64)
+        with self._lock:
+            changed = self._apply(user_ids, vectors)
+            listed = set(user_ids)
+            missing = [row for row, user_id in enumerate(self.user_ids) if self._active[row] and user_id not in listed]
+            self._active[missing] = False
+            self._maybe_rebuild()
+            return len(changed), len(missing)
+
+    def save(self, path=MATCH_INDEX_FILE):
+        """Writes the active users and their normalized vectors; the tree is rebuilt on load."""
+        with self._lock:
+            active = np.flatnonzero(self._active)
+            user_ids = np.array([self.user_ids[row] for row in active], dtype=str)
+            vectors = self._vectors[active]
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, user_ids=user_ids, vectors=vectors, weights=self.weights, metric=np.array(self.metric))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=MATCH_INDEX_FILE, **options):
+        """Reads an index written by save()."""
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["user_ids"].tolist(), data["vectors"], weights=data["weights"], metric=str(data["metric"]), **options)
+
+    @classmethod
+    def from_store(cls, store, **options):
+        """Builds an index from a VectorStore."""
+        return cls(store.user_ids.tolist(), store.vectors, **options)
+
+def refresh_match_index(path=MATCH_INDEX_FILE):
+    """
+    Loads the saved index (or builds a new one), syncs it with the refreshed vector store and saves it.
+
+    Returns:
+        MatchIndex: The refreshed index.
+    """
+    store = refresh_vector_store()
+    if os.path.exists(path):
+        index = MatchIndex.load(path)
+        changed, removed = index.sync(store.user_ids.tolist(), store.vectors)
+        print(f"Match index synced: {changed} users added or changed, {removed} removed.")
+    else:
+        index = MatchIndex.from_store(store)
+        print(f"Match index built for {len(index)} users.")
+    index.save(path)
+    return index
+
+if __name__ == "__main__":
+    refresh_match_index()
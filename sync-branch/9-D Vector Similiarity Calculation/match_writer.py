@@ -0,0 +1,214 @@
+import numpy as np
+import logging
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Table the match endpoints read pair rates from, and the table a full rewrite is loaded into first
+MATCH_RATE_TABLE = "UserPairMatchRateWithDisplayNamesTable"
+MATCH_RATE_LOAD_TABLE = f"{MATCH_RATE_TABLE}_Load"
+
+# Rows per executemany round trip (override through .env)
+MATCH_WRITE_BATCH_SIZE = int(os.getenv("MATCH_WRITE_BATCH_SIZE", 50000))
+
+# Session-scoped staging tables; pairs are stored once with user_id1 < user_id2
+MATCH_RATES_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#Match_Rates_Staging') IS NULL
+    CREATE TABLE #Match_Rates_Staging (
+        user_id1 NVARCHAR(255) NOT NULL, user_id2 NVARCHAR(255) NOT NULL,
+        final_match_rate_percentage FLOAT NOT NULL, PRIMARY KEY (user_id1, user_id2)
+    );
+TRUNCATE TABLE #Match_Rates_Staging;
+"""
+
+MATCH_USERS_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#Match_Users_Staging') IS NULL
+    CREATE TABLE #Match_Users_Staging (user_id NVARCHAR(255) NOT NULL PRIMARY KEY);
+TRUNCATE TABLE #Match_Users_Staging;
+"""
+
+# Existing rows may hold a pair in either order, so both orders are updated
+UPSERT_MATCH_RATES_SQL = f"""
+UPDATE m SET m.final_match_rate_percentage = s.final_match_rate_percentage
+FROM {MATCH_RATE_TABLE} m
+JOIN #Match_Rates_Staging s ON m.user_id1 = s.user_id1 AND m.user_id2 = s.user_id2;
+
+UPDATE m SET m.final_match_rate_percentage = s.final_match_rate_percentage
+FROM {MATCH_RATE_TABLE} m
+JOIN #Match_Rates_Staging s ON m.user_id1 = s.user_id2 AND m.user_id2 = s.user_id1;
+
+INSERT INTO {MATCH_RATE_TABLE} (user_id1, user_display_name_1, user_id2, user_display_name_2, final_match_rate_percentage)
+SELECT s.user_id1, u1.display_name, s.user_id2, u2.display_name, s.final_match_rate_percentage
+FROM #Match_Rates_Staging s
+LEFT JOIN Users u1 ON u1.user_id = s.user_id1
+LEFT JOIN Users u2 ON u2.user_id = s.user_id2
+WHERE NOT EXISTS (
+    SELECT 1 FROM {MATCH_RATE_TABLE} m
+    WHERE (m.user_id1 = s.user_id1 AND m.user_id2 = s.user_id2)
+       OR (m.user_id1 = s.user_id2 AND m.user_id2 = s.user_id1)
+);
+"""
+
+DELETE_USER_MATCHES_SQL = f"""
+DELETE m FROM {MATCH_RATE_TABLE} m
+WHERE m.user_id1 IN (SELECT user_id FROM #Match_Users_Staging)
+   OR m.user_id2 IN (SELECT user_id FROM #Match_Users_Staging);
+"""
+
+# Columns this module writes; (user_id1, user_id2) is the key upsert_match_rates relies on.
+# The live table is only created here when it does not exist yet.
+CREATE_MATCH_RATE_TABLE_SQL = f"""
+IF OBJECT_ID('{MATCH_RATE_TABLE}') IS NULL
+BEGIN
+    CREATE TABLE {MATCH_RATE_TABLE} (
+        user_id1 NVARCHAR(255) NOT NULL, user_display_name_1 NVARCHAR(255) NULL,
+        user_id2 NVARCHAR(255) NOT NULL, user_display_name_2 NVARCHAR(255) NULL,
+        final_match_rate_percentage FLOAT NOT NULL,
+        CONSTRAINT PK_{MATCH_RATE_TABLE} PRIMARY KEY (user_id1, user_id2)
+    );
+    CREATE INDEX IX_MatchRates_User2 ON {MATCH_RATE_TABLE} (user_id2) INCLUDE (user_id1, final_match_rate_percentage);
+END
+"""
+
+# Full rewrites load into a separate table that readers never query
+CREATE_LOAD_TABLE_SQL = f"""
+IF OBJECT_ID('{MATCH_RATE_LOAD_TABLE}') IS NOT NULL DROP TABLE {MATCH_RATE_LOAD_TABLE};
+CREATE TABLE {MATCH_RATE_LOAD_TABLE} (
+    user_id1 NVARCHAR(255) NOT NULL, user_display_name_1 NVARCHAR(255) NULL,
+    user_id2 NVARCHAR(255) NOT NULL, user_display_name_2 NVARCHAR(255) NULL,
+    final_match_rate_percentage FLOAT NOT NULL
+);
+"""
+
+FILL_LOAD_DISPLAY_NAMES_SQL = f"""
+UPDATE l SET l.user_display_name_1 = u1.display_name, l.user_display_name_2 = u2.display_name
+FROM {MATCH_RATE_LOAD_TABLE} l
+LEFT JOIN Users u1 ON u1.user_id = l.user_id1
+LEFT JOIN Users u2 ON u2.user_id = l.user_id2;
+"""
+
+# The live table keeps its key, indexes, constraints, grants and triggers; only its rows
+# are replaced, in one transaction, so readers see either the old rows or the new ones
+COPY_LOAD_TABLE_SQL = f"""
+TRUNCATE TABLE {MATCH_RATE_TABLE};
+INSERT INTO {MATCH_RATE_TABLE} WITH (TABLOCK) (user_id1, user_display_name_1, user_id2, user_display_name_2, final_match_rate_percentage)
+SELECT user_id1, user_display_name_1, user_id2, user_display_name_2, final_match_rate_percentage
+FROM {MATCH_RATE_LOAD_TABLE};
+"""
+
+DROP_LOAD_TABLE_SQL = f"IF OBJECT_ID('{MATCH_RATE_LOAD_TABLE}') IS NOT NULL DROP TABLE {MATCH_RATE_LOAD_TABLE};"
+
+def ordered_pair(user_id1, user_id2):
+    """Returns the pair with the smaller ID first, the order pair rows are written in."""
+    return (user_id1, user_id2) if user_id1 < user_id2 else (user_id2, user_id1)
+
+def pair_rows(user_1, user_2, scores):
+    """(user_id1, user_id2, final_match_rate_percentage) rows from a chunk of pair arrays and 0-1 scores; NaN scores become 0."""
+    percentages = np.round(np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=0.0) * 100, 2)
+    return list(zip(np.asarray(user_1).tolist(), np.asarray(user_2).tolist(), percentages.tolist()))
+
+def stage_match_rates(batches, cursor, batch_size=MATCH_WRITE_BATCH_SIZE):
+    """
+    Bulk-loads (user_id1, user_id2, final_match_rate_percentage) rows into #Match_Rates_Staging.
+
+    Args:
+        batches (iterable): Lists of rows, as produced by the similarity jobs.
+        cursor (pyodbc.Cursor): Cursor whose session owns the staging table.
+        batch_size (int): Rows per executemany call.
+
+    Returns:
+        int: Number of staged rows.
+    """
+    cursor.execute(MATCH_RATES_STAGING_SQL)
+    cursor.fast_executemany = True
+    staged = 0
+    for batch in batches:
+        for start in range(0, len(batch), batch_size):
+            rows = batch[start:start + batch_size]
+            cursor.executemany(
+                "INSERT INTO #Match_Rates_Staging (user_id1, user_id2, final_match_rate_percentage) VALUES (?, ?, ?)",
+                rows
+            )
+            staged += len(rows)
+    return staged
+
+def upsert_match_rates(batches, cursor, conn, removed_user_ids=()):
+    """
+    Writes recomputed pair rates in one transaction: staged rows are updated or inserted,
+    and every pair of `removed_user_ids` is deleted.
+
+    Args:
+        batches (iterable): Lists of (user_id1, user_id2, final_match_rate_percentage) rows.
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        conn (pyodbc.Connection): Database connection to commit the transaction.
+        removed_user_ids (iterable): Users whose pairs are dropped.
+
+    Returns:
+        int: Number of pair rows written.
+    """
+    try:
+        staged = stage_match_rates(batches, cursor)
+        cursor.execute(UPSERT_MATCH_RATES_SQL)
+
+        removed_user_ids = list(removed_user_ids)
+        if removed_user_ids:
+            cursor.execute(MATCH_USERS_STAGING_SQL)
+            cursor.executemany("INSERT INTO #Match_Users_Staging (user_id) VALUES (?)", [(user_id,) for user_id in removed_user_ids])
+            cursor.execute(DELETE_USER_MATCHES_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Upserted {staged} match rates and removed pairs of {len(removed_user_ids)} users.")
+    return staged
+
+def replace_match_rates(batches, cursor, conn, batch_size=MATCH_WRITE_BATCH_SIZE):
+    """
+    Rewrites the whole pair table without readers ever seeing a partial one.
+
+    Rows are bulk-loaded into MATCH_RATE_LOAD_TABLE with fast_executemany, committing
+    per batch since nothing reads that table. Display names are then filled in, and the
+    rows of MATCH_RATE_TABLE are replaced from the load table in a single transaction.
+    The live table itself is never dropped or renamed.
+
+    Args:
+        batches (iterable): Lists of (user_id1, user_id2, final_match_rate_percentage) rows.
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        conn (pyodbc.Connection): Database connection to commit transactions.
+        batch_size (int): Rows per executemany call.
+
+    Returns:
+        int: Number of pair rows written.
+    """
+    loaded = 0
+    try:
+        cursor.execute(CREATE_LOAD_TABLE_SQL)
+        conn.commit()
+        cursor.fast_executemany = True
+        for batch in batches:
+            for start in range(0, len(batch), batch_size):
+                rows = batch[start:start + batch_size]
+                cursor.executemany(
+                    f"INSERT INTO {MATCH_RATE_LOAD_TABLE} (user_id1, user_id2, final_match_rate_percentage) VALUES (?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+                loaded += len(rows)
+                logger.debug(f"Loaded {loaded} match rates into {MATCH_RATE_LOAD_TABLE}.")
+
+        cursor.execute(FILL_LOAD_DISPLAY_NAMES_SQL)
+        conn.commit()
+        cursor.execute(CREATE_MATCH_RATE_TABLE_SQL)
+        cursor.execute(COPY_LOAD_TABLE_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    cursor.execute(DROP_LOAD_TABLE_SQL)
+    conn.commit()
+    logger.info(f"Replaced {MATCH_RATE_TABLE} with {loaded} match rates.")
+    return loaded
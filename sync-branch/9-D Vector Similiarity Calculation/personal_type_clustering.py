@@ -0,0 +1,188 @@
+import pyodbc
+import numpy as np
+import logging
+import os
+import sys
+from collections import Counter
+from vector_store import CONNECTION_STRING, refresh_vector_store
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Clustering settings (override through .env)
+PERSONAL_TYPE_MODEL_FILE = os.getenv("PERSONAL_TYPE_MODEL_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "personal_type_model.npz"))
+CLUSTER_BATCH_SIZE = int(os.getenv("CLUSTER_BATCH_SIZE", 1024))  # Users per MiniBatchKMeans step
+CLUSTER_RANDOM_STATE = int(os.getenv("CLUSTER_RANDOM_STATE", 42))  # Fixed seed so refits are reproducible
+CLUSTER_N_INIT = 3
+
+# Session-scoped staging table for the set-based UserClusters write
+USER_CLUSTERS_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#UserClusters_Staging') IS NULL
+    CREATE TABLE #UserClusters_Staging (user_id NVARCHAR(255) NOT NULL PRIMARY KEY, personal_type NVARCHAR(255) NOT NULL);
+TRUNCATE TABLE #UserClusters_Staging;
+"""
+
+MERGE_USER_CLUSTERS_SQL = """
+MERGE UserClusters AS target
+USING #UserClusters_Staging AS source
+ON target.user_id = source.user_id
+WHEN MATCHED AND EXISTS (SELECT target.personal_type EXCEPT SELECT source.personal_type) THEN
+    UPDATE SET target.personal_type = source.personal_type
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT (user_id, personal_type) VALUES (source.user_id, source.personal_type);
+"""
+
+class PersonalTypeModel:
+    """
+    Centroids of the personal-type clusters and the personal type each one stands for.
+    Assigning a user is a nearest-centroid lookup, O(k) per user.
+    """
+
+    def __init__(self, centroids, personal_types):
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.personal_types = list(personal_types)
+
+    def nearest_clusters(self, vectors):
+        """Index of the nearest centroid for each row of `vectors`, shape (N, n) -> (N,)."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        # |v - c|^2 without the |v|^2 term, which is the same for every centroid
+        distances = (self.centroids ** 2).sum(axis=1)[None, :] - 2 * vectors @ self.centroids.T
+        return np.argmin(distances, axis=1)
+
+    def assign(self, vectors):
+        """Personal type for each row of `vectors`."""
+        return [self.personal_types[cluster] for cluster in self.nearest_clusters(vectors)]
+
+    def save(self, path=PERSONAL_TYPE_MODEL_FILE):
+        temp_path = f"{path}.tmp.npz"
+        np.savez(temp_path, centroids=self.centroids, personal_types=np.array(self.personal_types, dtype=str))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=PERSONAL_TYPE_MODEL_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["centroids"], data["personal_types"].tolist())
+
+def label_clusters(cluster_labels, current_types, personal_types):
+    """
+    Maps cluster indices to personal types so that refits keep existing labels stable.
+
+    Each cluster takes the personal type most of its members already have, greedily by
+    vote count and without reusing a type; clusters left over take the unused types in order.
+
+    Args:
+        cluster_labels (np.ndarray): Cluster index per user.
+        current_types (list): Current personal type per user, None where unassigned.
+        personal_types (list): Every personal type, one per cluster.
+
+    Returns:
+        list: Personal type per cluster index.
+    """
+    known_types = set(personal_types)
+    votes = Counter(
+        (int(cluster), personal_type) for cluster, personal_type in zip(cluster_labels, current_types)
+        if personal_type in known_types
+    )
+    mapping = {}
+    for (cluster, personal_type), _ in votes.most_common():
+        if cluster not in mapping and personal_type not in mapping.values():
+            mapping[cluster] = personal_type
+
+    remaining = [personal_type for personal_type in personal_types if personal_type not in mapping.values()]
+    for cluster in range(len(personal_types)):
+        if cluster not in mapping:
+            mapping[cluster] = remaining.pop(0)
+    return [mapping[cluster] for cluster in range(len(personal_types))]
+
+def fit_personal_type_model(vectors, current_types, personal_types):
+    """
+    Fits MiniBatchKMeans with one cluster per personal type.
+
+    Args:
+        vectors (np.ndarray): Normalized user vectors, shape (N, n).
+        current_types (list): Current personal type per user, None where unassigned.
+        personal_types (list): Every personal type.
+
+    Returns:
+        PersonalTypeModel: The fitted model.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    if not personal_types:
+        raise ValueError("Personal_Types is empty; there is nothing to cluster into.")
+    if len(vectors) < len(personal_types):
+        raise ValueError(f"Need at least {len(personal_types)} users to fit {len(personal_types)} personal types.")
+
+    kmeans = MiniBatchKMeans(
+        n_clusters=len(personal_types), batch_size=CLUSTER_BATCH_SIZE,
+        random_state=CLUSTER_RANDOM_STATE, n_init=CLUSTER_N_INIT
+    ).fit(vectors)
+    return PersonalTypeModel(kmeans.cluster_centers_, label_clusters(kmeans.labels_, current_types, personal_types))
+
+def fetch_personal_types(cursor):
+    cursor.execute("SELECT personal_type FROM Personal_Types ORDER BY personal_type")
+    return [row[0] for row in cursor.fetchall()]
+
+def fetch_current_types(cursor):
+    """Returns user_id -> personal_type for every UserClusters row."""
+    cursor.execute("SELECT user_id, personal_type FROM UserClusters")
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def write_user_clusters(assignments, cursor, conn):
+    """
+    Bulk-writes (user_id, personal_type) rows to UserClusters; only new or changed rows are written.
+
+    Returns:
+        int: Number of rows inserted or updated.
+    """
+    if not assignments:
+        return 0
+    try:
+        cursor.execute(USER_CLUSTERS_STAGING_SQL)
+        cursor.fast_executemany = True
+        cursor.executemany("INSERT INTO #UserClusters_Staging (user_id, personal_type) VALUES (?, ?)", assignments)
+        cursor.execute(MERGE_USER_CLUSTERS_SQL)
+        written = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Wrote {written} UserClusters rows.")
+    return written
+
+def run_clustering(refit=False, model_path=PERSONAL_TYPE_MODEL_FILE):
+    """
+    Assigns every user in the vector store a personal type and writes UserClusters.
+
+    The saved centroids are reused, so new users are typed without touching the rest
+    of the population. The model is fitted when `refit` is set or none is saved yet.
+
+    Returns:
+        tuple: (model, rows written).
+    """
+    store = refresh_vector_store()
+    user_ids = store.user_ids.tolist()
+    conn = pyodbc.connect(CONNECTION_STRING)
+    try:
+        cursor = conn.cursor()
+        if refit or not os.path.exists(model_path):
+            current_types = fetch_current_types(cursor)
+            model = fit_personal_type_model(
+                store.vectors, [current_types.get(user_id) for user_id in user_ids], fetch_personal_types(cursor)
+            )
+            model.save(model_path)
+            print(f"Fitted {len(model.personal_types)} personal-type clusters over {len(user_ids)} users.")
+        else:
+            model = PersonalTypeModel.load(model_path)
+
+        assignments = [(user_id, str(personal_type)) for user_id, personal_type in zip(user_ids, model.assign(store.vectors))]
+        written = write_user_clusters(assignments, cursor, conn)
+    finally:
+        conn.close()
+    print(f"Personal types assigned: {written} UserClusters rows inserted or updated.")
+    return model, written
+
+if __name__ == "__main__":
+    run_clustering(refit='--refit' in sys.argv)
@@ -0,0 +1,253 @@
+import numpy as np
+from functools import lru_cache
+
+#####################################
+# Closed-Form Radar Polygon Overlap #
+#####################################
+
+# Radar charts put every dimension on its own axis, equally spaced around 2π.
+# Sector k is the wedge between axis k and axis k+1, and inside it a polygon is
+# the triangle (origin, r_k on axis k, r_k+1 on axis k+1) with area
+# 0.5 * r_k * r_k+1 * sin(2π/n). Two radar polygons on the same axes therefore
+# intersect sector by sector, and each sector has a closed form:
+#   - if one polygon is inside the other at both axes, the overlap is the
+#     triangle of the per-axis minimum radii;
+#   - if the edges cross, the overlap is bounded by the lower edge up to the
+#     crossing point P and by the other edge after it.
+# Points in a sector are written in the (axis k, axis k+1) basis, so cross
+# products reduce to x0*y1 - x1*y0 times sin(2π/n) and no trigonometry is needed
+# per pair.
+
+# Pairs per block in all-pairs computations; each block allocates a few (rows, N, n) arrays
+PAIR_BLOCK_SIZE = 2_000_000
+
+# Radar axes of the normalized audio features, in table column order
+FEATURE_LABELS = [
+    "danceability", "energy", "loudness", "speechiness", "acousticness",
+    "instrumentalness", "liveness", "valence", "tempo"
+]
+
+# Weights that turn normalized features into the radii used for match rates
+FEATURE_WEIGHTS = np.array([0.2, 0.2, 0.1, 0.1, 0.1, 0.1, 0.1, 0.05, 0.05])
+FEATURE_WEIGHTS.setflags(write=False)
+
+
+@lru_cache(maxsize=None)
+def angle_basis(n_dims=len(FEATURE_LABELS)):
+    """
+    Radar axis geometry for `n_dims` dimensions, computed once per dimension count.
+
+    Returns:
+        tuple: (angles, closed_angles, cos, sin, sector_sine). `closed_angles` repeats the
+        first angle at the end for plotting; the arrays are read-only because they are shared.
+    """
+    angles = np.linspace(0, 2 * np.pi, n_dims, endpoint=False)
+    closed_angles = np.append(angles, angles[0])
+    cos, sin = np.cos(angles), np.sin(angles)
+    for array in (angles, closed_angles, cos, sin):
+        array.setflags(write=False)
+    return angles, closed_angles, cos, sin, np.sin(2 * np.pi / n_dims)
+
+
+def sector_sine(n_dims):
+    """sin of the angle between two neighbouring radar axes."""
+    return angle_basis(n_dims)[4]
+
+
+def close_loop(radii):
+    """Repeats the first radius at the end, shape (..., n) -> (..., n + 1), for plotting."""
+    radii = np.asarray(radii)
+    return np.concatenate([radii, radii[..., :1]], axis=-1)
+
+
+def polar_to_cartesian(radii):
+    """
+    Radar vertices in Cartesian coordinates.
+
+    Args:
+        radii (np.ndarray): Radii, shape (..., n).
+
+    Returns:
+        np.ndarray: Vertices, shape (..., n, 2).
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    _, _, cos, sin, _ = angle_basis(radii.shape[-1])
+    return np.stack((radii * cos, radii * sin), axis=-1)
+
+
+def radar_intersection_area(a, b):
+    """
+    Area of the intersection of radar polygons `a` and `b`, broadcast over leading axes.
+
+    Args:
+        a (np.ndarray): Radii, shape (..., n).
+        b (np.ndarray): Radii, shape (..., n), broadcastable against `a`.
+
+    Returns:
+        np.ndarray: Intersection areas, shape of the broadcast leading axes.
+    """
+    a0 = np.asarray(a, dtype=np.float64)
+    b0 = np.asarray(b, dtype=np.float64)
+    a1 = np.roll(a0, -1, axis=-1)
+    b1 = np.roll(b0, -1, axis=-1)
+
+    low0 = np.minimum(a0, b0)
+    low1 = np.minimum(a1, b1)
+    area = low0 * low1
+
+    # Edges cross where the order of the radii flips between the two axes
+    crossing = (a0 - b0) * (a1 - b1) < 0
+    if np.any(crossing):
+        denominator = np.where(crossing, a1 * b0 - a0 * b1, 1.0)
+        # Position of the crossing point P along edge a, and P in the (axis k, axis k+1) basis
+        t = (b0 - a0) * b1 / denominator
+        p0 = (1 - t) * a0
+        p1 = t * a1
+        # Area under the lower edge from axis k to P, then from P to axis k+1
+        crossed = low0 * p1 + p0 * low1
+        area = np.where(crossing, crossed, area)
+
+    return 0.5 * sector_sine(a0.shape[-1]) * area.sum(axis=-1)
+
+
+def radar_area(radii):
+    """
+    Area of radar polygons.
+
+    Args:
+        radii (np.ndarray): Radii, shape (..., n).
+
+    Returns:
+        np.ndarray: Areas, shape (...).
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    return 0.5 * sector_sine(radii.shape[-1]) * (radii * np.roll(radii, -1, axis=-1)).sum(axis=-1)
+
+
+def iou_from_areas(intersection, area_a, area_b):
+    """Intersection over union, 0 where both polygons are empty."""
+    union = area_a + area_b - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def iomax_from_areas(intersection, area_a, area_b):
+    """Intersection over the larger of the two areas, 0 where both polygons are empty."""
+    larger = np.maximum(area_a, area_b)
+    return np.divide(intersection, larger, out=np.zeros_like(intersection), where=larger > 0)
+
+
+# Metrics that are a function of (intersection, area_a, area_b)
+AREA_METRICS = {
+    "intersection": lambda intersection, area_a, area_b: intersection,
+    "iou": iou_from_areas,
+    "iomax": iomax_from_areas,
+}
+
+
+######################
+# All-Pairs Matrices #
+######################
+
+def _row_blocks(n_rows, n_cols, block_size=PAIR_BLOCK_SIZE):
+    rows_per_block = max(1, block_size // max(n_cols, 1))
+    for start in range(0, n_rows, rows_per_block):
+        yield start, min(start + rows_per_block, n_rows)
+
+
+def pairwise_area_metric(radii, others=None, metric="iou", block_size=PAIR_BLOCK_SIZE):
+    """
+    Area-based metric between every row of `radii` and every row of `others`.
+
+    Args:
+        radii (np.ndarray): Weighted vectors, shape (N, n).
+        others (np.ndarray): Weighted vectors, shape (M, n); defaults to `radii`.
+        metric (str): "iou", "iomax" (intersection over the larger area) or "intersection".
+        block_size (int): Pairs evaluated per NumPy call, to bound memory.
+
+    Returns:
+        np.ndarray: Metric matrix, shape (N, M).
+    """
+    combine = AREA_METRICS[metric]
+    radii = np.asarray(radii, dtype=np.float64)
+    others = radii if others is None else np.asarray(others, dtype=np.float64)
+    areas = radar_area(radii)
+    other_areas = radar_area(others)
+
+    result = np.empty((len(radii), len(others)), dtype=np.float64)
+    for start, stop in _row_blocks(len(radii), len(others), block_size):
+        intersection = radar_intersection_area(radii[start:stop, None, :], others[None, :, :])
+        result[start:stop] = combine(intersection, areas[start:stop, None], other_areas[None, :])
+    return result
+
+
+def pairwise_iou(radii, others=None, block_size=PAIR_BLOCK_SIZE):
+    """Radar-polygon IoU matrix, shape (N, M). See pairwise_area_metric."""
+    return pairwise_area_metric(radii, others, "iou", block_size)
+
+
+def pairwise_iomax(radii, others=None, block_size=PAIR_BLOCK_SIZE):
+    """Radar-polygon intersection over the larger area, shape (N, M). See pairwise_area_metric."""
+    return pairwise_area_metric(radii, others, "iomax", block_size)
+
+
+def pairwise_cosine(vectors, others=None):
+    """
+    Cosine similarity between every row of `vectors` and every row of `others`.
+
+    Returns:
+        np.ndarray: Cosine matrix, shape (N, M); 0 where either vector is all zeros.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    others = vectors if others is None else np.asarray(others, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1)
+    other_norms = np.linalg.norm(others, axis=1)
+    magnitude = norms[:, None] * other_norms[None, :]
+    return np.divide(vectors @ others.T, magnitude, out=np.zeros_like(magnitude), where=magnitude > 0)
+
+
+def top_k_iou(radii, k, block_size=PAIR_BLOCK_SIZE, metric="iou"):
+    """
+    The `k` most similar other rows for every row, by radar-polygon IoU (or another area metric).
+
+    Args:
+        radii (np.ndarray): Weighted vectors, shape (N, n).
+        k (int): Matches kept per row.
+        block_size (int): Pairs evaluated per NumPy call, to bound memory.
+        metric (str): Any key of AREA_METRICS.
+
+    Returns:
+        tuple: (indices, scores), both shape (N, min(k, N - 1)), best match first.
+    """
+    combine = AREA_METRICS[metric]
+    radii = np.asarray(radii, dtype=np.float64)
+    n_rows = len(radii)
+    k = min(k, max(n_rows - 1, 0))
+    areas = radar_area(radii)
+
+    indices = np.empty((n_rows, k), dtype=np.int64)
+    scores = np.empty((n_rows, k), dtype=np.float64)
+    for start, stop in _row_blocks(n_rows, n_rows, block_size):
+        intersection = radar_intersection_area(radii[start:stop, None, :], radii[None, :, :])
+        block = combine(intersection, areas[start:stop, None], areas[None, :])
+        # Never match a user with themselves
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+        if k == 0:
+            continue
+        candidates = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(block, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+        indices[start:stop] = np.take_along_axis(candidates, order, axis=1)
+        scores[start:stop] = np.take_along_axis(candidate_scores, order, axis=1)
+    return indices, scores
+
+
+def upper_triangle_pairs(matrix):
+    """
+    Flattens a symmetric pair matrix into its i < j entries.
+
+    Returns:
+        tuple: (i, j, values) arrays.
+    """
+    i, j = np.triu_indices(len(matrix), k=1)
+    return i, j, matrix[i, j]
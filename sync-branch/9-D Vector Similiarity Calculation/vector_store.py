@@ -0,0 +1,181 @@
+import pyodbc
+import numpy as np
+import json
+import logging
+import os
+import sys
+from similarity_kernel import FEATURE_LABELS, FEATURE_WEIGHTS
+from dotenv import load_dotenv
+
+# The similarity scripts connect with the same settings as the API jobs
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from db_pool import DB_CONNECTION_STRING as CONNECTION_STRING
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Store settings (override through .env)
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_store"))
+VECTOR_STORE_FETCH_SIZE = 10000  # Rows per fetchmany while refreshing
+
+NORMALIZED_FEATURES_QUERY = """
+SELECT
+    user_id,
+    norm_danceability,
+    norm_energy,
+    norm_loudness,
+    norm_speechiness,
+    norm_acousticness,
+    norm_instrumentalness,
+    norm_liveness,
+    norm_valence,
+    norm_tempo
+FROM NormalizedUserAudioFeatures
+ORDER BY user_id
+"""
+
+########################
+# On-Disk Vector Store #
+########################
+
+# A store directory holds manifest.json plus one pair of .npy files per version:
+# user_ids-<v>.npy (the ID index) and vectors-<v>.npy (contiguous float32, shape
+# (N, 9), row i belongs to user_ids[i]). Readers memory-map the files named by
+# the manifest, so opening the store costs no copy and no parsing. A refresh
+# that finds changes writes a new version and swaps the manifest atomically;
+# readers keep their old mapping until they reload().
+
+class VectorStore:
+    """Memory-mapped, read-only view of the normalized user feature vectors."""
+
+    def __init__(self, directory=VECTOR_STORE_DIR):
+        self.directory = directory
+        self.version = None
+        self.user_ids = np.empty(0, dtype=str)
+        self.vectors = np.empty((0, len(FEATURE_LABELS)), dtype=np.float32)
+        self._positions = None
+
+    @classmethod
+    def open(cls, directory=VECTOR_STORE_DIR):
+        """Opens a store; an empty store is returned if nothing has been written yet."""
+        store = cls(directory)
+        store.reload()
+        return store
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Maps the current version if it differs from the one in use; returns True if it changed."""
+        manifest = self._read_manifest()
+        if manifest is None or manifest["version"] == self.version:
+            return False
+        self.user_ids = np.load(os.path.join(self.directory, manifest["user_ids"]), mmap_mode="r")
+        self.vectors = np.load(os.path.join(self.directory, manifest["vectors"]), mmap_mode="r")
+        self.version = manifest["version"]
+        self._positions = None
+        return True
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self.positions
+
+    @property
+    def positions(self):
+        """user_id -> row, built on first use."""
+        if self._positions is None:
+            self._positions = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+        return self._positions
+
+    def get(self, user_id):
+        """Returns the user's vector (a view into the mapping), or None if they are not stored."""
+        row = self.positions.get(user_id)
+        return None if row is None else self.vectors[row]
+
+    def weighted(self, weights=FEATURE_WEIGHTS):
+        """Radii for the similarity kernel, as a float64 array."""
+        return self.vectors.astype(np.float64) * weights
+
+    def write(self, user_ids, vectors):
+        """Writes a new version and makes it current; older versions are deleted where possible."""
+        os.makedirs(self.directory, exist_ok=True)
+        version = (self.version or 0) + 1
+        files = {"user_ids": f"user_ids-{version}.npy", "vectors": f"vectors-{version}.npy"}
+        np.save(os.path.join(self.directory, files["user_ids"]), np.asarray(user_ids, dtype=str))
+        np.save(os.path.join(self.directory, files["vectors"]), np.ascontiguousarray(vectors, dtype=np.float32))
+
+        temp_path = f"{self.manifest_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump({"version": version, "count": len(user_ids), **files}, file)
+        os.replace(temp_path, self.manifest_path)
+        self.reload()
+
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy") and name not in files.values():
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Still mapped by a reader on a platform that locks open files
+                    pass
+
+    def refresh(self, cursor):
+        """
+        Reads NormalizedUserAudioFeatures and writes a new version only if any vector changed.
+
+        Args:
+            cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+
+        Returns:
+            tuple: (changed_user_ids, removed_user_ids); changed includes new users.
+        """
+        cursor.execute(NORMALIZED_FEATURES_QUERY)
+        user_ids = []
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(VECTOR_STORE_FETCH_SIZE)
+            if not rows:
+                break
+            user_ids.extend(row[0] for row in rows)
+            chunks.append(np.array([row[1:] for row in rows], dtype=np.float32))
+        vectors = np.concatenate(chunks) if chunks else np.empty((0, len(FEATURE_LABELS)), dtype=np.float32)
+
+        # Compare row by row against the current version
+        old_rows = np.array([self.positions.get(user_id, -1) for user_id in user_ids], dtype=np.int64)
+        known = old_rows >= 0
+        changed = ~known
+        old_vectors = self.vectors[old_rows[known]]
+        same = (old_vectors == vectors[known]) | (np.isnan(old_vectors) & np.isnan(vectors[known]))
+        changed[known] = ~np.all(same, axis=1)
+        listed = set(user_ids)
+        removed_user_ids = [user_id for user_id in self.positions if user_id not in listed]
+
+        changed_user_ids = [user_ids[row] for row in np.flatnonzero(changed)]
+        if changed_user_ids or removed_user_ids:
+            self.write(user_ids, vectors)
+            logger.info(f"Vector store version {self.version}: {len(changed_user_ids)} users changed, {len(removed_user_ids)} removed.")
+        return changed_user_ids, removed_user_ids
+
+def refresh_vector_store(directory=VECTOR_STORE_DIR):
+    """Opens the store, refreshes it from the database and returns it."""
+    store = VectorStore.open(directory)
+    conn = pyodbc.connect(CONNECTION_STRING)
+    try:
+        store.refresh(conn.cursor())
+    finally:
+        conn.close()
+    return store
+
+if __name__ == "__main__":
+    store = refresh_vector_store()
+    print(f"Vector store version {store.version} holds {len(store)} users.")
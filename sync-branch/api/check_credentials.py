@@ -1,4 +1,3 @@
-import requests
 import base64
 import time
 import json
@@ -8,6 +7,8 @@ from dotenv import load_dotenv
 import os
 import logging
 from cmd_gui_kit import CmdGUI  # Import CmdGUI for visual feedback
+from http_session import http_get, http_post
+from credential_registry import atomic_write_json
 
 # Initialize CmdGUI
 gui = CmdGUI()
@@ -70,7 +71,7 @@ def get_access_token(client_id, client_secret, gui):
     gui.spinner(duration=2, message="Requesting access token...")
     logger.debug("Requesting access token.")
 
-    response = requests.post(token_url, data=token_data, headers=token_headers)
+    response = http_post(token_url, data=token_data, headers=token_headers)
     if response.status_code == 200:
         logger.info("Access token successfully retrieved.")
         return response.json()["access_token"]
@@ -91,7 +92,7 @@ def check_api_status(access_token, commands, max_retries=1, gui=None):
         retries = 0
         while retries < max_retries:
             test_url = url.replace("{track_id}", TRACK_ID) if "{track_id}" in url else url
-            response = requests.get(test_url, headers=headers)
+            response = http_get(test_url, headers=headers)
 
             if response.status_code == 200:
                 status_results[command] = "Active"
@@ -139,9 +140,8 @@ def check_credentials_status(credentials=CREDENTIALS, commands=formatted_api_com
         gui.log(f"\n{table}", level="info")
         logger.info(f"API status table: \n{table}")
 
-    with open(output_file, "w") as f:
-        json.dump(json_output, f, indent=4)
-        logger.info(f"API status results saved to {output_file}.")
+    atomic_write_json(output_file, json_output)
+    logger.info(f"API status results saved to {output_file}.")
 
 def main():
     logger.info("Starting credential check process.")
@@ -0,0 +1,183 @@
+import json
+import os
+import time
+import atexit
+import tempfile
+import logging
+from datetime import datetime, timezone
+from threading import RLock
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Seconds between automatic write-backs of the in-memory status table
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", 30))
+
+RATE_LIMITED = "Rate-Limited"
+RETRY_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def atomic_write_json(path, data):
+    """
+    Writes JSON to a temporary file next to `path` and swaps it in with os.replace,
+    so concurrent readers never see a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def parse_rate_limit_expiry(status):
+    """
+    Converts a status string into a rate-limit expiry timestamp.
+
+    Args:
+        status (str): A status such as "Active", "Rate-Limited" or "Rate-Limited; Retry at 2024-01-01 10:00:00".
+
+    Returns:
+        float or None: Epoch seconds until which the key is limited, inf if no retry time
+        is known, or None if the status is not a rate limit.
+    """
+    if not isinstance(status, str) or not status.startswith(RATE_LIMITED):
+        return None
+    _, _, retry_at = status.partition("Retry at")
+    retry_at = retry_at.strip()
+    if not retry_at:
+        return float("inf")
+    try:
+        return datetime.strptime(retry_at, RETRY_AT_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return float("inf")
+
+class CredentialStatusRegistry:
+    """
+    In-process table of API key statuses keyed by (client_id, request_type).
+
+    The status file is read once and then served from memory. Changes are kept
+    in memory and written back atomically, either every STATUS_FLUSH_INTERVAL
+    seconds or on flush()/process exit. Only the clients this process changed
+    are merged into the file, so entries written by other scripts are kept.
+    """
+
+    def __init__(self, path, flush_interval=STATUS_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = RLock()
+        self._status = {}  # client_id -> {request_type: status}
+        self._limited_until = {}  # (client_id, request_type) -> epoch seconds
+        self._dirty = set()
+        self._loaded = False
+        self._last_flush = time.time()
+        atexit.register(self.flush)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def load(self):
+        """(Re)loads the status table from disk, discarding unsaved changes."""
+        with self._lock:
+            self._status.clear()
+            self._limited_until.clear()
+            self._dirty.clear()
+            self._loaded = True
+            try:
+                with open(self.path, "r") as f:
+                    status_data = json.load(f)
+            except FileNotFoundError:
+                logger.warning(f"Status file {self.path} not found. Starting with an empty status table.")
+                return
+            except json.JSONDecodeError:
+                logger.error(f"Failed to decode JSON from {self.path}. Starting with an empty status table.")
+                return
+
+            for entry in status_data:
+                self._set(entry["Client ID"], entry.get("Status", {}))
+
+    def _set(self, client_id, status_dict):
+        self._status[client_id] = dict(status_dict)
+        for key in [key for key in self._limited_until if key[0] == client_id]:
+            del self._limited_until[key]
+        for request_type, status in status_dict.items():
+            expiry = parse_rate_limit_expiry(status)
+            if expiry is not None:
+                self._limited_until[(client_id, request_type)] = expiry
+
+    def get_status(self, client_id, request_type):
+        with self._lock:
+            self._ensure_loaded()
+            return self._status.get(client_id, {}).get(request_type)
+
+    def is_rate_limited(self, client_id, request_type):
+        """O(1) check whether a key is currently rate-limited for a request type."""
+        with self._lock:
+            self._ensure_loaded()
+            expiry = self._limited_until.get((client_id, request_type))
+        return expiry is not None and expiry > time.time()
+
+    def active_clients(self, request_type):
+        """Returns the client IDs marked 'Active' for a request type, in file order."""
+        with self._lock:
+            self._ensure_loaded()
+            return [
+                client_id for client_id, statuses in self._status.items()
+                if statuses.get(request_type) == "Active" and not self.is_rate_limited(client_id, request_type)
+            ]
+
+    def set_client_status(self, client_id, status_dict):
+        """Replaces every status of a client and schedules a write-back."""
+        with self._lock:
+            self._ensure_loaded()
+            self._set(client_id, status_dict)
+            self._dirty.add(client_id)
+        self._maybe_flush()
+
+    def mark_rate_limited(self, client_id, request_type, retry_after):
+        """Marks a single (client_id, request_type) as limited for `retry_after` seconds."""
+        retry_time = datetime.fromtimestamp(time.time() + retry_after, tz=timezone.utc).strftime(RETRY_AT_FORMAT)
+        with self._lock:
+            self._ensure_loaded()
+            statuses = self._status.setdefault(client_id, {})
+            statuses[request_type] = f"{RATE_LIMITED}; Retry at {retry_time}"
+            self._limited_until[(client_id, request_type)] = time.time() + retry_after
+            self._dirty.add(client_id)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Atomically merges this process's changes into the status file."""
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                with open(self.path, "r") as f:
+                    status_data = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                status_data = []
+
+            pending = set(self._dirty)
+            for entry in status_data:
+                if entry["Client ID"] in pending:
+                    entry["Status"] = self._status[entry["Client ID"]]
+                    pending.discard(entry["Client ID"])
+            for client_id in pending:
+                status_data.append({"Client ID": client_id, "Status": self._status[client_id]})
+
+            try:
+                atomic_write_json(self.path, status_data)
+            except OSError as e:
+                logger.error(f"Failed to write status file {self.path}: {e}")
+                return
+            self._dirty.clear()
+            self._last_flush = time.time()
+            logger.debug(f"Flushed credential statuses to {self.path}.")
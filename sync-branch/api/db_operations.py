@@ -227,22 +227,25 @@ def check_and_insert_playlist(playlist, user_id, cursor, conn, debug_mode=DEBUG_
             gui.status(f"Database error for user {user_id}: {db_err}",status="error")
             logger.error(f"Database error for user {user_id}: {db_err}")
                     
-def fetch_and_insert_audio_features(track_ids, headers, cursor, conn, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+INSERT_AUDIO_FEATURES_SQL = """
+INSERT INTO Audio_Features (track_id, acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, valence, tempo, track_key, mode, time_signature)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def fetch_audio_features_batch(track_ids, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     """
-    Fetches audio features for up to 100 track IDs in one request and inserts them into the database.
+    Fetches audio features for up to 100 track IDs in one request.
+    Safe to call from several threads; make_request spreads the calls over the credential scheduler.
 
     Args:
         track_ids (list): List of track IDs to fetch audio features for.
-        headers (dict): Authorization headers for Spotify API.
-        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
-        conn (pyodbc.Connection): Database connection to commit transactions.
-        debug_mode (bool): If True, print debug information.
+
+    Returns:
+        list or None: One entry per requested ID (None where Spotify has no features),
+        or None if the request failed.
     """
     if not track_ids:
-        if debug_mode:
-            gui.log("No track IDs to process.", level="info")
-            logger.info("No track IDs to process.")
-        return  # No track IDs to process
+        return []
 
     # Make a request for audio features in bulk (up to 100 track IDs)
     track_ids_string = ",".join(track_ids)
@@ -262,26 +265,7 @@ def fetch_and_insert_audio_features(track_ids, headers, cursor, conn, debug_mode
             if debug_mode:
                 gui.log(f"Received audio features for {len(audio_features_list)} tracks.", level="info")
                 logger.info(f"Received audio features for {len(audio_features_list)} tracks.")
-
-            for audio_features_data in audio_features_list:
-                if audio_features_data:  # Ensure data is not None
-                    track_id = audio_features_data.get("id")
-                    if debug_mode:
-                        gui.log(f"Inserting audio features for track ID: {track_id}", level="info")
-                        logger.info(f"Inserting audio features for track ID: {track_id}")
-                    cursor.execute("""
-                    INSERT INTO Audio_Features (track_id, acousticness, danceability, energy, instrumentalness, liveness, loudness, speechiness, valence, tempo, track_key, mode, time_signature)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, track_id, audio_features_data.get("acousticness"), audio_features_data.get("danceability"),
-                    audio_features_data.get("energy"), audio_features_data.get("instrumentalness"),
-                    audio_features_data.get("liveness"), audio_features_data.get("loudness"),
-                    audio_features_data.get("speechiness"), audio_features_data.get("valence"),
-                    audio_features_data.get("tempo"), audio_features_data.get("key"),
-                    audio_features_data.get("mode"), audio_features_data.get("time_signature"))
-            conn.commit()
-            if debug_mode:
-                gui.log(f"Committed audio features for batch of {len(track_ids)} tracks.", level="info")
-                logger.info(f"Committed audio features for batch of {len(track_ids)} tracks.")
+            return audio_features_list
         else:
             if debug_mode or error_mode:
                 gui.status(f"Failed to fetch audio features. Status Code: {response.status_code}", status="error")
@@ -292,69 +276,240 @@ def fetch_and_insert_audio_features(track_ids, headers, cursor, conn, debug_mode
         if debug_mode or error_mode:
             gui.status("No response received for the request.", status="error")
             logger.error("No response received for the request.")
+    return None
 
-def check_and_insert_track(track_item, playlist_id, headers, cursor, conn, track_buffer, max_buffer_size=100, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
-    if not track_item or 'track' not in track_item or track_item['track'] is None:
-        if debug_mode or warning_mode:
-            gui.log("Track data is None or unavailable, skipping this track.", level="warn")
-            logger.info("Track data is None or unavailable, skipping this track.")
-        return  # Skip if the track data is invalid
+def insert_audio_features(audio_features_list, cursor, conn, debug_mode=DEBUG_MODE):
+    """
+    Bulk-inserts audio feature objects with fast_executemany and commits once.
 
-    track_info = track_item["track"]
-    track_id = track_info.get("id")
-    album_info = track_info.get("album", {})
-    album_id = album_info.get("id")
+    Args:
+        audio_features_list (list): Audio feature objects; None entries are skipped.
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        conn (pyodbc.Connection): Database connection to commit transactions.
 
-    if not track_id:
-        if debug_mode or warning_mode:
-            gui.log("Track ID is missing, skipping.", level="warn")
-            logger.info("Track ID is missing, skipping.")
-        return  # Skip tracks with no valid ID
+    Returns:
+        int: Number of rows inserted.
+    """
+    rows = [
+        (audio_features_data.get("id"), audio_features_data.get("acousticness"), audio_features_data.get("danceability"),
+         audio_features_data.get("energy"), audio_features_data.get("instrumentalness"),
+         audio_features_data.get("liveness"), audio_features_data.get("loudness"),
+         audio_features_data.get("speechiness"), audio_features_data.get("valence"),
+         audio_features_data.get("tempo"), audio_features_data.get("key"),
+         audio_features_data.get("mode"), audio_features_data.get("time_signature"))
+        for audio_features_data in audio_features_list
+        if audio_features_data  # Ensure data is not None
+    ]
+    if rows:
+        cursor.fast_executemany = True
+        cursor.executemany(INSERT_AUDIO_FEATURES_SQL, rows)
+    conn.commit()
+    if debug_mode:
+        gui.log(f"Committed audio features for batch of {len(rows)} tracks.", level="info")
+        logger.info(f"Committed audio features for batch of {len(rows)} tracks.")
+    return len(rows)
 
-    if not album_id:
+def fetch_and_insert_audio_features(track_ids, headers, cursor, conn, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    """
+    Fetches audio features for up to 100 track IDs in one request and inserts them into the database.
+
+    Args:
+        track_ids (list): List of track IDs to fetch audio features for.
+        headers (dict): Authorization headers for Spotify API.
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        conn (pyodbc.Connection): Database connection to commit transactions.
+        debug_mode (bool): If True, print debug information.
+    """
+    if not track_ids:
+        if debug_mode:
+            gui.log("No track IDs to process.", level="info")
+            logger.info("No track IDs to process.")
+        return  # No track IDs to process
+
+    audio_features_list = fetch_audio_features_batch(track_ids, debug_mode, warning_mode, error_mode)
+    if audio_features_list is not None:
+        insert_audio_features(audio_features_list, cursor, conn, debug_mode)
+
+# Rows buffered by TrackBatchWriter before a batch is flushed
+TRACK_BATCH_SIZE = int(os.getenv("TRACK_BATCH_SIZE", 500))
+
+# Session-scoped staging tables used by TrackBatchWriter
+STAGING_TABLES_SQL = """
+IF OBJECT_ID('tempdb..#Albums_Staging') IS NULL
+    CREATE TABLE #Albums_Staging (
+        album_id NVARCHAR(64) NOT NULL, name NVARCHAR(512) NULL, release_date DATE NULL,
+        total_tracks INT NULL, album_type NVARCHAR(32) NULL, album_href NVARCHAR(512) NULL, uri NVARCHAR(128) NULL
+    );
+IF OBJECT_ID('tempdb..#Tracks_Staging') IS NULL
+    CREATE TABLE #Tracks_Staging (
+        track_id NVARCHAR(64) NOT NULL, name NVARCHAR(512) NULL, album_id NVARCHAR(64) NOT NULL,
+        duration_ms INT NULL, explicit BIT NULL, popularity INT NULL, preview_url NVARCHAR(1024) NULL,
+        track_href NVARCHAR(512) NULL, uri NVARCHAR(128) NULL
+    );
+IF OBJECT_ID('tempdb..#Playlist_Tracks_Staging') IS NULL
+    CREATE TABLE #Playlist_Tracks_Staging (
+        playlist_id NVARCHAR(64) NOT NULL, track_id NVARCHAR(64) NOT NULL, added_at NVARCHAR(40) NULL
+    );
+"""
+
+MERGE_ALBUMS_SQL = """
+MERGE Albums WITH (HOLDLOCK) AS target
+USING #Albums_Staging AS source
+ON target.album_id = source.album_id
+WHEN NOT MATCHED THEN
+    INSERT (album_id, name, release_date, total_tracks, album_type, album_href, uri)
+    VALUES (source.album_id, source.name, source.release_date, source.total_tracks, source.album_type, source.album_href, source.uri);
+"""
+
+MERGE_TRACKS_SQL = """
+MERGE Tracks WITH (HOLDLOCK) AS target
+USING #Tracks_Staging AS source
+ON target.track_id = source.track_id
+WHEN NOT MATCHED THEN
+    INSERT (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
+    VALUES (source.track_id, source.name, source.album_id, source.duration_ms, source.explicit, source.popularity, source.preview_url, source.track_href, source.uri);
+"""
+
+MERGE_PLAYLIST_TRACKS_SQL = """
+MERGE Playlist_Tracks WITH (HOLDLOCK) AS target
+USING #Playlist_Tracks_Staging AS source
+ON target.playlist_id = source.playlist_id AND target.track_id = source.track_id
+WHEN NOT MATCHED THEN
+    INSERT (playlist_id, track_id, added_at)
+    VALUES (source.playlist_id, source.track_id, source.added_at);
+"""
+
+def parse_release_date(release_date, album_id=None, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE):
+    """Parses a Spotify release date ('2020', '2020-05' or '2020-05-17') into 'YYYY-MM-DD', or None."""
+    if not release_date:
+        return None
+    try:
+        return parser.parse(release_date).strftime('%Y-%m-%d')
+    except ValueError:
         if debug_mode or warning_mode:
-            gui.log(f"Skipping track {track_id} due to missing album_id.", level="warn")
-            logger.info(f"Skipping track {track_id} due to missing album_id.")
-        return  # Skip this track if album_id is missing
-
-    # Insert album into Albums table if not exists
-    cursor.execute("SELECT 1 FROM Albums WHERE album_id = ?", (album_id,))
-    if cursor.fetchone() is None:
-        release_date = album_info.get("release_date", None)
-        parsed_date = None
-        if release_date:
-            try:
-                parsed_date = parser.parse(release_date).strftime('%Y-%m-%d')
-            except ValueError:
-                if debug_mode or warning_mode:
-                    gui.log(f"Invalid release date format for album {album_id}.", level="warn")
-                    logger.info(f"Invalid release date format for album {album_id}.")
-        
-        cursor.execute("""
-        INSERT INTO Albums (album_id, name, release_date, total_tracks, album_type, album_href, uri)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, album_id, album_info.get("name"), parsed_date,
-        album_info.get("total_tracks", 0), album_info.get("album_type", ""),
-        album_info.get("href", ""), album_info.get("uri", ""))
-        conn.commit()  # Commit the album insertion to ensure it is visible
-
-    # Insert track into Tracks table if not exists
-    cursor.execute("SELECT 1 FROM Tracks WHERE track_id = ?", (track_id,))
-    if cursor.fetchone() is None:
-        cursor.execute("""
-        INSERT INTO Tracks (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, track_id, track_info.get("name"), album_id,
-        track_info.get("duration_ms"), int(track_info.get("explicit", 0)),
-        track_info.get("popularity", 0), track_info.get("preview_url"),
-        track_info.get("href"), track_info.get("uri"))
-        conn.commit()  # Commit the track insertion
-
-    # Associate playlist with track in Playlist_Tracks table using provided playlist_id
-    cursor.execute("SELECT 1 FROM Playlist_Tracks WHERE playlist_id = ? AND track_id = ?", (playlist_id, track_id))
-    if cursor.fetchone() is None:
-        cursor.execute("""
-        INSERT INTO Playlist_Tracks (playlist_id, track_id, added_at)
-        VALUES (?, ?, ?)
-        """, playlist_id, track_id, track_item["added_at"])
-        conn.commit()  # Commit the association
\ No newline at end of file
+            gui.log(f"Invalid release date format for album {album_id}.", level="warn")
+            logger.info(f"Invalid release date format for album {album_id}.")
+        return None
+
+class TrackBatchWriter:
+    """
+    Set-based writer for the albums, tracks and playlist links of playlist tracks.
+
+    Albums, tracks and playlist links are collected in memory. Every
+    `batch_size` tracks they are bulk-loaded with fast_executemany into
+    session temp tables, merged into Albums, Tracks and Playlist_Tracks with
+    one MERGE per table, and committed once. Use it as a context manager so
+    the last partial batch is flushed.
+    """
+
+    def __init__(self, cursor, conn, batch_size=TRACK_BATCH_SIZE, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+        self.cursor = cursor
+        self.conn = conn
+        self.batch_size = batch_size
+        self.debug_mode = debug_mode
+        self.warning_mode = warning_mode
+        self.error_mode = error_mode
+        self.albums = {}  # album_id -> row
+        self.tracks = {}  # track_id -> row
+        self.links = {}  # (playlist_id, track_id) -> row
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def add(self, track_item, playlist_id):
+        """
+        Buffers one playlist track item. Flushes automatically when the batch is full.
+
+        Args:
+            track_item (dict): A playlist track item from the Spotify API.
+            playlist_id (str): Playlist the track belongs to.
+
+        Returns:
+            str or None: The buffered track ID, or None if the item was skipped.
+        """
+        if not track_item or track_item.get("track") is None:
+            if self.debug_mode or self.warning_mode:
+                gui.log("Track data is None or unavailable, skipping this track.", level="warn")
+                logger.info("Track data is None or unavailable, skipping this track.")
+            return None
+
+        track_info = track_item["track"]
+        track_id = track_info.get("id")
+        album_info = track_info.get("album") or {}
+        album_id = album_info.get("id")
+
+        if not track_id:
+            if self.debug_mode or self.warning_mode:
+                gui.log("Track ID is missing, skipping.", level="warn")
+                logger.info("Track ID is missing, skipping.")
+            return None
+
+        if not album_id:
+            if self.debug_mode or self.warning_mode:
+                gui.log(f"Skipping track {track_id} due to missing album_id.", level="warn")
+                logger.info(f"Skipping track {track_id} due to missing album_id.")
+            return None
+
+        if album_id not in self.albums:
+            self.albums[album_id] = (
+                album_id, album_info.get("name"),
+                parse_release_date(album_info.get("release_date"), album_id, self.debug_mode, self.warning_mode),
+                album_info.get("total_tracks", 0), album_info.get("album_type", ""),
+                album_info.get("href", ""), album_info.get("uri", "")
+            )
+        if track_id not in self.tracks:
+            self.tracks[track_id] = (
+                track_id, track_info.get("name"), album_id,
+                track_info.get("duration_ms"), int(track_info.get("explicit", 0)),
+                track_info.get("popularity", 0), track_info.get("preview_url"),
+                track_info.get("href"), track_info.get("uri")
+            )
+        self.links.setdefault((playlist_id, track_id), (playlist_id, track_id, track_item.get("added_at")))
+
+        if len(self.tracks) >= self.batch_size:
+            self.flush()
+        return track_id
+
+    def flush(self):
+        """Writes every buffered row with one MERGE per table and a single commit."""
+        if not (self.albums or self.tracks or self.links):
+            return
+
+        previous_fast_executemany = self.cursor.fast_executemany
+        try:
+            self.cursor.execute(STAGING_TABLES_SQL)
+            self.cursor.execute("TRUNCATE TABLE #Albums_Staging; TRUNCATE TABLE #Tracks_Staging; TRUNCATE TABLE #Playlist_Tracks_Staging;")
+            self.cursor.fast_executemany = True
+
+            if self.albums:
+                self.cursor.executemany("INSERT INTO #Albums_Staging VALUES (?, ?, ?, ?, ?, ?, ?)", list(self.albums.values()))
+            if self.tracks:
+                self.cursor.executemany("INSERT INTO #Tracks_Staging VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", list(self.tracks.values()))
+            if self.links:
+                self.cursor.executemany("INSERT INTO #Playlist_Tracks_Staging VALUES (?, ?, ?)", list(self.links.values()))
+
+            # Parents first so the foreign keys of Tracks and Playlist_Tracks are satisfied
+            self.cursor.execute(MERGE_ALBUMS_SQL)
+            self.cursor.execute(MERGE_TRACKS_SQL)
+            self.cursor.execute(MERGE_PLAYLIST_TRACKS_SQL)
+            self.conn.commit()
+
+            if self.debug_mode:
+                gui.log(f"Flushed {len(self.albums)} albums, {len(self.tracks)} tracks and {len(self.links)} playlist links.", level="info")
+                logger.info(f"Flushed {len(self.albums)} albums, {len(self.tracks)} tracks and {len(self.links)} playlist links.")
+        except pyodbc.Error as db_err:
+            self.conn.rollback()
+            if self.debug_mode or self.error_mode:
+                gui.status(f"Batch write failed: {db_err}", status="error")
+                logger.error(f"Batch write failed: {db_err}")
+            raise
+        finally:
+            self.cursor.fast_executemany = previous_fast_executemany
+            self.albums.clear()
+            self.tracks.clear()
+            self.links.clear()
@@ -0,0 +1,168 @@
+import pyodbc
+import time
+import atexit
+import logging
+import os
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import Lock, BoundedSemaphore
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Database connection details
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT")
+DB_NAME = os.getenv("DB_NAME")
+DB_USER = os.getenv("DB_USER")
+DB_PASSWORD = os.getenv("DB_PASSWORD")
+
+DB_CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
+
+# Pool settings (override through .env)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))  # Maximum open connections per process
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # Seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv("DB_POOL_HEALTHCHECK_AFTER", 60))  # Idle seconds before a connection is pinged
+
+class ConnectionPool:
+    """
+    Bounded pool of pyodbc connections.
+
+    At most `max_size` connections are open at once; checkout blocks up to
+    `timeout` seconds for one to be returned. Connections that sat idle longer
+    than `healthcheck_after` are pinged with SELECT 1 before being handed out,
+    and replaced if the ping fails. A connection is only ever used by the
+    thread that checked it out.
+    """
+
+    def __init__(self, connection_string=DB_CONNECTION_STRING, max_size=DB_POOL_SIZE,
+                 timeout=DB_POOL_TIMEOUT, healthcheck_after=DB_POOL_HEALTHCHECK_AFTER):
+        self.connection_string = connection_string
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_after = healthcheck_after
+        self._idle = LifoQueue()  # (conn, last_used); LIFO keeps the warmest connections in use
+        self._slots = BoundedSemaphore(max_size)
+        self._closed = False
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pyodbc.Error:
+            pass
+
+    def checkout(self):
+        """
+        Takes a connection from the pool, opening a new one if none is idle.
+
+        Returns:
+            pyodbc.Connection: A connection that must be handed back with release().
+
+        Raises:
+            TimeoutError: If every connection stays checked out for `timeout` seconds.
+        """
+        if self._closed:
+            raise RuntimeError("Connection pool is closed.")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No database connection became available within {self.timeout} seconds.")
+
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except Empty:
+                    return pyodbc.connect(self.connection_string)
+                if time.monotonic() - last_used < self.healthcheck_after or self._is_healthy(conn):
+                    return conn
+                logger.warning("Discarding a stale database connection from the pool.")
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        """
+        Returns a connection to the pool. Uncommitted work is rolled back; a
+        connection that cannot be rolled back, or is flagged `broken`, is closed.
+        """
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+                return
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                self._discard(conn)
+                return
+            self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context-managed checkout: `with pool.connection() as conn:`."""
+        conn = self.checkout()
+        broken = False
+        try:
+            yield conn
+        except pyodbc.OperationalError:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    def close(self):
+        """Closes every idle connection; connections still checked out are closed on release."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
+
+# SQL Server error numbers for primary key and unique index violations
+DUPLICATE_KEY_ERRORS = ("(2627)", "(2601)")
+
+def is_duplicate_key(error):
+    """True if a pyodbc.IntegrityError is a duplicate key, not a foreign key or NOT NULL violation."""
+    return len(error.args) > 1 and any(code in str(error.args[1]) for code in DUPLICATE_KEY_ERRORS)
+
+_pool = None
+_pool_lock = Lock()
+
+def get_pool():
+    """Returns the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+                logger.debug(f"Database connection pool created (size={DB_POOL_SIZE}).")
+    return _pool
+
+def get_connection():
+    """Shorthand for get_pool().connection()."""
+    return get_pool().connection()
+
+def close_pool():
+    """Closes the shared pool and its idle connections."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+atexit.register(close_pool)
@@ -57,18 +57,9 @@ def fetch_and_insert_playlist_images(playlist_id, cursor, conn, debug_mode=DEBUG
         error_mode (bool): If True, enable error logs.
     """
     try:
-        # Fetch playlist details
-        playlist_url = f"https://api.spotify.com/v1/playlists/{playlist_id}"
-        gui.spinner(duration=1, message=f"Fetching image for playlist ID: {playlist_id}")
-        response = make_request(playlist_url, "Get Playlist")
-
-        if response and response.status_code == 200:
-            playlist_data = response.json()
-            images = playlist_data.get("images", [])
-
-            # Extract the first URL or set to None if no images are available
-            first_image_url = images[0]["url"] if images else None
+        found, first_image_url = fetch_playlist_image_url(playlist_id, debug_mode, warning_mode, error_mode)
 
+        if found:
             if debug_mode:
                 if first_image_url:
                     gui.log(f"Fetched image URL for playlist {playlist_id}: {first_image_url}", level="info")
@@ -77,20 +68,83 @@ def fetch_and_insert_playlist_images(playlist_id, cursor, conn, debug_mode=DEBUG
                     gui.log(f"No image found for playlist {playlist_id}.", level="warn")
                     logger.info(f"No image found for playlist {playlist_id}.")
 
-            # Store the first image URL in the database
-            cursor.execute("UPDATE Playlists SET images = ? WHERE playlist_id = ?", first_image_url, playlist_id)
+            # Store the first image URL in the database, skipping the write if it is unchanged
+            cursor.execute(
+                "UPDATE Playlists SET images = ? WHERE playlist_id = ? AND EXISTS (SELECT images EXCEPT SELECT ?)",
+                first_image_url, playlist_id, first_image_url
+            )
             conn.commit()
             gui.status(f"Image for playlist {playlist_id} successfully updated in the database.", status="success")
             logger.info(f"Image for playlist {playlist_id} successfully updated in the database.")
-        else:
-            if error_mode:
-                gui.status(
-                logger.info(
-                    f"Failed to fetch images for playlist {playlist_id}. "
-                    f"Status: {response.status_code if response else 'No response'}"
-                ))
 
     except Exception as e:
         if error_mode:
             gui.status(f"An unexpected error occurred while processing playlist {playlist_id}: {e}", status="error")
             logger.error(f"An unexpected error occurred while processing playlist {playlist_id}: {e}")
+
+# Session-scoped staging table for set-based image updates
+PLAYLIST_IMAGES_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#Playlist_Images_Staging') IS NULL
+    CREATE TABLE #Playlist_Images_Staging (playlist_id NVARCHAR(64) NOT NULL PRIMARY KEY, images NVARCHAR(1024) NULL);
+TRUNCATE TABLE #Playlist_Images_Staging;
+"""
+
+# Only rows whose URL actually changed are written; EXCEPT compares NULLs as equal
+UPDATE_PLAYLIST_IMAGES_SQL = """
+UPDATE p SET p.images = s.images
+FROM Playlists p
+JOIN #Playlist_Images_Staging s ON s.playlist_id = p.playlist_id
+WHERE EXISTS (SELECT p.images EXCEPT SELECT s.images)
+"""
+
+def fetch_playlist_image_url(playlist_id, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    """
+    Fetches the first image URL of a playlist from the lightweight /playlists/{id}/images endpoint.
+    Safe to call from several threads.
+
+    Returns:
+        tuple: (found, image_url). `found` is False if the request failed; image_url is
+        None if the playlist has no images.
+    """
+    try:
+        response = make_request(f"https://api.spotify.com/v1/playlists/{playlist_id}/images", "Get Playlist Cover Image")
+    except Exception as e:
+        if debug_mode or error_mode:
+            gui.status(f"Failed to fetch images for playlist {playlist_id}: {e}", status="error")
+            logger.error(f"Failed to fetch images for playlist {playlist_id}: {e}")
+        return False, None
+
+    if response is None or response.status_code != 200:
+        if debug_mode or warning_mode:
+            gui.log(f"Failed to fetch images for playlist {playlist_id}.", level="warn")
+            logger.info(f"Failed to fetch images for playlist {playlist_id}.")
+        return False, None
+
+    images = response.json() or []
+    return True, images[0]["url"] if images else None
+
+def apply_playlist_images(playlist_images, cursor, conn):
+    """
+    Writes fetched image URLs with one staged, set-based UPDATE.
+
+    Args:
+        playlist_images (dict): playlist_id -> image URL (or None).
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        conn (pyodbc.Connection): Database connection to commit transactions.
+
+    Returns:
+        int: Number of playlists whose image changed.
+    """
+    if not playlist_images:
+        return 0
+    try:
+        cursor.execute(PLAYLIST_IMAGES_STAGING_SQL)
+        cursor.fast_executemany = True
+        cursor.executemany("INSERT INTO #Playlist_Images_Staging (playlist_id, images) VALUES (?, ?)", list(playlist_images.items()))
+        cursor.execute(UPDATE_PLAYLIST_IMAGES_SQL)
+        updated = cursor.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return updated
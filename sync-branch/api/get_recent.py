@@ -1,12 +1,19 @@
-import requests
 import pyodbc
-from datetime import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import json
 import base64
 from dotenv import load_dotenv
 import os
 import sys
 from cmd_gui_kit import CmdGUI
+from http_session import http_get, http_post
+from credential_registry import atomic_write_json
+from id_cache import KnownIdIndex
+from db_pool import get_connection, is_duplicate_key, DB_POOL_SIZE
 import logging
 
 
@@ -54,13 +61,96 @@ DEBUG_MODE = os.getenv("DEBUG_MODE")
 if DEBUG_MODE == "True":
     DEBUG_MODE = True
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-DB_CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
+# Number of users processed concurrently
+RECENT_WORKERS = int(os.getenv("RECENT_WORKERS", 8))
+
+# Last stored played_at per user, sent as the `after` cursor (override through .env)
+RECENT_WATERMARK_FILE = os.getenv("RECENT_WATERMARK_FILE", "recent_watermarks.json")
+PLAYED_AT_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+@contextmanager
+def _connection(conn=None):
+    """Yields the given connection, or one checked out of the shared pool."""
+    if conn is not None:
+        yield conn
+        return
+    with get_connection() as conn:
+        yield conn
+
+# Process-local existence caches; most recently played tracks are repeats
+known_users = KnownIdIndex("Users", "user_id")
+known_albums = KnownIdIndex("Albums", "album_id")
+known_tracks = KnownIdIndex("Tracks", "track_id")
+
+def warm_known_ids():
+    """
+    Seeds the existence caches from the database once per process. Later cycles
+    skip the table scans; IDs inserted or confirmed since are added as they happen.
+    """
+    cold = [index for index in (known_users, known_albums, known_tracks) if not index.warmed]
+    if not cold:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for index in cold:
+                index.warm(cursor)
+        finally:
+            cursor.close()
+
+# Per-user high-water marks (Unix milliseconds of the newest stored play)
+_watermarks = {}
+_watermarks_lock = threading.Lock()
+
+def to_unix_ms(played_at):
+    """Converts a naive UTC datetime into the millisecond cursor the API expects."""
+    return int(played_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def load_watermarks():
+    """
+    Loads the watermarks from RECENT_WATERMARK_FILE. Users missing from the file
+    are seeded from MAX(listened_at) in user_recent_tracks, so the first
+    incremental run does not re-fetch plays that are already stored.
+    """
+    try:
+        with open(RECENT_WATERMARK_FILE, "r") as f:
+            watermarks = {user_id: int(value) for user_id, value in json.load(f).items()}
+    except FileNotFoundError:
+        watermarks = {}
+    except (json.JSONDecodeError, ValueError, AttributeError):
+        logger.error(f"Failed to decode {RECENT_WATERMARK_FILE}. Falling back to the database.")
+        watermarks = {}
+
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT user_id, MAX(listened_at) FROM user_recent_tracks GROUP BY user_id")
+            for user_id, last_played in cursor.fetchall():
+                if user_id not in watermarks and last_played is not None:
+                    watermarks[user_id] = to_unix_ms(last_played)
+        finally:
+            cursor.close()
+
+    with _watermarks_lock:
+        _watermarks.clear()
+        _watermarks.update(watermarks)
+
+def get_watermark(user_id):
+    with _watermarks_lock:
+        return _watermarks.get(user_id)
+
+def advance_watermark(user_id, played_at_ms):
+    with _watermarks_lock:
+        if played_at_ms > _watermarks.get(user_id, 0):
+            _watermarks[user_id] = played_at_ms
+
+def save_watermarks():
+    with _watermarks_lock:
+        snapshot = dict(_watermarks)
+    try:
+        atomic_write_json(RECENT_WATERMARK_FILE, snapshot)
+    except OSError as e:
+        logger.error(f"Failed to write {RECENT_WATERMARK_FILE}: {e}")
 
 # Function to read the latest access token from auth_tokens.json
 def get_all_tokens_with_user_ids():
@@ -79,7 +169,7 @@ def get_all_tokens_with_user_ids():
 def is_token_valid(access_token):
     url = "https://api.spotify.com/v1/me"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers)
 
     # If the token is valid, the status code should be 200
     if response.status_code == 200:
@@ -105,7 +195,7 @@ def refresh_access_token(refresh_token):
         "refresh_token": refresh_token
     }
 
-    response = requests.post(url, headers=headers, data=data)
+    response = http_post(url, headers=headers, data=data)
 
     if response.status_code == 200:
         new_token_data = response.json()
@@ -126,168 +216,331 @@ def refresh_access_token(refresh_token):
     else:
         raise Exception(f"[ERROR] Failed to refresh token: {response.status_code} - {response.text}")
     
-# Function to check and insert user data
-def check_and_insert_user(user_id, access_token):
-    conn = pyodbc.connect(DB_CONNECTION_STRING)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT 1 FROM Users WHERE user_id = ?", (user_id,))
-    if cursor.fetchone() is None:
-        url = "https://api.spotify.com/v1/me"
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            display_name = user_data.get("display_name", "")
-            email = user_data.get("email", "")
-            profile_image_url = user_data["images"][0]["url"] if user_data.get("images") else ""
-            country = user_data.get("country", "")
-
-            cursor.execute("""
-                INSERT INTO Users (user_id, display_name, email, profile_image_url, country)
-                VALUES (?, ?, ?, ?, ?)
-            """, user_id, display_name, email, profile_image_url, country)
-            conn.commit()
-        else:
+def _exists_in_db(cursor, index, item_id):
+    """Resolves an ID through the known-ID cache, falling back to SQL only when the cache cannot tell."""
+    known = index.lookup(item_id)
+    if known is None:
+        cursor.execute(f"SELECT 1 FROM {index.table} WHERE {index.column} = ?", (item_id,))
+        known = cursor.fetchone() is not None
+    if known:
+        index.add(item_id)
+    return known
+
+def _insert_row(cursor, conn, index, item_id, query, *params):
+    """
+    Inserts a row and records its ID; a duplicate key written by another process counts as success.
+
+    Returns:
+        bool: True if the row is stored, False if the insert broke any other constraint.
+    """
+    try:
+        cursor.execute(query, *params)
+        conn.commit()
+    except pyodbc.IntegrityError as e:
+        conn.rollback()
+        if not is_duplicate_key(e):
             if DEBUG_MODE or ERROR_MODE:
-                gui.log(f"Failed to fetch user profile: {response.status_code} - {response.text}", level="warn")
-                logger.info(f"Failed to fetch user profile: {response.status_code} - {response.text}")
+                gui.log(f"Failed to insert {item_id} into {index.table}: {e}", level="warn")
+                logger.info(f"Failed to insert {item_id} into {index.table}: {e}")
             return False
-    cursor.close()
-    conn.close()
+    index.add(item_id)
     return True
 
-# Function to check and insert album data
-def check_and_insert_album(album_id, access_token):
-    conn = pyodbc.connect(DB_CONNECTION_STRING)
-    cursor = conn.cursor()
+# Function to check and insert user data
+def check_and_insert_user(user_id, access_token, conn=None):
+    if known_users.lookup(user_id):
+        return True
 
-    cursor.execute("SELECT 1 FROM Albums WHERE album_id = ?", (album_id,))
-    if cursor.fetchone() is None:
-        url = f"https://api.spotify.com/v1/albums/{album_id}"
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers)
+    with _connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            if not _exists_in_db(cursor, known_users, user_id):
+                url = "https://api.spotify.com/v1/me"
+                headers = {"Authorization": f"Bearer {access_token}"}
+                response = http_get(url, headers=headers)
+            
+                if response.status_code == 200:
+                    user_data = response.json()
+                    display_name = user_data.get("display_name", "")
+                    email = user_data.get("email", "")
+                    profile_image_url = user_data["images"][0]["url"] if user_data.get("images") else ""
+                    country = user_data.get("country", "")
+
+                    if not _insert_row(cursor, conn, known_users, user_id, """
+                        INSERT INTO Users (user_id, display_name, email, profile_image_url, country)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, user_id, display_name, email, profile_image_url, country):
+                        return False
+                else:
+                    if DEBUG_MODE or ERROR_MODE:
+                        gui.log(f"Failed to fetch user profile: {response.status_code} - {response.text}", level="warn")
+                        logger.info(f"Failed to fetch user profile: {response.status_code} - {response.text}")
+                    return False
+        finally:
+            cursor.close()
+        return True
+
+# Fields the recently-played payload normally carries; only gaps trigger a batch fetch
+TRACK_FIELDS = ("name", "duration_ms", "explicit", "popularity", "href", "uri")
+ALBUM_FIELDS = ("name", "release_date", "total_tracks", "album_type", "href", "uri")
+TRACKS_BATCH_LIMIT = 50  # Max IDs for /v1/tracks?ids=
+ALBUMS_BATCH_LIMIT = 20  # Max IDs for /v1/albums?ids=
+
+def _has_missing_fields(obj, fields):
+    return any(obj.get(field) is None for field in fields)
 
+def fetch_in_batches(endpoint, ids, batch_size, access_token):
+    """
+    Fetches full objects from a Spotify multi-ID endpoint (e.g. "tracks" or "albums").
+
+    Returns:
+        dict: ID -> object for every ID Spotify returned.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    objects = {}
+    for i in range(0, len(ids), batch_size):
+        batch = ids[i:i + batch_size]
+        response = http_get(f"https://api.spotify.com/v1/{endpoint}?ids={','.join(batch)}", headers=headers)
         if response.status_code == 200:
-            album_data = response.json()
-            release_date = album_data.get("release_date", None)
-
-            cursor.execute("""
-                INSERT INTO Albums (album_id, name, release_date, total_tracks, album_type, album_href, uri)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, album_id, album_data["name"], release_date, album_data.get("total_tracks", 0),
-            album_data.get("album_type", ""), album_data.get("href", ""), album_data.get("uri", ""))
-            conn.commit()
+            for obj in response.json().get(endpoint, []):
+                if obj:
+                    objects[obj["id"]] = obj
         else:
             if DEBUG_MODE or ERROR_MODE:
-                gui.log(f"Failed to fetch album data for album_id {album_id}: {response.status_code} - {response.text}", level="warn")
-                logger.info(f"Failed to fetch album data for album_id {album_id}: {response.status_code} - {response.text}")
-            return False
-    cursor.close()
-    conn.close()
-    return True
+                gui.log(f"Failed to fetch {endpoint} batch: {response.status_code} - {response.text}", level="warn")
+                logger.info(f"Failed to fetch {endpoint} batch: {response.status_code} - {response.text}")
+    return objects
+
+def store_recent_catalog(items, access_token, conn=None):
+    """
+    Ensures the albums and tracks referenced by recently-played items exist.
+
+    Rows are built from the track and simplified album objects already present
+    in the recently-played response. The batch endpoints are only called for
+    objects that lack a required field.
+
+    Args:
+        items (list): Items from the recently-played endpoint.
+        access_token (str): The user's access token, used for gap-filling requests.
+        conn (pyodbc.Connection): Connection to use; a new one is opened if omitted.
+
+    Returns:
+        set: Track IDs that are present in the Tracks table.
+    """
+    tracks = {}
+    albums = {}
+    available = set()
+    for item in items:
+        track = item.get("track") or {}
+        track_id = track.get("id")
+        album = track.get("album") or {}
+        if not track_id or not album.get("id"):
+            continue
+        if known_tracks.lookup(track_id):
+            available.add(track_id)
+            continue
+        tracks[track_id] = track
+        albums[album["id"]] = album
 
-# Function to check and insert track data
-def check_and_insert_track(track_id, album_id, access_token):
-    conn = pyodbc.connect(DB_CONNECTION_STRING)
-    cursor = conn.cursor()
+    if not tracks:
+        return available
 
-    cursor.execute("SELECT 1 FROM Tracks WHERE track_id = ?", (track_id,))
-    if cursor.fetchone() is None:
-        # Ensure album exists in Albums table before inserting the track
-        if not check_and_insert_album(album_id, access_token):
+    with _connection(conn) as conn:
+        cursor = conn.cursor()
+        try:
+            _store_new_catalog_rows(tracks, albums, available, access_token, conn, cursor)
+        finally:
+            cursor.close()
+    return available
+
+def _store_new_catalog_rows(tracks, albums, available, access_token, conn, cursor):
+    """Inserts the albums and tracks not yet in the database and adds their IDs to `available`."""
+    new_tracks = {}
+    for track_id, track in tracks.items():
+        if _exists_in_db(cursor, known_tracks, track_id):
+            available.add(track_id)
+        else:
+            new_tracks[track_id] = track
+    needed_albums = {track["album"]["id"] for track in new_tracks.values()}
+    new_albums = {
+        album_id: album for album_id, album in albums.items()
+        if album_id in needed_albums and not _exists_in_db(cursor, known_albums, album_id)
+    }
+
+    # Fill gaps from the multi-ID endpoints only where the payload is incomplete
+    incomplete_tracks = [track_id for track_id, track in new_tracks.items() if _has_missing_fields(track, TRACK_FIELDS)]
+    if incomplete_tracks:
+        new_tracks.update(fetch_in_batches("tracks", incomplete_tracks, TRACKS_BATCH_LIMIT, access_token))
+    incomplete_albums = [album_id for album_id, album in new_albums.items() if _has_missing_fields(album, ALBUM_FIELDS)]
+    if incomplete_albums:
+        new_albums.update(fetch_in_batches("albums", incomplete_albums, ALBUMS_BATCH_LIMIT, access_token))
+
+    for album_id, album in new_albums.items():
+        _insert_row(cursor, conn, known_albums, album_id, """
+            INSERT INTO Albums (album_id, name, release_date, total_tracks, album_type, album_href, uri)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, album_id, album.get("name"), album.get("release_date"), album.get("total_tracks", 0),
+        album.get("album_type", ""), album.get("href", ""), album.get("uri", ""))
+
+    for track_id, track in new_tracks.items():
+        album_id = track["album"]["id"]
+        if not known_albums.lookup(album_id):
             if DEBUG_MODE or ERROR_MODE:
                 gui.log(f"Failed to insert album for track {track_id}. Aborting track insertion.", level="warn")
                 logger.info(f"Failed to insert album for track {track_id}. Aborting track insertion.")
-            return False
-
-        url = f"https://api.spotify.com/v1/tracks/{track_id}"
-        headers = {"Authorization": f"Bearer {access_token}"}
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-            track_data = response.json()
-
-            cursor.execute("""
-                INSERT INTO Tracks (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, track_id, track_data["name"], album_id, track_data["duration_ms"],
-            int(track_data["explicit"]), track_data["popularity"], track_data["preview_url"],
-            track_data["href"], track_data["uri"])
-            conn.commit()
-        else:
-            if DEBUG_MODE or ERROR_MODE:
-                gui.log(f"Failed to fetch track data for track_id {track_id}: {response.status_code} - {response.text}", level="warn")
-                logger.info(f"Failed to fetch track data for track_id {track_id}: {response.status_code} - {response.text}")
-            return False
-    cursor.close()
-    conn.close()
-    return True
+            continue
+        if _insert_row(cursor, conn, known_tracks, track_id, """
+            INSERT INTO Tracks (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, track_id, track.get("name"), album_id, track.get("duration_ms"),
+        int(track.get("explicit") or 0), track.get("popularity", 0), track.get("preview_url"),
+        track.get("href"), track.get("uri")):
+            available.add(track_id)
 
 # Function to fetch recently played tracks
-def get_recently_played_tracks(access_token):
-    url = "https://api.spotify.com/v1/me/player/recently-played?limit=50"
+def get_recently_played_tracks(access_token, after=None):
+    """
+    Args:
+        access_token (str): The user's access token.
+        after (int): Optional Unix timestamp in milliseconds; only plays after it are returned.
+
+    Returns:
+        list or None: Recently played items, or None if the access token is invalid or expired.
+    """
+    url = "https://api.spotify.com/v1/me/player/recently-played"
+    params = {"limit": 50}
+    if after is not None:
+        params["after"] = after
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers, params=params)
 
     if response.status_code == 200:
         return response.json()["items"]
+    elif response.status_code == 401:  # Unauthorized indicates expired/invalid token
+        return None
     else:
         raise Exception(f"[ERROR] Error fetching recently played tracks: {response.status_code} - {response.text}")
 
-# Function to insert recently played tracks
-def insert_recently_played_tracks():
-    user_tokens = get_all_tokens_with_user_ids()
-    for user_token in user_tokens:
-        user_id = user_token["user_id"]
-        access_token = user_token["access_token"]
-        
-        # Check if the token is valid; refresh if necessary
-        if not is_token_valid(access_token):
-            if DEBUG_MODE or WARNING_MODE:
-                gui.log(f"Access token for user {user_id} is invalid or expired.", level="warn")
-                logger.info(f"Access token for user {user_id} is invalid or expired.")
-            continue
-        
-        gui.log(f"Processing recently played tracks for user {user_id}.", level="info")
-        logger.info(f"Processing recently played tracks for user {user_id}.")
-        
-        if not check_and_insert_user(user_id, access_token):
+def process_recent_user(user_token):
+    """
+    Stores the recently played tracks of one user on a pooled connection.
+
+    Plays come newest first. The returned watermark is the newest play stored, or
+    confirmed already stored, that is older than every play that was skipped, so
+    a skipped play is fetched again next run. It is None when nothing may advance.
+
+    Returns:
+        tuple: (user_id, number of plays inserted or None if skipped, new watermark or None, elapsed seconds)
+    """
+    start_time = time.time()
+    user_id = user_token["user_id"]
+    access_token = user_token["access_token"]
+
+    # An invalid token shows up as 401 here, so no separate /me validity check is needed
+    watermark = get_watermark(user_id)
+    tracks = get_recently_played_tracks(access_token, after=watermark)
+    if tracks is None:
+        if DEBUG_MODE or WARNING_MODE:
+            gui.log(f"Access token for user {user_id} is invalid or expired.", level="warn")
+            logger.info(f"Access token for user {user_id} is invalid or expired.")
+        return user_id, None, None, time.time() - start_time
+
+    # The cursor is exclusive, but guard against plays at or before the watermark anyway
+    if watermark is not None:
+        tracks = [item for item in tracks if to_unix_ms(datetime.strptime(item["played_at"], PLAYED_AT_FORMAT)) > watermark]
+    if not tracks:
+        return user_id, 0, None, time.time() - start_time
+
+    # Check out a pooled connection only once there is something to store
+    with get_connection() as conn:
+        if not check_and_insert_user(user_id, access_token, conn):
             if DEBUG_MODE or WARNING_MODE:
                 gui.log(f"Failed to insert user {user_id}. Aborting.", level="warn")
                 logger.info(f"Failed to insert user {user_id}. Aborting.")
-            continue
-    
-        tracks = get_recently_played_tracks(access_token)
-    
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
+            return user_id, None, None, time.time() - start_time
+
+        # Ensure tracks and albums exist, built from the payload we already have
+        available_tracks = store_recent_catalog(tracks, access_token, conn)
+
+        inserted = 0
+        stored_played_at = []
+        oldest_skipped = None
         cursor = conn.cursor()
+        try:
+            for item in tracks:
+                track_id = item["track"]["id"]
+                played_at = datetime.strptime(item["played_at"], PLAYED_AT_FORMAT)
     
-        for item in tracks:
-            track_id = item["track"]["id"]
-            album_id = item["track"]["album"]["id"]
-            played_at = datetime.strptime(item["played_at"], "%Y-%m-%dT%H:%M:%S.%fZ")
-    
-            # Ensure track and album exist before inserting into user_recent_tracks
-            if check_and_insert_track(track_id, album_id, access_token):
-                try:
-                    cursor.execute("""
-                        INSERT INTO user_recent_tracks (user_id, track_id, listened_at)
-                        VALUES (?, ?, ?)
-                    """, user_id, track_id, played_at)
-                    conn.commit()
-                except pyodbc.IntegrityError as e:  # noqa: F841
-                    # Handle duplicate entry case
-                    if DEBUG_MODE:
-                        gui.log(f"[DEBUG] Duplicate entry for user {user_id}, track {track_id} at {played_at}. Skipping.", level="info")
-                        logger.info(f"[DEBUG] Duplicate entry for user {user_id}, track {track_id} at {played_at}. Skipping.")
-                    conn.rollback()  # Rollback if insertion fails
-
-        cursor.close()
-        conn.close()
-        gui.log(f"Recently played tracks stored successfully for user {user_id}.", level="info")
-        logger.info(f"Recently played tracks stored successfully for user {user_id}.")
+                # Ensure track and album exist before inserting into user_recent_tracks
+                if track_id not in available_tracks:
+                    oldest_skipped = played_at if oldest_skipped is None else min(oldest_skipped, played_at)
+                else:
+                    try:
+                        cursor.execute("""
+                            INSERT INTO user_recent_tracks (user_id, track_id, listened_at)
+                            VALUES (?, ?, ?)
+                        """, user_id, track_id, played_at)
+                        conn.commit()
+                        inserted += 1
+                    except pyodbc.IntegrityError as e:
+                        conn.rollback()  # Rollback if insertion fails
+                        if not is_duplicate_key(e):
+                            # e.g. a foreign key to a missing track; hold the watermark so the play is fetched again
+                            if DEBUG_MODE or ERROR_MODE:
+                                gui.log(f"Failed to store play of track {track_id} at {played_at} for user {user_id}: {e}", level="warn")
+                                logger.info(f"Failed to store play of track {track_id} at {played_at} for user {user_id}: {e}")
+                            oldest_skipped = played_at if oldest_skipped is None else min(oldest_skipped, played_at)
+                            continue
+                        # Already stored, e.g. by an overlapping run or after the state file was deleted
+                        if DEBUG_MODE:
+                            gui.log(f"[DEBUG] Duplicate entry for user {user_id}, track {track_id} at {played_at}. Skipping.", level="info")
+                            logger.info(f"[DEBUG] Duplicate entry for user {user_id}, track {track_id} at {played_at}. Skipping.")
+                    stored_played_at.append(played_at)
+        finally:
+            cursor.close()
+
+        # Reached only when no insert raised; never move past a skipped or failed play
+        if oldest_skipped is not None:
+            stored_played_at = [played_at for played_at in stored_played_at if played_at < oldest_skipped]
+        watermark = to_unix_ms(max(stored_played_at)) if stored_played_at else None
+        return user_id, inserted, watermark, time.time() - start_time
+
+# Function to insert recently played tracks
+def insert_recently_played_tracks(max_workers=RECENT_WORKERS):
+    """
+    Collects recently played tracks for every user in auth_tokens.json.
+    Up to `max_workers` users are processed at once, each worker holding one
+    pooled database connection and sharing the pooled HTTP session.
+    """
+    max_workers = min(max_workers, DB_POOL_SIZE)
+    user_tokens = get_all_tokens_with_user_ids()
+    warm_known_ids()
+    load_watermarks()
+    run_start = time.time()
+
+    # Watermarks only move for users whose worker finished; users that raised keep theirs
+    advanced = False
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_recent_user, user_token): user_token["user_id"] for user_token in user_tokens}
+        for future in as_completed(futures):
+            user_id = futures[future]
+            try:
+                user_id, inserted, watermark, elapsed = future.result()
+            except Exception as e:
+                gui.status(f"Error processing user {user_id}: {e}", status="error")
+                logger.error(f"Error processing user {user_id}: {e}")
+                continue
+            if watermark is not None:
+                advance_watermark(user_id, watermark)
+                advanced = True
+            if inserted is not None:
+                gui.log(f"Recently played tracks stored successfully for user {user_id} ({inserted} new plays, {elapsed:.2f}s).", level="info")
+                logger.info(f"Recently played tracks stored successfully for user {user_id} ({inserted} new plays, {elapsed:.2f}s).")
+    if advanced:
+        save_watermarks()
+
+    gui.log(f"Processed {len(user_tokens)} users in {time.time() - run_start:.2f}s with {max_workers} workers.", level="info")
+    logger.info(f"Processed {len(user_tokens)} users in {time.time() - run_start:.2f}s with {max_workers} workers.")
 
 # Main function
 def main():
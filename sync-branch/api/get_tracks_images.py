@@ -1,21 +1,13 @@
-import requests
-import pyodbc
-from util import get_access_token_for_request
+from util import make_request
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from dotenv import load_dotenv
 import os
 import logging
+from db_pool import get_pool
 
 load_dotenv()
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
-
 # Setup logging
 LOG_FILE = "logs/main.log"
 
@@ -41,6 +33,23 @@ logger.addHandler(console_handler)
 
 logger.propagate = False
 
+# Backfill settings (override through .env)
+TRACK_IMAGE_BATCH_SIZE = 50  # Max IDs for /v1/tracks?ids=
+TRACK_IMAGE_WORKERS = int(os.getenv("TRACK_IMAGE_WORKERS", 8))  # Concurrent /tracks requests
+
+# Session-scoped staging table for the set-based image update
+TRACK_IMAGES_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#Track_Images_Staging') IS NULL
+    CREATE TABLE #Track_Images_Staging (track_id NVARCHAR(64) NOT NULL PRIMARY KEY, images NVARCHAR(1024) NULL);
+TRUNCATE TABLE #Track_Images_Staging;
+"""
+
+UPDATE_TRACK_IMAGES_SQL = """
+UPDATE t SET t.images = s.images
+FROM Tracks t
+JOIN #Track_Images_Staging s ON s.track_id = t.track_id
+"""
+
 def fetch_missing_track_images(cursor):
     """
     Fetch track IDs missing images from the database.
@@ -49,18 +58,21 @@ def fetch_missing_track_images(cursor):
     cursor.execute(query)
     return [row[0] for row in cursor.fetchall()]
 
-def fetch_track_images_from_spotify(track_ids, access_token):
+def fetch_track_images_from_spotify(track_ids):
     """
     Fetch track images from Spotify API for a list of track IDs.
+    Each call takes its token from the credential scheduler, so batches can run
+    concurrently and a token expiring mid-run is simply replaced.
     """
     url = f"https://api.spotify.com/v1/tracks?ids={','.join(track_ids)}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = make_request(url, "Get Tracks")
 
+    if response is None:
+        raise Exception("Spotify API error: no response for track batch.")
     if response.status_code == 200:
         tracks_data = response.json().get("tracks", [])
         logger.info(f"Fetched {len(tracks_data)} track images from Spotify.")
-        return {track["id"]: track["album"]["images"][0]["url"] if track["album"]["images"] else None for track in tracks_data}
+        return {track["id"]: track["album"]["images"][0]["url"] if track["album"]["images"] else None for track in tracks_data if track}
     else:
         logger.error(f"Spotify API error: {response.status_code} - {response.text}")
         raise Exception(f"Spotify API error: {response.status_code} - {response.text}")
@@ -68,10 +80,19 @@ def fetch_track_images_from_spotify(track_ids, access_token):
 def update_track_images_in_db(track_images, cursor, conn):
     """
     Update the `Tracks` table with the retrieved track images.
+    The batch is bulk-loaded into a temp table and applied with one UPDATE ... FROM.
     """
-    for track_id, image_url in track_images.items():
-        cursor.execute("UPDATE Tracks SET images = ? WHERE track_id = ?", image_url, track_id)
-    conn.commit()
+    if not track_images:
+        return
+    try:
+        cursor.execute(TRACK_IMAGES_STAGING_SQL)
+        cursor.fast_executemany = True
+        cursor.executemany("INSERT INTO #Track_Images_Staging (track_id, images) VALUES (?, ?)", list(track_images.items()))
+        cursor.execute(UPDATE_TRACK_IMAGES_SQL)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     logger.info(f"Updated images for {len(track_images)} tracks in the database.")
 
 def update_missing_track_images():
@@ -79,34 +100,32 @@ def update_missing_track_images():
     Main function to fetch and update missing track images in the database.
     """
     logger.info("Starting the process to update missing track images...")
-    conn = pyodbc.connect(CONNECTION_STRING)
-    cursor = conn.cursor()
-
     try:
-        missing_tracks = fetch_missing_track_images(cursor)
-        if not missing_tracks:
-            logger.info("No tracks are missing images.")
-            return
-
-        access_token = get_access_token_for_request("Get Tracks")
-        batch_size = 50
-
-        for i in tqdm(range(0, len(missing_tracks), batch_size), desc="Updating Track Images"):
-            batch = missing_tracks[i:i + batch_size]
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
             try:
-                track_images = fetch_track_images_from_spotify(batch, access_token)
-                update_track_images_in_db(track_images, cursor, conn)
-            except Exception as e:
-                logger.error(f"Error processing batch {i // batch_size + 1}: {e}")
-
-        logger.info("Track images updated successfully.")
-
+                missing_tracks = fetch_missing_track_images(cursor)
+                if not missing_tracks:
+                    logger.info("No tracks are missing images.")
+                    return
+
+                batches = [missing_tracks[i:i + TRACK_IMAGE_BATCH_SIZE] for i in range(0, len(missing_tracks), TRACK_IMAGE_BATCH_SIZE)]
+
+                # Batches are fetched concurrently; this thread owns the connection and writes them as they finish
+                with ThreadPoolExecutor(max_workers=TRACK_IMAGE_WORKERS) as executor:
+                    futures = {executor.submit(fetch_track_images_from_spotify, batch): number for number, batch in enumerate(batches, start=1)}
+                    for future in tqdm(as_completed(futures), total=len(futures), desc="Updating Track Images"):
+                        try:
+                            update_track_images_in_db(future.result(), cursor, conn)
+                        except Exception as e:
+                            logger.error(f"Error processing batch {futures[future]}: {e}")
+
+                logger.info("Track images updated successfully.")
+            finally:
+                cursor.close()
+                logger.info("Database connection closed.")
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-        logger.info("Database connection closed.")
 
 if __name__ == "__main__":
     update_missing_track_images()
\ No newline at end of file
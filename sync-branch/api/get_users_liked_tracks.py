@@ -1,7 +1,10 @@
-import requests
 import json
 import pyodbc
 from util import fetch_user_profile
+from http_session import http_get
+from id_cache import KnownIdIndex
+from db_pool import get_connection, is_duplicate_key
+from credential_registry import atomic_write_json
 from cmd_gui_kit import CmdGUI
 import logging
 from dotenv import load_dotenv
@@ -37,16 +40,28 @@ logger.propagate = False
 
 gui = CmdGUI()
 
-# Database connection details
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-DB_CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
+# Saved-tracks import state (override through .env)
+LIKED_PAGE_SIZE = 50  # Max limit for /me/tracks
+LIKED_PROGRESS_FILE = os.getenv("LIKED_PROGRESS_FILE", "liked_tracks_progress.json")  # Resume point per unfinished user
+ADDED_AT_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
+# Process-local existence caches for albums and tracks
+known_albums = KnownIdIndex("Albums", "album_id")
+known_tracks = KnownIdIndex("Tracks", "track_id")
 
+def warm_known_ids():
+    """Seeds the existence caches from the database once per process."""
+    cold = [index for index in (known_albums, known_tracks) if not index.warmed]
+    if not cold:
+        return
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            for index in cold:
+                index.warm(cursor)
+            cursor.close()
+    except Exception as e:
+        logger.error(f"Error warming known-ID caches: {e}")
 
 def format_date(date_string):
     """Convert date string to SQL Server compatible format (YYYY-MM-DD)."""
@@ -59,139 +74,251 @@ def format_date(date_string):
     # Return a default date if parsing fails
     return None  # Or return a placeholder like '1900-01-01'
 
-def insert_album_if_not_exists(track):
-    """Ensure the album exists in the Albums table."""
-    try:
-        with pyodbc.connect(DB_CONNECTION_STRING) as conn:
-            cursor = conn.cursor()
-            
-            # Extract album details
-            album = track["track"]["album"]
-            album_id = album["id"]
-            name = album["name"]
-            release_date_raw = album.get("release_date", None)
-            release_date = format_date(release_date_raw)
-            total_tracks = album.get("total_tracks", 0)  # Default to 0 if missing
-            album_type = album.get("album_type", None)  # Allow NULL if missing
-            album_href = album["href"]
-            uri = album["uri"]
-
-            # Check if the album exists in the Albums table
-            cursor.execute("SELECT COUNT(*) FROM Albums WHERE album_id = ?", album_id)
-            if cursor.fetchone()[0] == 0:
-                # Insert the album into Albums table
-                cursor.execute(
-                    """
-                    INSERT INTO Albums (album_id, name, release_date, total_tracks, album_type, album_href, uri)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    album_id, name, release_date, total_tracks, album_type, album_href, uri
-                )
-                conn.commit()
-                logger.info(f"Inserted album {album_id} into Albums table.")
-    except Exception as e:
-        logger.error(f"Error inserting album {album_id}: {e}")
-        gui.status(f"Error inserting album {album_id}: {e}", status="error")
-        
-        
-def insert_track_if_not_exists(track):
-    """Ensure the track exists in the Tracks table."""
-    try:
-        with pyodbc.connect(DB_CONNECTION_STRING) as conn:
-            cursor = conn.cursor()
-            
-            # Insert album if not exists
-            insert_album_if_not_exists(track)
-
-            # Extract track details
-            track_id = track["track"]["id"]
-            name = track["track"]["name"]
-            album_id = track["track"]["album"]["id"]
-            duration_ms = track["track"]["duration_ms"]
-            explicit = 1 if track["track"]["explicit"] else 0  # Convert boolean to bit
-            popularity = track["track"].get("popularity", 0)  # Default to 0 if missing
-            preview_url = track["track"].get("preview_url", None)  # Allow NULL
-            track_href = track["track"]["href"]
-            uri = track["track"]["uri"]
-
-            # Check if the track exists in the Tracks table
-            cursor.execute("SELECT COUNT(*) FROM Tracks WHERE track_id = ?", track_id)
-            if cursor.fetchone()[0] == 0:
-                # Insert the track into Tracks table
-                cursor.execute(
-                    """
-                    INSERT INTO Tracks (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri
-                )
-                conn.commit()
-                logger.info(f"Inserted track {track_id} into Tracks table.")
-    except Exception as e:
-        logger.error(f"Error inserting track {track_id}: {e}")
-        gui.status(f"Error inserting track {track_id}: {e}", status="error")
+# Session-scoped staging tables; a page's albums and tracks are written with one MERGE each
+LIKED_CATALOG_STAGING_SQL = """
+IF OBJECT_ID('tempdb..#Liked_Albums_Staging') IS NULL
+    CREATE TABLE #Liked_Albums_Staging (
+        album_id NVARCHAR(255) NOT NULL PRIMARY KEY, name NVARCHAR(MAX), release_date DATE NULL,
+        total_tracks INT, album_type NVARCHAR(255) NULL, album_href NVARCHAR(MAX), uri NVARCHAR(MAX)
+    );
+IF OBJECT_ID('tempdb..#Liked_Tracks_Staging') IS NULL
+    CREATE TABLE #Liked_Tracks_Staging (
+        track_id NVARCHAR(255) NOT NULL PRIMARY KEY, name NVARCHAR(MAX), album_id NVARCHAR(255) NOT NULL,
+        duration_ms INT, explicit BIT, popularity INT, preview_url NVARCHAR(MAX) NULL,
+        track_href NVARCHAR(MAX), uri NVARCHAR(MAX)
+    );
+TRUNCATE TABLE #Liked_Albums_Staging;
+TRUNCATE TABLE #Liked_Tracks_Staging;
+"""
+
+# HOLDLOCK keeps a concurrent import from inserting the same ID between the match and the insert
+MERGE_LIKED_CATALOG_SQL = """
+MERGE Albums WITH (HOLDLOCK) AS target
+USING #Liked_Albums_Staging AS source
+ON target.album_id = source.album_id
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT (album_id, name, release_date, total_tracks, album_type, album_href, uri)
+    VALUES (source.album_id, source.name, source.release_date, source.total_tracks, source.album_type, source.album_href, source.uri);
+
+MERGE Tracks WITH (HOLDLOCK) AS target
+USING #Liked_Tracks_Staging AS source
+ON target.track_id = source.track_id
+WHEN NOT MATCHED BY TARGET THEN
+    INSERT (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri)
+    VALUES (source.track_id, source.name, source.album_id, source.duration_ms, source.explicit,
+            source.popularity, source.preview_url, source.track_href, source.uri);
+"""
 
-def insert_tracks_to_db(user_id, tracks):
-    """Insert liked tracks into Users_Liked_Tracks table."""
+def album_row(track):
+    """Albums row for the album of a saved-track item."""
+    album = track["track"]["album"]
+    return (
+        album["id"], album["name"], format_date(album.get("release_date", None)),
+        album.get("total_tracks", 0),  # Default to 0 if missing
+        album.get("album_type", None),  # Allow NULL if missing
+        album["href"], album["uri"]
+    )
+
+def track_row(track):
+    """Tracks row for a saved-track item."""
+    track = track["track"]
+    return (
+        track["id"], track["name"], track["album"]["id"], track["duration_ms"],
+        1 if track["explicit"] else 0,  # Convert boolean to bit
+        track.get("popularity", 0),  # Default to 0 if missing
+        track.get("preview_url", None),  # Allow NULL
+        track["href"], track["uri"]
+    )
+
+def stage_liked_catalog(items, cursor):
+    """
+    Stages the albums and tracks of a page that the known-ID caches do not already confirm.
+
+    Returns:
+        tuple: (staged album IDs, staged track IDs).
+    """
+    albums = {}
+    tracks = {}
+    for track in items:
+        track_id = track["track"]["id"]
+        if track_id in tracks or known_tracks.lookup(track_id):
+            continue
+        tracks[track_id] = track_row(track)
+        album_id = track["track"]["album"]["id"]
+        if album_id not in albums and not known_albums.lookup(album_id):
+            albums[album_id] = album_row(track)
+
+    if tracks:
+        cursor.execute(LIKED_CATALOG_STAGING_SQL)
+        cursor.fast_executemany = True
+        if albums:
+            cursor.executemany(
+                "INSERT INTO #Liked_Albums_Staging (album_id, name, release_date, total_tracks, album_type, album_href, uri) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                list(albums.values())
+            )
+        cursor.executemany(
+            "INSERT INTO #Liked_Tracks_Staging (track_id, name, album_id, duration_ms, explicit, popularity, preview_url, track_href, uri) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            list(tracks.values())
+        )
+    return list(albums), list(tracks)
+
+def load_progress():
+    """Returns user_id -> {"offset", "watermark"} for imports that did not finish."""
     try:
-        with pyodbc.connect(DB_CONNECTION_STRING) as conn:
-            cursor = conn.cursor()
-            
-            for track in tracks:
-                # Ensure the track and album exist
-                insert_track_if_not_exists(track)
-
-                # Extract relevant fields
-                track_id = track["track"]["id"]
-                liked_date = track["added_at"]
-
-                # Insert into Users_Liked_Tracks
-                cursor.execute(
-                    """
-                    INSERT INTO Users_Liked_Tracks (user_id, track_id, liked_date)
-                    VALUES (?, ?, ?)
-                    """,
-                    user_id, track_id, liked_date
-                )
-            conn.commit()
-        logger.info(f"Inserted {len(tracks)} tracks for user {user_id} into the database.")
-        gui.log(f"Inserted {len(tracks)} tracks for user {user_id} into the database.", level="info")
-    except Exception as e:
-        logger.error(f"Error inserting tracks for user {user_id}: {e}")
-        gui.status(f"Error inserting tracks for user {user_id}: {e}", status="error")
+        with open(LIKED_PROGRESS_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        logger.error(f"Failed to decode {LIKED_PROGRESS_FILE}. Starting every user from the newest likes.")
+        return {}
 
-def fetch_user_saved_tracks(access_token):
+def save_progress(user_id, offset, watermark=None):
+    """
+    Records where a user's import should resume, or clears it when `offset` is None.
+    The watermark the import started with is kept so a resumed run stops at the same place.
+    """
+    progress = load_progress()
+    if offset is None:
+        if user_id not in progress:
+            return
+        progress.pop(user_id)
+    else:
+        progress[user_id] = {
+            "offset": offset,
+            "watermark": watermark.strftime(ADDED_AT_FORMAT) if watermark else None,
+        }
+    atomic_write_json(LIKED_PROGRESS_FILE, progress)
+
+def get_liked_watermark(cursor, user_id):
+    """Returns the newest liked_date stored for the user, or None."""
+    cursor.execute("SELECT MAX(liked_date) FROM Users_Liked_Tracks WHERE user_id = ?", user_id)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def iter_saved_track_pages(access_token, start_offset=0, limit=LIKED_PAGE_SIZE):
+    """
+    Yields the user's saved tracks one page at a time, newest likes first.
+
+    Yields:
+        tuple: (offset, items) for each page.
+
+    Raises:
+        Exception: If a page cannot be fetched, so the caller keeps its resume point.
+    """
     base_url = "https://api.spotify.com/v1/me/tracks"
-    
-    user_data = fetch_user_profile(access_token)
-    user_id = user_data["user_id"]
     headers = {"Authorization": f"Bearer {access_token}"}
-    total_tracks = []
-    offset = 0
-    limit = 50
-    has_more = True
+    offset = start_offset
 
-    while has_more:
+    while True:
         params = {"limit": limit, "offset": offset}
-        response = requests.get(base_url, headers=headers, params=params)
+        response = http_get(base_url, headers=headers, params=params)
         if response.status_code == 403:
             gui.log("Permission Denied: Check token scopes.", level="warn")
             logger.info("Permission Denied: Check token scopes.")
-            break
+            return
         elif response.status_code != 200:
-            gui.status(f"{response.status_code} - {response.text}", status="error")
-            logger.error(f"{response.status_code} - {response.text}")
-            break
+            raise Exception(f"{response.status_code} - {response.text}")
 
-        data = response.json()
-        items = data.get("items", [])
-        total_tracks.extend(items)
+        items = response.json().get("items", [])
+        yield offset, items
 
+        if len(items) < limit:
+            return
         offset += limit
-        has_more = len(items) == limit
 
-    # Insert tracks into the database
-    insert_tracks_to_db(user_id, total_tracks)
+def insert_liked_page(user_id, items, cursor, conn):
+    """
+    Writes one page of liked tracks in a single transaction: the page's new albums and
+    tracks are merged from staging tables, then the Users_Liked_Tracks rows are added.
+    Rows already stored are skipped, so re-writing a page after a resume is harmless.
+
+    Returns:
+        int: Number of liked tracks in the page.
+    """
+    if not items:
+        return 0
+
+    rows = [(user_id, track["track"]["id"], track["added_at"], user_id, track["track"]["id"]) for track in items]
+    for attempt in range(2):
+        try:
+            album_ids, track_ids = stage_liked_catalog(items, cursor)
+            if track_ids:
+                cursor.execute(MERGE_LIKED_CATALOG_SQL)
+            cursor.fast_executemany = True
+            cursor.executemany(
+                """
+                INSERT INTO Users_Liked_Tracks (user_id, track_id, liked_date)
+                SELECT ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM Users_Liked_Tracks WHERE user_id = ? AND track_id = ?)
+                """,
+                rows
+            )
+            conn.commit()
+            break
+        except pyodbc.IntegrityError as e:
+            # Another import committed some of these rows first; the retry sees and skips them
+            conn.rollback()
+            if attempt or not is_duplicate_key(e):
+                raise
+            logger.debug(f"Duplicate rows while writing a liked page for user {user_id}, retrying: {e}")
+        except Exception:
+            conn.rollback()
+            raise
+
+    # Only record IDs once the page is committed
+    for album_id in album_ids:
+        known_albums.add(album_id)
+    for track_id in track_ids:
+        known_tracks.add(track_id)
+    if track_ids:
+        logger.info(f"Merged {len(track_ids)} tracks and {len(album_ids)} albums for user {user_id}.")
+    return len(rows)
+
+def fetch_user_saved_tracks(access_token):
+    """
+    Streams the user's saved tracks into the database page by page.
+
+    A fresh run starts at the newest like and stops at the first track whose
+    added_at is not newer than the newest liked_date already stored. After
+    each committed page the next offset is kept in LIKED_PROGRESS_FILE, so a
+    run that fails part-way resumes there with its original watermark.
+    """
+    user_data = fetch_user_profile(access_token)
+    user_id = user_data["user_id"]
+    resume = load_progress().get(user_id)
+    inserted = 0
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if resume:
+                start_offset = resume["offset"]
+                watermark = datetime.strptime(resume["watermark"], ADDED_AT_FORMAT) if resume.get("watermark") else None
+            else:
+                start_offset = 0
+                watermark = get_liked_watermark(cursor, user_id)
+
+            for offset, items in iter_saved_track_pages(access_token, start_offset=start_offset):
+                page = [item for item in items if item.get("track") and item["track"].get("id")]
+                reached_watermark = False
+                if watermark is not None:
+                    newer = [item for item in page if datetime.strptime(item["added_at"], ADDED_AT_FORMAT) > watermark]
+                    reached_watermark = len(newer) < len(page)
+                    page = newer
+
+                inserted += insert_liked_page(user_id, page, cursor, conn)
+                if reached_watermark:
+                    break
+                save_progress(user_id, offset + LIKED_PAGE_SIZE, watermark)
+
+            cursor.close()
+        save_progress(user_id, None)
+        logger.info(f"Inserted {inserted} tracks for user {user_id} into the database.")
+        gui.log(f"Inserted {inserted} tracks for user {user_id} into the database.", level="info")
+    except Exception as e:
+        logger.error(f"Error inserting tracks for user {user_id} after {inserted} tracks: {e}")
+        gui.status(f"Error inserting tracks for user {user_id} after {inserted} tracks: {e}", status="error")
 
 # Execute the function
 def get_users_liked_tracks():
@@ -203,6 +330,8 @@ def get_users_liked_tracks():
         logger.error("auth_tokens.json file not found.")
         return
 
+    warm_known_ids()
+
     for token_entry in tokens:
         access_token = token_entry.get("access_token")
         fetch_user_saved_tracks(access_token)    
@@ -0,0 +1,93 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from threading import Lock
+from dotenv import load_dotenv
+import os
+import logging
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Connection pool settings (override through .env)
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))  # Number of per-host pools kept alive
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))  # Keep-alive connections per host pool
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 30))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", 0.5))
+
+# 429 is left out on purpose: make_request handles it by rotating credentials.
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+_session = None
+_session_lock = Lock()
+
+def build_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                  max_retries=HTTP_MAX_RETRIES, backoff_factor=HTTP_BACKOFF_FACTOR):
+    """
+    Builds a requests.Session with keep-alive connection pools and retry/backoff adapters.
+
+    Args:
+        pool_connections (int): Number of host pools to cache.
+        pool_maxsize (int): Maximum number of connections kept open per host.
+        max_retries (int): Retries for connection errors and transient 5xx responses.
+        backoff_factor (float): Exponential backoff factor between retries.
+
+    Returns:
+        requests.Session: A session whose adapters reuse TCP/TLS connections.
+    """
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """
+    Returns the process-wide shared session, creating it on first use.
+    The underlying urllib3 pools are thread-safe, so worker threads can share it.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+                logger.debug(
+                    f"HTTP session created (pools={HTTP_POOL_CONNECTIONS}, maxsize={HTTP_POOL_MAXSIZE}, "
+                    f"retries={HTTP_MAX_RETRIES})."
+                )
+    return _session
+
+def close_session():
+    """Closes the shared session and releases all pooled connections."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def http_get(url, headers=None, params=None, timeout=None):
+    """GET through the shared pooled session."""
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    return get_session().get(url, headers=headers, params=params, timeout=timeout)
+
+def http_post(url, data=None, headers=None, timeout=None):
+    """POST through the shared pooled session."""
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    return get_session().post(url, data=data, headers=headers, timeout=timeout)
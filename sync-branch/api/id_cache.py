@@ -0,0 +1,120 @@
+import hashlib
+import math
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Sizing of the existence caches (override through .env)
+KNOWN_ID_CAPACITY = int(os.getenv("KNOWN_ID_CAPACITY", 1000000))  # Expected number of IDs per table
+KNOWN_ID_ERROR_RATE = float(os.getenv("KNOWN_ID_ERROR_RATE", 0.001))  # Bloom filter false-positive rate
+KNOWN_ID_LRU_SIZE = int(os.getenv("KNOWN_ID_LRU_SIZE", 100000))  # Exact IDs kept per table
+KNOWN_ID_FETCH_SIZE = 10000  # Rows per fetchmany while warming
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string IDs using double hashing on a BLAKE2b digest."""
+
+    def __init__(self, capacity=KNOWN_ID_CAPACITY, error_rate=KNOWN_ID_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class LRUSet:
+    """Bounded set that evicts the least recently used ID."""
+
+    def __init__(self, maxsize=KNOWN_ID_LRU_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def add(self, item):
+        self._items[item] = None
+        self._items.move_to_end(item)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __contains__(self, item):
+        if item in self._items:
+            self._items.move_to_end(item)
+            return True
+        return False
+
+class KnownIdIndex:
+    """
+    Process-local existence index for one table's primary key.
+
+    An exact LRU answers "exists" for IDs seen recently. A Bloom filter seeded
+    from the table answers "does not exist" for IDs never seen. Anything else
+    still needs a SQL lookup. Record every confirmed or inserted ID with add().
+    """
+
+    def __init__(self, table, column, capacity=KNOWN_ID_CAPACITY, lru_size=KNOWN_ID_LRU_SIZE):
+        self.table = table
+        self.column = column
+        self.capacity = capacity
+        self.bloom = BloomFilter(capacity)
+        self.recent = LRUSet(lru_size)
+        self.warmed = False
+        self._lock = Lock()
+
+    def warm(self, cursor):
+        """Seeds the Bloom filter with every ID currently in the table."""
+        cursor.execute(f"SELECT COUNT(*) FROM {self.table}")
+        row_count = cursor.fetchone()[0]
+        bloom = BloomFilter(max(self.capacity, row_count * 2))
+
+        cursor.execute(f"SELECT {self.column} FROM {self.table}")
+        while True:
+            rows = cursor.fetchmany(KNOWN_ID_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                bloom.add(row[0])
+
+        with self._lock:
+            # Keep IDs recorded while the table was being scanned
+            for item in self.recent:
+                bloom.add(item)
+            self.bloom = bloom
+            self.warmed = True
+        logger.info(f"Warmed known-ID index for {self.table} with {row_count} IDs.")
+
+    def lookup(self, item):
+        """
+        Returns:
+            bool or None: True if the ID is known to exist, False if it is known to be
+            missing (only after warm()), or None if the database must be asked.
+        """
+        with self._lock:
+            if item in self.recent:
+                return True
+            if self.warmed and item not in self.bloom:
+                return False
+        return None
+
+    def add(self, item):
+        """Records an ID that exists in the table."""
+        with self._lock:
+            self.bloom.add(item)
+            self.recent.add(item)
@@ -0,0 +1,268 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from util import get_credential, get_client_token, invalidate_client_token, paginated_url, scheduler
+from http_session import http_get
+from db_operations import check_user_exists, insert_user_data, check_and_insert_playlist, TrackBatchWriter
+from cmd_gui_kit import CmdGUI
+from dotenv import load_dotenv
+import logging
+import os
+import sys
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+gui = CmdGUI()
+
+# Check if '--debug' is passed as a command-line argument
+DEBUG_MODE = '--debug' in sys.argv
+WARNING_MODE = '--warning' in sys.argv
+ERROR_MODE = '--error' in sys.argv
+
+DEBUG_MODE = os.getenv("DEBUG_MODE")
+if DEBUG_MODE == "True":
+    DEBUG_MODE = True
+
+# Concurrency limits (override through .env)
+INGEST_USER_CONCURRENCY = int(os.getenv("INGEST_USER_CONCURRENCY", 8))  # Users processed at once
+INGEST_REQUEST_CONCURRENCY = int(os.getenv("INGEST_REQUEST_CONCURRENCY", 8))  # In-flight requests per request type
+INGEST_CREDENTIAL_CONCURRENCY = int(os.getenv("INGEST_CREDENTIAL_CONCURRENCY", 4))  # In-flight requests per client_id
+INGEST_MAX_RETRIES = int(os.getenv("INGEST_MAX_RETRIES", 5))
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+
+class IngestionEngine:
+    """
+    Asyncio ingestion of users, playlists and playlist tracks.
+
+    HTTP calls run on a thread pool over the shared pooled session, so the token
+    and credential logic in util.py is reused as-is. All database work runs on a
+    single dedicated thread because one pyodbc connection must not be used from
+    several threads at once.
+    """
+
+    def __init__(self, conn, cursor, update=True, user_concurrency=INGEST_USER_CONCURRENCY,
+                 request_concurrency=INGEST_REQUEST_CONCURRENCY, credential_concurrency=INGEST_CREDENTIAL_CONCURRENCY,
+                 debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+        self.conn = conn
+        self.cursor = cursor
+        self.update = update
+        self.user_concurrency = user_concurrency
+        self.request_concurrency = request_concurrency
+        self.credential_concurrency = credential_concurrency
+        self.debug_mode = debug_mode
+        self.warning_mode = warning_mode
+        self.error_mode = error_mode
+        self._request_limits = {}  # request_type -> Semaphore
+        self._credential_limits = {}  # client_id -> Semaphore
+        self._user_limit = None
+        self._http_executor = ThreadPoolExecutor(max_workers=max(request_concurrency * 2, 4), thread_name_prefix="ingest-http")
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-db")
+
+    def _request_limit(self, request_type):
+        if request_type not in self._request_limits:
+            self._request_limits[request_type] = asyncio.Semaphore(self.request_concurrency)
+        return self._request_limits[request_type]
+
+    def _credential_limit(self, client_id):
+        if client_id not in self._credential_limits:
+            self._credential_limits[client_id] = asyncio.Semaphore(self.credential_concurrency)
+        return self._credential_limits[client_id]
+
+    async def _run_http(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._http_executor, func, *args)
+
+    async def _run_db(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    async def fetch_json(self, url, request_type):
+        """
+        GETs a Spotify endpoint, sending each attempt on the key the scheduler picks.
+        A 429 backs that key off for Retry-After seconds.
+
+        Returns:
+            dict or None: The decoded JSON body, or None if the resource could not be fetched.
+        """
+        async with self._request_limit(request_type):
+            for attempt in range(INGEST_MAX_RETRIES):
+                client_id, wait = scheduler.reserve(request_type)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                access_token = await self._run_http(get_client_token, get_credential(client_id), request_type)
+                if access_token is None:
+                    continue
+
+                async with self._credential_limit(client_id):
+                    response = await self._run_http(http_get, url, {"Authorization": f"Bearer {access_token}"})
+
+                if response.status_code == 200:
+                    scheduler.record_success(client_id)
+                    return response.json()
+                elif response.status_code == 404:
+                    if self.debug_mode or self.warning_mode:
+                        gui.log(f"Resource not found: {url}", level="info")
+                        logger.info(f"Resource not found: {url}")
+                    return None
+                elif response.status_code == 401:
+                    invalidate_client_token(client_id)
+                elif response.status_code == 429:
+                    # The scheduler holds this key back for Retry-After and moves on to the others
+                    retry_after = int(response.headers.get("Retry-After", 1))
+                    scheduler.record_throttle(client_id, request_type, retry_after)
+                    if self.debug_mode or self.warning_mode:
+                        gui.log(f"Rate limit exceeded for client_id {client_id}. Backing it off for {retry_after} seconds.", level="info")
+                        logger.info(f"Rate limit exceeded for client_id {client_id}. Backing it off for {retry_after} seconds.")
+                else:
+                    if self.debug_mode or self.error_mode:
+                        gui.status(f"Request to {url} failed with status {response.status_code}.", status="error")
+                        logger.error(f"Request to {url} failed with status {response.status_code}.")
+                    return None
+
+        if self.debug_mode or self.error_mode:
+            gui.status(f"Failed to fetch {url} after retries.", status="error")
+            logger.error(f"Failed to fetch {url} after retries.")
+        return None
+
+    async def iter_pages(self, url, request_type, limit=50):
+        """
+        Async generator over the pages of a paginated endpoint.
+
+        The first page gives `total`; every remaining offset is then requested at
+        once and pages are yielded in completion order, so consumers can write
+        early pages while later ones are still in flight.
+
+        Yields:
+            list: The `items` of each page.
+        """
+        first_page = await self.fetch_json(paginated_url(url, 0, limit), request_type)
+        if first_page is None:
+            return
+        yield first_page.get("items", [])
+
+        tasks = [
+            asyncio.ensure_future(self.fetch_json(paginated_url(url, offset, limit), request_type))
+            for offset in range(limit, first_page.get("total", 0), limit)
+        ]
+        try:
+            for next_page in asyncio.as_completed(tasks):
+                page = await next_page
+                if page is not None:
+                    yield page.get("items", [])
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _store_playlist(self, user_id, playlist):
+        """Writes one playlist and links it to the user. Runs on the database thread."""
+        check_and_insert_playlist(playlist, user_id, self.cursor, self.conn)
+
+        # The simplified playlist object already carries its images
+        images = playlist.get("images") or []
+        if images:
+            self.cursor.execute(
+                "UPDATE Playlists SET images = ? WHERE playlist_id = ? AND images IS NULL",
+                images[0]["url"], playlist["id"]
+            )
+            self.conn.commit()
+
+    def _store_tracks(self, playlist_id, track_items):
+        """Writes one page of playlist tracks in a single batch. Runs on the database thread."""
+        with TrackBatchWriter(self.cursor, self.conn, debug_mode=self.debug_mode, warning_mode=self.warning_mode, error_mode=self.error_mode) as writer:
+            for track_item in track_items:
+                writer.add(track_item, playlist_id)
+
+    async def ingest_playlist(self, user_id, playlist):
+        """Stores a playlist and streams every page of its tracks into the database."""
+        await self._run_db(self._store_playlist, user_id, playlist)
+        tracks_url = f"{SPOTIFY_API_URL}/playlists/{playlist['id']}/tracks"
+        async for track_items in self.iter_pages(tracks_url, "Get Playlist Tracks", limit=100):
+            await self._run_db(self._store_tracks, playlist["id"], track_items)
+
+    def _store_user(self, user_id):
+        """Inserts the user's profile if it is missing. Runs on the database thread."""
+        if not check_user_exists(user_id, self.cursor):
+            insert_user_data(user_id, None, self.cursor, self.conn, update=self.update)
+
+    async def ingest_user(self, user_id):
+        """
+        Ingests one user: profile, every page of playlists and every page of their tracks.
+        Playlists, and the track pages within each playlist, are fetched concurrently.
+
+        Returns:
+            bool: True if the user was processed successfully.
+        """
+        async with self._user_limit:
+            try:
+                try:
+                    await self._run_db(self._store_user, user_id)
+                except AttributeError as e:
+                    if self.debug_mode or self.error_mode:
+                        gui.status(f"AttributeError encountered for user {user_id} during data insertion: {e}", status="error")
+                        logger.error(f"AttributeError encountered for user {user_id} during data insertion: {e}")
+
+                playlists = []
+                page_count = 0
+                playlists_url = f"{SPOTIFY_API_URL}/users/{user_id}/playlists"
+                async for items in self.iter_pages(playlists_url, "Get Playlists", limit=50):
+                    page_count += 1
+                    playlists.extend(playlist for playlist in items if playlist and playlist.get("id"))
+
+                if page_count == 0:
+                    if self.debug_mode or self.error_mode:
+                        gui.status(f"No data received for user {user_id}'s playlists.", status="error")
+                        logger.error(f"No data received for user {user_id}'s playlists.")
+                    return False
+
+                await asyncio.gather(*(self.ingest_playlist(user_id, playlist) for playlist in playlists))
+                return True
+
+            except Exception as e:
+                if self.debug_mode or self.error_mode:
+                    gui.status(f"General error processing user {user_id}: {e}", status="error")
+                    logger.error(f"General error processing user {user_id}: {e}")
+                return False
+
+    async def run(self, user_ids, on_user_done=None):
+        """
+        Ingests all users with at most `user_concurrency` in flight.
+
+        Args:
+            user_ids (list): Spotify user IDs to ingest.
+            on_user_done (callable): Optional callback(user_id, success) invoked as each user finishes.
+
+        Returns:
+            dict: user_id -> success flag.
+        """
+        self._user_limit = asyncio.Semaphore(self.user_concurrency)
+
+        async def ingest(user_id):
+            success = await self.ingest_user(user_id)
+            if on_user_done:
+                on_user_done(user_id, success)
+            return user_id, success
+
+        try:
+            results = await asyncio.gather(*(ingest(user_id) for user_id in user_ids))
+        finally:
+            self._http_executor.shutdown(wait=False)
+            self._db_executor.shutdown(wait=True)
+        return dict(results)
+
+def ingest_users(user_ids, conn, cursor, update=True, on_user_done=None, **limits):
+    """
+    Synchronous entry point for the asyncio ingestion engine.
+
+    Args:
+        user_ids (list): Spotify user IDs to ingest.
+        conn (pyodbc.Connection): Database connection to commit transactions.
+        cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        update (bool): If True, update existing user rows.
+        on_user_done (callable): Optional callback(user_id, success).
+        **limits: Overrides for user_concurrency, request_concurrency and credential_concurrency.
+
+    Returns:
+        dict: user_id -> success flag.
+    """
+    engine = IngestionEngine(conn, cursor, update=update, **limits)
+    return asyncio.run(engine.run(user_ids, on_user_done=on_user_done))
@@ -4,11 +4,13 @@ import time
 from util import get_access_token_for_request
 from db_operations import check_user_exists, insert_user_data
 from playlist_operations import handle_playlists
+from ingest_engine import ingest_users
 import sys
 from dotenv import load_dotenv
 import os
 from cmd_gui_kit import CmdGUI
 import logging
+from db_pool import get_pool
 
 # Setup logging
 LOG_FILE = "logs/main.log"
@@ -42,6 +44,7 @@ DEBUG_MODE = '--debug' in sys.argv
 WARNING_MODE = '--warning' in sys.argv
 ERROR_MODE = '--error' in sys.argv
 UPDATE_MODE = '--upt' in sys.argv
+ASYNC_MODE = '--async' in sys.argv
 
 load_dotenv()
 
@@ -49,14 +52,6 @@ DEBUG_MODE = os.getenv("DEBUG_MODE")
 if DEBUG_MODE == "True":
     DEBUG_MODE = True
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
-
 # Function to process user data and playlists
 def process_user_data(user_id, conn, cursor, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE, UPDATE = True):
     try:
@@ -111,38 +106,35 @@ def update_csv_status(CSV_path, user_id):
                 row['processed'] = '1'
             csvwriter.writerow(row)
 
-# Main function
-def main(CSV_path, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE, update_mode = UPDATE_MODE):
-    # Connect to SQL Server
-    try:
-        conn = pyodbc.connect(CONNECTION_STRING)
-        cursor = conn.cursor()
-        if debug_mode:
-            gui.status("Connected to the database successfully.", status="success")
-            logger.info("Connected to the database successfully.")
-    except pyodbc.Error as db_err:
-        if debug_mode or error_mode:
-            gui.status(f"Database connection failed: {db_err}", status="error")
-            logger.error(f"Database connection failed: {db_err}")
-        return
-
+def process_csv(CSV_path, conn, cursor, debug_mode, warning_mode, error_mode, update_mode, async_mode):
+    """Processes every user in the CSV file that is not marked processed yet, on the given connection."""
     # Read user IDs from CSV file
     try:
         with open(CSV_path, 'r') as csvfile:
-            csvreader = csv.DictReader(csvfile)
-            for row in csvreader:
-                user_id = row['user_id']
-                processed = row.get('processed', '0')
+            rows = list(csv.DictReader(csvfile))
+
+        # Process only users who have not been processed
+        pending_user_ids = [row['user_id'] for row in rows if row.get('processed', '0') == '0']
+
+        if async_mode:
+            gui.log(f"Processing {len(pending_user_ids)} users concurrently.", level="info")
+            logger.info(f"Processing {len(pending_user_ids)} users concurrently.")
 
-                # Process only users who have not been processed
-                if processed == '0':
-                    gui.log(f"Processing user: {user_id}", level="info")
-                    logger.info(f"Processing user: {user_id}")
-                    success = process_user_data(user_id, conn, cursor, UPDATE=update_mode)
+            def mark_processed(user_id, success):
+                # Mark user as processed if successful
+                if success:
+                    update_csv_status(CSV_path, user_id)
 
-                    # Mark user as processed if successful
-                    if success:
-                        update_csv_status(CSV_path, user_id)
+            ingest_users(pending_user_ids, conn, cursor, update=update_mode, on_user_done=mark_processed)
+        else:
+            for user_id in pending_user_ids:
+                gui.log(f"Processing user: {user_id}", level="info")
+                logger.info(f"Processing user: {user_id}")
+                success = process_user_data(user_id, conn, cursor, UPDATE=update_mode)
+
+                # Mark user as processed if successful
+                if success:
+                    update_csv_status(CSV_path, user_id)
 
     except FileNotFoundError:
         if debug_mode or error_mode:
@@ -152,16 +144,36 @@ def main(CSV_path, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=
         if debug_mode or warning_mode:
             gui.status(f"CSV file format error: Missing key {key_err}", status="warning")
             logger.warning(f"CSV file format error: Missing key {key_err}")
+    except pyodbc.OperationalError:
+        # Let the pool see it, so the dead connection is not reused
+        raise
     except Exception as e:
         if debug_mode or error_mode:
             gui.status(f"An error occurred while reading the CSV file: {e}", status="error")
             logger.error(f"An error occurred while reading the CSV file: {e}")
-    finally:
-        cursor.close()
-        conn.close()
-        if debug_mode:
-            gui.status("Database connection closed.", status="info")
-            logger.info("Database connection closed.")
+
+# Main function
+def main(CSV_path, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE, update_mode = UPDATE_MODE, async_mode = ASYNC_MODE):
+    # Connect to SQL Server; the pool discards the connection if a connection-level error escapes
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if debug_mode:
+                    gui.status("Connected to the database successfully.", status="success")
+                    logger.info("Connected to the database successfully.")
+                process_csv(CSV_path, conn, cursor, debug_mode, warning_mode, error_mode, update_mode, async_mode)
+            finally:
+                cursor.close()
+    except pyodbc.Error as db_err:
+        if debug_mode or error_mode:
+            gui.status(f"Database connection failed: {db_err}", status="error")
+            logger.error(f"Database connection failed: {db_err}")
+        return
+
+    if debug_mode:
+        gui.status("Database connection closed.", status="info")
+        logger.info("Database connection closed.")
 
 if __name__ == "__main__":
     CSV_path = "user_ids.csv"
@@ -8,6 +8,7 @@ import os
 from dotenv import load_dotenv
 from cmd_gui_kit import CmdGUI
 import logging
+from db_pool import get_pool
 
 
 # Setup logging
@@ -48,14 +49,6 @@ DEBUG_MODE = os.getenv("DEBUG_MODE")
 if DEBUG_MODE == "True":
     DEBUG_MODE = True
 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
-
 # Function to process playlist data
 def process_playlist_data(playlist_id, conn, cursor, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     try:
@@ -81,47 +74,50 @@ def process_playlist_data(playlist_id, conn, cursor, debug_mode=DEBUG_MODE, warn
 
 # Main function
 def main(CSV_path, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
-    # Connect to SQL Server
+    # Connect to SQL Server; the pool discards the connection if a connection-level error escapes
     try:
-        conn = pyodbc.connect(CONNECTION_STRING)
-        cursor = conn.cursor()
-        if debug_mode:
-            gui.log("Connected to the database successfully.", level="info")
-            logger.info("Connected to the database successfully.")
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if debug_mode:
+                    gui.log("Connected to the database successfully.", level="info")
+                    logger.info("Connected to the database successfully.")
+
+                # Read playlist IDs from CSV file
+                try:
+                    with open(CSV_path, 'r') as csvfile:
+                        csvreader = csv.DictReader(csvfile)
+                        for row in csvreader:
+                            playlist_id = row['playlist_id']
+                            gui.log(f"Processing playlist: {playlist_id}", level="info")
+                            logger.info(f"Processing playlist: {playlist_id}")
+                            process_playlist_data(playlist_id, conn, cursor)
+                except FileNotFoundError:
+                    if debug_mode or error_mode:
+                        gui.status(f"CSV file {CSV_path} not found.", status="error")
+                        logger.error(f"CSV file {CSV_path} not found.")
+                except KeyError as key_err:
+                    if debug_mode or warning_mode:
+                        gui.log(f"CSV file format error: Missing key {key_err}", level="warn")
+                        logger.info(f"CSV file format error: Missing key {key_err}")
+                except pyodbc.OperationalError:
+                    # Let the pool see it, so the dead connection is not reused
+                    raise
+                except Exception as e:
+                    if debug_mode or error_mode:
+                        gui.status(f"An error occurred while reading the CSV file: {e}", status="error")
+                        logger.error(f"An error occurred while reading the CSV file: {e}")
+            finally:
+                cursor.close()
     except pyodbc.Error as db_err:
         if debug_mode or error_mode:
             gui.status(f"Database connection failed: {db_err}", status="error")
             logger.error(f"Database connection failed: {db_err}")
         return
 
-    # Read playlist IDs from CSV file
-    try:
-        with open(CSV_path, 'r') as csvfile:
-            csvreader = csv.DictReader(csvfile)
-            for row in csvreader:
-                playlist_id = row['playlist_id']
-                gui.log(f"Processing playlist: {playlist_id}", level="info")
-                logger.info(f"Processing playlist: {playlist_id}")
-                process_playlist_data(playlist_id, conn, cursor)
-    except FileNotFoundError:
-        if debug_mode or error_mode:
-            gui.status(f"CSV file {CSV_path} not found.", status="error")
-            logger.error(f"CSV file {CSV_path} not found.")
-    except KeyError as key_err:
-        if debug_mode or warning_mode:
-            gui.log(f"CSV file format error: Missing key {key_err}", level="warn")
-            logger.info(f"CSV file format error: Missing key {key_err}")
-    except Exception as e:
-        if debug_mode or error_mode:
-            gui.status(f"An error occurred while reading the CSV file: {e}", status="error")
-            logger.error(f"An error occurred while reading the CSV file: {e}")
-    finally:
-        # Close the database connection
-        cursor.close()
-        conn.close()
-        if debug_mode:
-            gui.log("Database connection closed.", level="info")
-            logger.info("Database connection closed.")
+    if debug_mode:
+        gui.log("Database connection closed.", level="info")
+        logger.info("Database connection closed.")
 
 if __name__ == "__main__":
     CSV_path = "playlist_ids.csv"
@@ -0,0 +1,136 @@
+import time
+import logging
+import os
+from threading import Lock
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger("SyncBranchLogger")
+
+# Token bucket settings per client_id (requests per second, override through .env)
+SCHEDULER_INITIAL_RATE = float(os.getenv("SCHEDULER_INITIAL_RATE", 5))
+SCHEDULER_MIN_RATE = float(os.getenv("SCHEDULER_MIN_RATE", 0.2))
+SCHEDULER_MAX_RATE = float(os.getenv("SCHEDULER_MAX_RATE", 25))
+SCHEDULER_BURST = float(os.getenv("SCHEDULER_BURST", 10))
+SCHEDULER_RATE_INCREASE = float(os.getenv("SCHEDULER_RATE_INCREASE", 0.05))  # Added to the rate per successful request
+SCHEDULER_RATE_DECREASE = float(os.getenv("SCHEDULER_RATE_DECREASE", 0.5))  # Rate multiplier on every 429
+SCHEDULER_CEILING_RECOVERY = float(os.getenv("SCHEDULER_CEILING_RECOVERY", 0.02))  # Added to the ceiling per elapsed second, back up to the max rate
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to the responses it sees (AIMD).
+
+    Every success raises the rate a little, up to the highest rate that has not
+    been throttled yet. Every 429 cuts the rate and remembers it as the ceiling,
+    so the bucket settles near the key's sustainable rate. The ceiling climbs
+    back toward SCHEDULER_MAX_RATE over time, so an old 429 stops holding the
+    key down once the limit has passed.
+    """
+
+    def __init__(self, rate=SCHEDULER_INITIAL_RATE, capacity=SCHEDULER_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.ceiling = SCHEDULER_MAX_RATE
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.ceiling = min(SCHEDULER_MAX_RATE, self.ceiling + elapsed * SCHEDULER_CEILING_RECOVERY)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until one token is available (0 if one is available now)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def headroom(self, now):
+        """Tokens available now, negative while blocked by Retry-After."""
+        self._refill(now)
+        if self.blocked_until > now:
+            return -(self.blocked_until - now) * self.rate
+        return self.tokens
+
+    def take(self, now):
+        """Consumes one token and returns how long the caller must wait before sending."""
+        wait = self.wait_time(now)
+        self.tokens -= 1
+        return wait
+
+    def reward(self):
+        self.rate = min(self.ceiling, self.rate + SCHEDULER_RATE_INCREASE)
+
+    def throttle(self, retry_after, now):
+        self.ceiling = max(SCHEDULER_MIN_RATE, self.rate * 0.9)
+        self.rate = max(SCHEDULER_MIN_RATE, self.rate * SCHEDULER_RATE_DECREASE)
+        self.blocked_until = max(self.blocked_until, now + retry_after)
+        self.tokens = min(self.tokens, 0)
+
+class CredentialScheduler:
+    """
+    Spreads requests across every healthy credential at once.
+
+    Each client_id has its own TokenBucket. A request goes to the healthy key
+    with the most headroom, so throughput grows with the number of keys instead
+    of failing over one key at a time.
+    """
+
+    def __init__(self, client_ids, status_registry=None):
+        self.status_registry = status_registry
+        self._lock = Lock()
+        self._buckets = {client_id: TokenBucket() for client_id in client_ids}
+
+    def _is_healthy(self, client_id, request_type):
+        return self.status_registry is None or not self.status_registry.is_rate_limited(client_id, request_type)
+
+    def reserve(self, request_type):
+        """
+        Reserves a slot on the credential with the most headroom.
+
+        Returns:
+            tuple: (client_id, wait_seconds). The caller must wait before sending.
+        """
+        with self._lock:
+            if not self._buckets:
+                raise Exception("No credentials configured for the request scheduler.")
+            now = time.monotonic()
+            healthy = [client_id for client_id in self._buckets if self._is_healthy(client_id, request_type)]
+            candidates = healthy or list(self._buckets)
+            client_id = max(candidates, key=lambda cid: self._buckets[cid].headroom(now))
+            wait = self._buckets[client_id].take(now)
+        if not healthy:
+            logger.warning(f"All credentials are rate-limited for {request_type}. Using {client_id} after {wait:.2f}s.")
+        return client_id, wait
+
+    def acquire(self, request_type):
+        """Blocking variant of reserve(); sleeps until the slot is due and returns the client_id."""
+        client_id, wait = self.reserve(request_type)
+        if wait > 0:
+            time.sleep(wait)
+        return client_id
+
+    def record_success(self, client_id):
+        with self._lock:
+            if client_id in self._buckets:
+                self._buckets[client_id].reward()
+
+    def record_throttle(self, client_id, request_type, retry_after):
+        """Feeds a 429/Retry-After back into the key's bucket and the status registry."""
+        with self._lock:
+            bucket = self._buckets.get(client_id)
+            if bucket:
+                bucket.throttle(retry_after, time.monotonic())
+                logger.info(f"client_id {client_id} throttled; rate lowered to {bucket.rate:.2f} req/s.")
+        if self.status_registry is not None:
+            self.status_registry.mark_rate_limited(client_id, request_type, retry_after)
+
+    def rates(self):
+        """Returns the current learned rate per client_id."""
+        with self._lock:
+            return {client_id: bucket.rate for client_id, bucket in self._buckets.items()}
@@ -1,11 +1,15 @@
-import pyodbc
-from db_operations import fetch_and_insert_audio_features
+from db_operations import fetch_audio_features_batch, insert_audio_features
+from util import scheduler
 from tqdm import tqdm
 import sys
+import threading
+from queue import Queue, Full
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 from dotenv import load_dotenv
 from cmd_gui_kit import CmdGUI
 import logging
+from db_pool import get_pool
 
 # Setup logging
 LOG_FILE = "logs/update_audio_features.log"
@@ -45,62 +49,234 @@ DEBUG_MODE = os.getenv("DEBUG_MODE")
 if DEBUG_MODE == "True":
     DEBUG_MODE = True
 
-# Database connection settings
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
+# Backfill pipeline settings (override through .env)
+AUDIO_FEATURES_BATCH_SIZE = 100  # Max IDs for /v1/audio-features?ids=
+AUDIO_FEATURES_PER_CREDENTIAL = int(os.getenv("AUDIO_FEATURES_PER_CREDENTIAL", 2))  # Batches in flight per client_id
+AUDIO_FEATURES_CONCURRENCY = int(os.getenv("AUDIO_FEATURES_CONCURRENCY", 0))  # Total batches in flight; 0 derives it from the credentials
+AUDIO_FEATURES_PAGE_SIZE = int(os.getenv("AUDIO_FEATURES_PAGE_SIZE", 5000))  # Candidate IDs read per keyset page
+AUDIO_FEATURES_UNAVAILABLE_TTL_DAYS = int(os.getenv("AUDIO_FEATURES_UNAVAILABLE_TTL_DAYS", 30))  # Days before a null result is retried
+AUDIO_FEATURES_WRITER_POLL = 1.0  # Seconds a full write queue is waited on before the writer is checked again
 
-DB_CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
+# Tracks Spotify returned null features for; skipped until retry_after
+CREATE_UNAVAILABLE_LEDGER_SQL = """
+IF OBJECT_ID('Audio_Features_Unavailable', 'U') IS NULL
+CREATE TABLE Audio_Features_Unavailable (
+    track_id NVARCHAR(255) NOT NULL PRIMARY KEY,
+    attempts INT NOT NULL,
+    last_checked DATETIME2 NOT NULL,
+    retry_after DATETIME2 NOT NULL
+)
+"""
 
-def fetch_tracks_missing_audio_features(cursor):
+RECORD_UNAVAILABLE_SQL = """
+MERGE Audio_Features_Unavailable WITH (HOLDLOCK) AS target
+USING (SELECT ? AS track_id) AS source
+ON target.track_id = source.track_id
+WHEN MATCHED THEN
+    UPDATE SET attempts = target.attempts + 1, last_checked = SYSUTCDATETIME(),
+               retry_after = DATEADD(day, ?, SYSUTCDATETIME())
+WHEN NOT MATCHED THEN
+    INSERT (track_id, attempts, last_checked, retry_after)
+    VALUES (source.track_id, 1, SYSUTCDATETIME(), DATEADD(day, ?, SYSUTCDATETIME()));
+"""
+
+MISSING_AUDIO_FEATURES_PAGE_SQL = """
+SELECT TOP (?) t.track_id
+FROM Tracks t
+WHERE t.track_id > ?
+  AND NOT EXISTS (SELECT 1 FROM Audio_Features af WHERE af.track_id = t.track_id)
+  AND NOT EXISTS (
+      SELECT 1 FROM Audio_Features_Unavailable u
+      WHERE u.track_id = t.track_id AND u.retry_after > SYSUTCDATETIME()
+  )
+ORDER BY t.track_id
+"""
+
+def ensure_unavailable_ledger(cursor, conn):
+    """Creates the Audio_Features_Unavailable ledger if it does not exist yet."""
+    cursor.execute(CREATE_UNAVAILABLE_LEDGER_SQL)
+    conn.commit()
+
+def record_unavailable_tracks(track_ids, cursor, conn, ttl_days=AUDIO_FEATURES_UNAVAILABLE_TTL_DAYS):
+    """Records tracks Spotify has no audio features for, so they are skipped for `ttl_days`."""
+    if not track_ids:
+        return
+    cursor.fast_executemany = True
+    cursor.executemany(RECORD_UNAVAILABLE_SQL, [(track_id, ttl_days, ttl_days) for track_id in track_ids])
+    conn.commit()
+
+def iter_tracks_missing_audio_features(cursor, page_size=AUDIO_FEATURES_PAGE_SIZE):
     """
-    Fetches track IDs from the Tracks table that are missing in the Audio_Features table.
+    Yields track IDs from the Tracks table that are missing in the Audio_Features table
+    and are not in the unavailable ledger, one keyset page at a time.
+
+    Each page continues after the last track_id of the previous one, so rows
+    inserted by the backfill meanwhile never shift the pages.
 
     Args:
         cursor (pyodbc.Cursor): Database cursor for executing SQL queries.
+        page_size (int): Track IDs per query.
+
+    Yields:
+        str: Track IDs missing audio features, in track_id order.
+    """
+    last_track_id = ""
+    while True:
+        cursor.execute(MISSING_AUDIO_FEATURES_PAGE_SQL, page_size, last_track_id)
+        page = [row[0] for row in cursor.fetchall()]
+        yield from page
+        if len(page) < page_size:
+            return
+        last_track_id = page[-1]
+
+def iter_batches(track_ids, batch_size=AUDIO_FEATURES_BATCH_SIZE):
+    """Groups an iterable of track IDs into lists of at most `batch_size`."""
+    batch = []
+    for track_id in track_ids:
+        batch.append(track_id)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def default_concurrency():
+    """Batches in flight: AUDIO_FEATURES_CONCURRENCY, or AUDIO_FEATURES_PER_CREDENTIAL per scheduled credential."""
+    if AUDIO_FEATURES_CONCURRENCY > 0:
+        return AUDIO_FEATURES_CONCURRENCY
+    return max(1, len(scheduler.rates()) * AUDIO_FEATURES_PER_CREDENTIAL)
+
+def write_audio_features(write_queue, progress, stats, errors, debug_mode=DEBUG_MODE, error_mode=ERROR_MODE):
+    """
+    Writer thread: bulk-inserts fetched batches from `write_queue` until it receives None.
+    Owns a single pooled connection, so inserts never contend with the fetchers.
+    An error that stops the thread is appended to `errors` for the producer to raise.
+    """
+    try:
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                while True:
+                    item = write_queue.get()
+                    if item is None:
+                        break
+                    track_batch, audio_features_list = item
+                    try:
+                        stats["inserted"] += insert_audio_features(audio_features_list, cursor, conn, debug_mode)
+                        # The response lines up with the requested IDs; null entries have no features
+                        unavailable = [track_id for track_id, features in zip(track_batch, audio_features_list) if not features]
+                        record_unavailable_tracks(unavailable, cursor, conn)
+                        stats["unavailable"] += len(unavailable)
+                    except Exception as e:
+                        conn.rollback()
+                        stats["failed"] += 1
+                        if debug_mode or error_mode:
+                            gui.status(f"Failed to insert audio features batch: {e}", status="error")
+                            logger.error(f"Failed to insert audio features batch: {e}")
+                    progress.update(1)
+            finally:
+                cursor.close()
+    except Exception as e:
+        errors.append(e)
+        gui.status(f"Audio features writer stopped: {e}", status="error")
+        logger.error(f"Audio features writer stopped: {e}")
 
-    Returns:
-        list: List of track IDs that are missing audio features.
+def put_for_writer(write_queue, item, writer, errors):
     """
-    query = """
-    SELECT t.track_id
-    FROM Tracks t
-    LEFT JOIN Audio_Features af ON t.track_id = af.track_id
-    WHERE af.track_id IS NULL
+    Queues an item for the writer thread without blocking forever on a writer that has died.
+
+    Raises:
+        Exception: The writer's error, or RuntimeError if it exited without one.
     """
-    cursor.execute(query)
-    return [row[0] for row in cursor.fetchall()]
+    while True:
+        if errors:
+            raise errors[0]
+        if not writer.is_alive():
+            raise RuntimeError("Audio features writer exited before the queue was drained.")
+        try:
+            write_queue.put(item, timeout=AUDIO_FEATURES_WRITER_POLL)
+            return
+        except Full:
+            continue
 
-def check_and_update_audio_features(debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+def stop_writer(write_queue, writer):
+    """Sends the writer its stop signal, unless it already exited, and waits for it."""
+    while writer.is_alive():
+        try:
+            write_queue.put(None, timeout=AUDIO_FEATURES_WRITER_POLL)
+            break
+        except Full:
+            continue
+    writer.join()
+
+def check_and_update_audio_features(concurrency=None, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     """
     Checks the database for tracks that are missing audio features,
     fetches the missing audio features from the Spotify API, and updates the Audio_Features table.
 
+    Up to `concurrency` batches are fetched at once through the credential
+    scheduler while a writer thread inserts finished batches, so the API and
+    the database work overlap instead of alternating.
+
     Args:
+        concurrency (int): Batches in flight; defaults to default_concurrency().
         debug_mode (bool): If True, print debug information.
     """
-    conn = pyodbc.connect(DB_CONNECTION_STRING)
-    cursor = conn.cursor()
-
-    # Fetch track IDs that are missing audio features
-    missing_audio_features_tracks = fetch_tracks_missing_audio_features(cursor)
-
-    if debug_mode:
-        gui.log(f"Found {len(missing_audio_features_tracks)} tracks missing audio features.", level="info")
-        logger.info(f"Found {len(missing_audio_features_tracks)} tracks missing audio features.")
-
-    # Process tracks in batches to avoid rate limiting
-    batch_size = 100
-    for i in tqdm(range(0, len(missing_audio_features_tracks), batch_size), desc="Processing missing audio features", unit="batch"):
-        track_batch = missing_audio_features_tracks[i:i + batch_size]
-        fetch_and_insert_audio_features(track_batch, None, cursor, conn, debug_mode)
-
-    cursor.close()
-    conn.close()
-    gui.status("Finished updating missing audio features.", status="success")
-    logger.info("Finished updating missing audio features.")
+    concurrency = concurrency or default_concurrency()
+
+    # Candidates are streamed by keyset pagination on their own connection
+    with get_pool().connection() as candidate_conn:
+        candidate_cursor = candidate_conn.cursor()
+        try:
+            ensure_unavailable_ledger(candidate_cursor, candidate_conn)
+            batches = iter_batches(iter_tracks_missing_audio_features(candidate_cursor))
+
+            stats = {"inserted": 0, "unavailable": 0, "failed": 0}
+            # Bounded so fetchers pause if the writer falls behind
+            write_queue = Queue(maxsize=concurrency * 2)
+            progress = tqdm(desc="Processing missing audio features", unit="batch")
+            writer_errors = []  # Filled by the writer thread if it stops
+            writer = threading.Thread(target=write_audio_features, args=(write_queue, progress, stats, writer_errors, debug_mode, error_mode), name="audio-features-writer")
+            writer.start()
+            in_flight_batches = {}  # future -> track IDs it was asked for
+
+            def hand_off(futures):
+                for future in futures:
+                    track_batch = in_flight_batches.pop(future)
+                    try:
+                        audio_features_list = future.result()
+                    except Exception as e:
+                        if debug_mode or error_mode:
+                            gui.status(f"Failed to fetch audio features batch: {e}", status="error")
+                            logger.error(f"Failed to fetch audio features batch: {e}")
+                        audio_features_list = None
+                    if audio_features_list is None:
+                        stats["failed"] += 1
+                        progress.update(1)
+                    else:
+                        put_for_writer(write_queue, (track_batch, audio_features_list), writer, writer_errors)
+
+            try:
+                with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="audio-features") as executor:
+                    for track_batch in batches:
+                        if len(in_flight_batches) >= concurrency:
+                            done, _ = wait(in_flight_batches, return_when=FIRST_COMPLETED)
+                            hand_off(done)
+                        future = executor.submit(fetch_audio_features_batch, track_batch, debug_mode, warning_mode, error_mode)
+                        in_flight_batches[future] = track_batch
+                    hand_off(wait(list(in_flight_batches)).done)
+            finally:
+                stop_writer(write_queue, writer)
+                progress.close()
+            if writer_errors:
+                raise writer_errors[0]
+        finally:
+            candidate_cursor.close()
+
+    summary = (f"{stats['inserted']} inserted, {stats['unavailable']} marked unavailable, "
+               f"{stats['failed']} failed batches")
+    gui.status(f"Finished updating missing audio features ({summary}).", status="success")
+    logger.info(f"Finished updating missing audio features ({summary}).")
 
 def main():
     # Run the audio feature check and update function
@@ -1,10 +1,12 @@
 import pyodbc
-from fetch_playlist_image import fetch_and_insert_playlist_images
+from fetch_playlist_image import fetch_playlist_image_url, apply_playlist_images
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from cmd_gui_kit import CmdGUI
 from dotenv import load_dotenv
 from tqdm import tqdm
 import os
 import logging
+from db_pool import get_pool
 
 
 # Setup logging
@@ -42,14 +44,9 @@ DEBUG_MODE = os.getenv("DEBUG_MODE")
 if DEBUG_MODE == "True":
     DEBUG_MODE = True
 
-# Database connection settings
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-
-DB_CONNECTION_STRING = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={DB_HOST},{DB_PORT};DATABASE={DB_NAME};UID={DB_USER};PWD={DB_PASSWORD}"
+# Image refresh settings (override through .env)
+PLAYLIST_IMAGE_WORKERS = int(os.getenv("PLAYLIST_IMAGE_WORKERS", 8))  # Concurrent /images requests
+PLAYLIST_IMAGE_UPDATE_BATCH = int(os.getenv("PLAYLIST_IMAGE_UPDATE_BATCH", 1000))  # Playlists per set-based UPDATE
 
 def get_playlist_ids(cursor, update_all=True):
     """
@@ -69,36 +66,60 @@ def get_playlist_ids(cursor, update_all=True):
     cursor.execute(query)
     return [row[0] for row in cursor.fetchall()]
 
-def update_all_playlist_images(update_all=True, debug_mode=False, warning_mode=False, error_mode=False):
+def update_all_playlist_images(update_all=True, debug_mode=False, warning_mode=False, error_mode=False, max_workers=PLAYLIST_IMAGE_WORKERS):
     """
     Fetches playlist IDs from the database and updates their images.
 
+    Images are fetched concurrently from /playlists/{id}/images and written in
+    batches of PLAYLIST_IMAGE_UPDATE_BATCH with one UPDATE that only touches
+    rows whose URL changed.
+
     Args:
         update_all (bool): If True, update all playlists. If False, update only playlists without images.
+        max_workers (int): Concurrent image requests.
         debug_mode (bool): If True, enable debug logs.
         warning_mode (bool): If True, enable warning logs.
         error_mode (bool): If True, enable error logs.
     """
     try:
-        # Connect to the database
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        gui.status("Connected to the database successfully.", status="success")
-        logger.info("Connected to the database successfully.")
-
-        # Get playlist IDs based on the update_all parameter
-        playlist_ids = get_playlist_ids(cursor, update_all=update_all)
-        gui.log(f"Found {len(playlist_ids)} playlists to update.", level="info")
-        logger.info(f"Found {len(playlist_ids)} playlists to update.")
-
-        # Use tqdm to add a progress bar
-        for playlist_id in tqdm(playlist_ids, desc="Updating Playlists", unit="playlist"):
-            gui.log(f"Processing playlist ID: {playlist_id}", level="info")
-            logger.info(f"Processing playlist ID: {playlist_id}")
-            fetch_and_insert_playlist_images(playlist_id, cursor, conn, debug_mode, warning_mode, error_mode)
-
-        gui.status("Playlist images updated successfully.", status="success")
-        logger.info("Playlist images updated successfully.")
+        # Connect to the database; the pool discards the connection if a connection-level error escapes
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                gui.status("Connected to the database successfully.", status="success")
+                logger.info("Connected to the database successfully.")
+
+                # Get playlist IDs based on the update_all parameter
+                playlist_ids = get_playlist_ids(cursor, update_all=update_all)
+                gui.log(f"Found {len(playlist_ids)} playlists to update.", level="info")
+                logger.info(f"Found {len(playlist_ids)} playlists to update.")
+
+                playlist_images = {}
+                updated = 0
+                failed = 0
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(fetch_playlist_image_url, playlist_id, debug_mode, warning_mode, error_mode): playlist_id
+                        for playlist_id in playlist_ids
+                    }
+                    # Use tqdm to add a progress bar
+                    for future in tqdm(as_completed(futures), total=len(futures), desc="Updating Playlists", unit="playlist"):
+                        found, image_url = future.result()
+                        if not found:
+                            failed += 1
+                            continue
+                        playlist_images[futures[future]] = image_url
+                        if len(playlist_images) >= PLAYLIST_IMAGE_UPDATE_BATCH:
+                            updated += apply_playlist_images(playlist_images, cursor, conn)
+                            playlist_images = {}
+                updated += apply_playlist_images(playlist_images, cursor, conn)
+
+                gui.status(f"Playlist images updated successfully ({updated} changed, {failed} failed).", status="success")
+                logger.info(f"Playlist images updated successfully ({updated} changed, {failed} failed).")
+            finally:
+                cursor.close()
+                gui.log("Database connection closed.", level="info")
+                logger.info("Database connection closed.")
 
     except pyodbc.Error as db_err:
         gui.status(f"Database error: {db_err}", status="error")
@@ -108,15 +129,6 @@ def update_all_playlist_images(update_all=True, debug_mode=False, warning_mode=F
         gui.status(f"Unexpected error: {e}", status="error")
         logger.error(f"Unexpected error: {e}")
 
-    finally:
-        try:
-            cursor.close()
-            conn.close()
-            gui.log("Database connection closed.", level="info")
-            logger.info("Database connection closed.")
-        except Exception:
-            pass
-
 if __name__ == "__main__":
     # Set update_all to True or False based on your preference
     UPDATE_ALL = False  # Change to True to update all playlists
@@ -1,11 +1,15 @@
-import requests
 import base64
 import time
 import json
 import os
-from threading import Lock
+from threading import Lock, Thread
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 import sys
 from check_credentials import check_api_status
+from http_session import http_get, http_post
+from credential_registry import CredentialStatusRegistry
+from request_scheduler import CredentialScheduler
 from dotenv import load_dotenv
 from cmd_gui_kit import CmdGUI
 import logging
@@ -52,7 +56,7 @@ if DEBUG_MODE == "True":
 def fetch_user_profile(access_token, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     url = "https://api.spotify.com/v1/me"
     headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
+    response = http_get(url, headers=headers)
     if response.status_code == 200:
         user_data = response.json()
         return {
@@ -84,9 +88,26 @@ else:
 
 # File to track the status of API keys
 STATUS_FILE = "api_status.json"
-token_cache = {}  # Correctly declare this globally
+token_cache = {}  # client_id -> {"access_token": str, "expires_at": epoch seconds}
+current_credentials = {}  # request_type -> client_id currently in use
 lock = Lock()
 
+# Refresh client tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", 300))
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# Number of pages fetched in parallel after the first page of a paginated endpoint
+PAGINATION_PREFETCH_WORKERS = int(os.getenv("PAGINATION_PREFETCH_WORKERS", 4))
+
+_token_locks = {}  # client_id -> Lock, single-flight guard for the token endpoint
+_refreshing = set()  # client_ids with a background refresh in flight
+
+# In-memory status table backed by STATUS_FILE
+status_registry = CredentialStatusRegistry(STATUS_FILE)
+
+# Spreads requests over every credential with per-key token buckets
+scheduler = CredentialScheduler([cred["client_id"] for cred in CREDENTIALS], status_registry)
+
 # Load existing API status from a JSON file if it exists
 def load_status_file():
     if os.path.exists(STATUS_FILE):
@@ -94,43 +115,21 @@ def load_status_file():
             return json.load(f)
     return []
 
-# Function to update the status of an API key in the status file
-# Function to update the status of an API key in the status file
+# Function to update the status of an API key in the status table
 def update_client_status(client_id, new_status_dict, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     """
-    Updates the entire status for a specific client in the JSON file.
+    Updates the entire status for a specific client in the in-memory status table.
+    The change is written back to the JSON file atomically by the registry.
     
     Args:
         client_id (str): The client ID to update.
         new_status_dict (dict): A dictionary containing the new statuses for the client.
     """
     try:
-        # Load existing status data from the JSON file
-        with open(STATUS_FILE, 'r') as f:
-            status_data = json.load(f)
-
-        # Iterate through the status data to find the matching client_id
-        for entry in status_data:
-            if entry["Client ID"] == client_id:
-                # Replace the entire status with the new status dictionary
-                entry["Status"] = new_status_dict
-                break  # Exit the loop once the client is found
-
-        # Save the updated status data back to the JSON file
-        with open(STATUS_FILE, 'w') as f:
-            json.dump(status_data, f, indent=4)
+        status_registry.set_client_status(client_id, new_status_dict)
         if debug_mode:
             gui.log(f"Updated all statuses for client_id {client_id}.", level="info")
             logger.info(f"Updated all statuses for client_id {client_id}.")
-
-    except FileNotFoundError:
-        if debug_mode or error_mode:
-            gui.status(f"Status file {STATUS_FILE} not found. Cannot update client status.", status="error")
-            logger.error(f"Status file {STATUS_FILE} not found. Cannot update client status.")
-    except json.JSONDecodeError:
-        if debug_mode or error_mode:
-            gui.status(f"Failed to decode JSON from {STATUS_FILE}.", status="error")
-            logger.error(f"Failed to decode JSON from {STATUS_FILE}.")
     except Exception as e:
         if debug_mode or error_mode:
             gui.status(f"An unexpected error occurred: {e}", status="error")
@@ -138,17 +137,7 @@ def update_client_status(client_id, new_status_dict, debug_mode=DEBUG_MODE, warn
 
 # Function to check if an API key is marked as rate-limited
 def is_key_rate_limited(client_id, request_type, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
-    try:
-        with open(STATUS_FILE, 'r') as f:
-            status_data = json.load(f)
-            for entry in status_data:
-                if entry["Client ID"] == client_id and entry["Status"].get(request_type) == "Rate-Limited":
-                    return True
-    except FileNotFoundError:
-        if debug_mode or error_mode:
-            gui.status(f"Status file {STATUS_FILE} not found. Cannot check API key status.", status="error")
-            logger.error(f"Status file {STATUS_FILE} not found. Cannot check API key status.")
-    return False
+    return status_registry.is_rate_limited(client_id, request_type)
 
 def get_active_key_for_request(request_type):
     """
@@ -160,35 +149,160 @@ def get_active_key_for_request(request_type):
     Returns:
         dict or None: The credential dictionary of an available key or None if not found.
     """
-    status_data = load_status_file()
-    for cred_status in status_data:
-        client_id = cred_status["Client ID"]
-        if cred_status["Status"].get(request_type) == "Active":
-            for cred in CREDENTIALS:
-                if cred["client_id"] == client_id:
-                    return cred
+    credentials_by_id = {cred["client_id"]: cred for cred in CREDENTIALS}
+    for client_id in status_registry.active_clients(request_type):
+        if client_id in credentials_by_id:
+            return credentials_by_id[client_id]
     return None
 
-def get_access_token_for_request(request_type, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
-    global token_cache
+def _get_token_lock(client_id):
+    with lock:
+        return _token_locks.setdefault(client_id, Lock())
+
+def _fetch_client_token(credential, request_type=None, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    """
+    Requests a new client-credentials token and stores it with its expiry.
+    Callers must hold the client's token lock.
+
+    Returns:
+        str or None: The new access token, or None if the token endpoint refused.
+    """
+    client_id = credential["client_id"]
+    client_secret = credential["client_secret"]
+    client_creds_b64 = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    token_data = {"grant_type": "client_credentials"}
+    token_headers = {
+        "Authorization": f"Basic {client_creds_b64}",
+        "Content-Type": "application/x-www-form-urlencoded",
+    }
 
-    # Initialize token cache for the request type if it doesn't exist
-    if request_type not in token_cache:
-        token_cache[request_type] = {'current_credential': None, 'tokens': {}}
+    response = http_post(TOKEN_URL, data=token_data, headers=token_headers)
 
-    current_credential = token_cache[request_type]['current_credential']
+    if response.status_code == 200:
+        response_data = response.json()
+        access_token = response_data["access_token"]
+        expires_in = int(response_data.get("expires_in", 3600))
+        with lock:
+            token_cache[client_id] = {"access_token": access_token, "expires_at": time.time() + expires_in}
+        if debug_mode:
+            gui.log(f"New access token obtained using client_id {client_id} (expires in {expires_in}s).", level="info")
+            logger.info(f"New access token obtained using client_id {client_id} (expires in {expires_in}s).")
+        return access_token
+    elif response.status_code == 429:
+        retry_after = int(response.headers.get("Retry-After", 1))
+        if request_type:
+            status_registry.mark_rate_limited(client_id, request_type, retry_after)
+        if debug_mode or warning_mode:
+            gui.log(f"Rate limit exceeded for client_id {client_id}. Marked as 'Rate-Limited' for {retry_after} seconds.", level="warn")
+            logger.info(f"Rate limit exceeded for client_id {client_id}. Marked as 'Rate-Limited' for {retry_after} seconds.")
+    else:
+        if debug_mode or error_mode:
+            gui.status(f"Failed to obtain token for client_id {client_id}. Status code: {response.status_code}", status="error")
+            logger.error(f"Failed to obtain token for client_id {client_id}. Status code: {response.status_code}")
+    return None
+
+def _schedule_token_refresh(credential):
+    """Refreshes a client's token in a background thread, at most once at a time per client."""
+    client_id = credential["client_id"]
+    with lock:
+        if client_id in _refreshing:
+            return
+        _refreshing.add(client_id)
+
+    def refresh():
+        try:
+            with _get_token_lock(client_id):
+                entry = token_cache.get(client_id)
+                if entry and entry["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN:
+                    return  # Another worker already refreshed it
+                _fetch_client_token(credential)
+        except Exception as e:
+            logger.error(f"Background token refresh failed for client_id {client_id}: {e}")
+        finally:
+            with lock:
+                _refreshing.discard(client_id)
+
+    Thread(target=refresh, daemon=True).start()
+
+def get_client_token(credential, request_type=None):
+    """
+    Returns a valid access token for a credential.
+
+    Fresh tokens are served from the cache. Tokens inside TOKEN_REFRESH_MARGIN are
+    still served while a background refresh replaces them. Missing or expired
+    tokens are fetched synchronously under a per-client lock, so concurrent
+    workers wait for one request instead of all hitting the token endpoint.
+
+    Args:
+        credential (dict): A credential with "client_id" and "client_secret".
+        request_type (str): Request type to mark as rate-limited if the token endpoint returns 429.
+
+    Returns:
+        str or None: The access token, or None if one could not be obtained.
+    """
+    client_id = credential["client_id"]
+    entry = token_cache.get(client_id)
+    if entry:
+        remaining = entry["expires_at"] - time.time()
+        if remaining > TOKEN_REFRESH_MARGIN:
+            return entry["access_token"]
+        if remaining > 0:
+            _schedule_token_refresh(credential)
+            return entry["access_token"]
+
+    with _get_token_lock(client_id):
+        entry = token_cache.get(client_id)
+        if entry and entry["expires_at"] > time.time():
+            return entry["access_token"]
+        return _fetch_client_token(credential, request_type)
+
+def invalidate_client_token(client_id):
+    """Drops a cached token, e.g. after Spotify rejected it with 401."""
+    with lock:
+        token_cache.pop(client_id, None)
+
+def get_credential(client_id):
+    """Returns the credential dictionary for a client ID, or None."""
+    return next((cred for cred in CREDENTIALS if cred["client_id"] == client_id), None)
+
+def get_scheduled_token(request_type, max_attempts=None):
+    """
+    Lets the scheduler pick the credential with the most headroom and returns its token.
+    Blocks until the chosen key's token bucket allows another request.
+
+    Returns:
+        tuple: (client_id, access_token).
+    """
+    for _ in range(max_attempts or max(len(CREDENTIALS), 1)):
+        client_id = scheduler.acquire(request_type)
+        access_token = get_client_token(get_credential(client_id), request_type)
+        if access_token:
+            return client_id, access_token
+    raise Exception(f"No valid tokens could be obtained for request type: {request_type}")
+
+def get_credential_token_for_request(request_type, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    """
+    Picks a credential that is not rate-limited for a request type and returns its token.
+
+    Returns:
+        tuple: (client_id, access_token) of the credential that was selected.
+    """
+    current_credential = current_credentials.get(request_type)
 
     # Check if the current credential is still active
     if current_credential and not is_key_rate_limited(current_credential, request_type):
-        if debug_mode:
-            gui.log(f"Using cached token for client_id {current_credential} for request type: {request_type}", level="info")
-            logger.info(f"Using cached token for client_id {current_credential} for request type: {request_type}")
-        return token_cache[request_type]['tokens'][current_credential]
+        credential = get_credential(current_credential)
+        if credential:
+            access_token = get_client_token(credential, request_type)
+            if access_token:
+                if debug_mode:
+                    gui.log(f"Using cached token for client_id {current_credential} for request type: {request_type}", level="info")
+                    logger.info(f"Using cached token for client_id {current_credential} for request type: {request_type}")
+                return current_credential, access_token
 
     # If no valid current credential, find a new one
     for credential in CREDENTIALS:
         client_id = credential["client_id"]
-        client_secret = credential["client_secret"]
 
         # Skip if this client ID is marked as rate-limited
         if is_key_rate_limited(client_id, request_type):
@@ -197,55 +311,21 @@ def get_access_token_for_request(request_type, debug_mode=DEBUG_MODE, warning_mo
                 logger.info(f"Skipping client_id {client_id} as it is marked 'Rate-Limited' for {request_type}.")
             continue
 
-        # If token is already cached for this client ID, use it
-        if client_id in token_cache[request_type]['tokens']:
-            token_cache[request_type]['current_credential'] = client_id
-            if debug_mode:
-                gui.log(f"Using cached token for client_id {client_id} for request type: {request_type}", level="info")
-                logger.info(f"Using cached token for client_id {client_id} for request type: {request_type}")
-            return token_cache[request_type]['tokens'][client_id]
-
-        # Request a new access token for this client ID
-        client_creds_b64 = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
-        token_url = "https://accounts.spotify.com/api/token"
-        token_data = {"grant_type": "client_credentials"}
-        token_headers = {
-            "Authorization": f"Basic {client_creds_b64}",
-            "Content-Type": "application/x-www-form-urlencoded",
-        }
-        
-        response = requests.post(token_url, data=token_data, headers=token_headers)
-        
-        if response.status_code == 200:
-            response_data = response.json()
-            access_token = response_data["access_token"]
+        first_token = client_id not in token_cache
+        access_token = get_client_token(credential, request_type)
+        if access_token is None:
+            continue
 
-            # Cache the token and set this credential as the current active one
-            with lock:
-                token_cache[request_type]['tokens'][client_id] = access_token
-                token_cache[request_type]['current_credential'] = client_id
+        current_credentials[request_type] = client_id
 
-            # Update status to Active
-            status_results = check_api_status(access_token, API_COMMANDS)
-            update_client_status(client_id,status_results)
-            if debug_mode:
-                gui.log(f"New access token obtained using client_id {client_id} for request type: {request_type}", level="info")
-                logger.info(f"New access token obtained using client_id {client_id} for request type: {request_type}")
-            return access_token
-        elif response.status_code == 429:
-            retry_after = int(response.headers.get("Retry-After", 1))
-            status_results = check_api_status(access_token, API_COMMANDS)
-            update_client_status(client_id,status_results)
-            if debug_mode or warning_mode:
-                gui.log(f"Rate limit exceeded for client_id {client_id}. Marked as 'Rate-Limited'. Retrying after {retry_after} seconds.", level="warn")
-                logger.info(f"Rate limit exceeded for client_id {client_id}. Marked as 'Rate-Limited'. Retrying after {retry_after} seconds.")
-            time.sleep(retry_after)
-        else:
-            status_results = check_api_status(access_token, API_COMMANDS)
-            update_client_status(client_id,status_results)
-            if debug_mode or error_mode:
-                gui.status(f"Failed to obtain token for client_id {client_id}. Status code: {response.status_code}", status="error")
-                logger.error(f"Failed to obtain token for client_id {client_id}. Status code: {response.status_code}")
+        # Refresh the key's status the first time this process uses it
+        if first_token:
+            status_results = check_api_status(access_token, API_COMMANDS, gui=gui)
+            update_client_status(client_id, status_results)
+        if debug_mode:
+            gui.log(f"Using client_id {client_id} for request type: {request_type}", level="info")
+            logger.info(f"Using client_id {client_id} for request type: {request_type}")
+        return client_id, access_token
                 
     # If all credentials are exhausted, log and raise an exception
     if debug_mode or error_mode:
@@ -253,9 +333,14 @@ def get_access_token_for_request(request_type, debug_mode=DEBUG_MODE, warning_mo
         logger.error(f"No valid tokens could be obtained for request type: {request_type}")
     raise Exception()
 
+def get_access_token_for_request(request_type, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    _, access_token = get_credential_token_for_request(request_type, debug_mode, warning_mode, error_mode)
+    return access_token
+
 def make_request(url, request_type, max_retries=5, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
     """
     Makes a GET request to a specified URL with retry logic to handle rate limiting.
+    Each attempt is sent with the credential the scheduler currently has the most headroom on.
 
     Args:
         url (str): The API endpoint to request data from.
@@ -265,30 +350,32 @@ def make_request(url, request_type, max_retries=5, debug_mode=DEBUG_MODE, warnin
     Returns:
         requests.Response or None: The API response if successful, or None if not found.
     """
-    access_token = get_access_token_for_request(request_type)
-    headers = {"Authorization": f"Bearer {access_token}"}
-
     for attempt in range(max_retries):
-        response = requests.get(url, headers=headers)
+        client_id, access_token = get_scheduled_token(request_type)
+        headers = {"Authorization": f"Bearer {access_token}"}
+        response = http_get(url, headers=headers)
 
         if response.status_code == 200:
+            scheduler.record_success(client_id)
             return response
+        elif response.status_code == 401:
+            # Token was revoked or expired early; drop it and fetch a fresh one
+            invalidate_client_token(client_id)
+            if debug_mode or warning_mode:
+                gui.log(f"Access token rejected for {url}. Requesting a new token.", level="info")
+                logger.info(f"Access token rejected for {url}. Requesting a new token.")
         elif response.status_code == 404:
             if debug_mode or warning_mode:
                 gui.log(f"Resource not found: {url}", level="info")
                 logger.info(f"Resource not found: {url}")
             return None  # Log and skip if resource is not found
         elif response.status_code == 429:
-            # Rate limit exceeded, check `Retry-After` header
+            # Rate limit exceeded; the scheduler backs this key off for `Retry-After` seconds
             retry_after = int(response.headers.get("Retry-After", 1))
+            scheduler.record_throttle(client_id, request_type, retry_after)
             if debug_mode or warning_mode:
-                gui.log(f"Rate limit exceeded. Waiting for {retry_after} seconds before retrying.", level="info")
-                logger.info(f"Rate limit exceeded. Waiting for {retry_after} seconds before retrying.")
-            time.sleep(retry_after)
-
-            # Get a new access token in case of rate limit
-            access_token = get_access_token_for_request(request_type)
-            headers["Authorization"] = f"Bearer {access_token}"
+                gui.log(f"Rate limit exceeded for client_id {client_id}. Backing it off for {retry_after} seconds.", level="info")
+                logger.info(f"Rate limit exceeded for client_id {client_id}. Backing it off for {retry_after} seconds.")
         else:
             response.raise_for_status()
     if debug_mode or error_mode:
@@ -296,6 +383,53 @@ def make_request(url, request_type, max_retries=5, debug_mode=DEBUG_MODE, warnin
         logger.error("Failed to fetch data after retries.")
     return None
 
+def paginated_url(url, offset, limit):
+    """Appends offset/limit query parameters to a Spotify endpoint URL."""
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}{urlencode({'offset': offset, 'limit': limit})}"
+
+def iter_paginated_items(url, request_type, limit=50, max_workers=PAGINATION_PREFETCH_WORKERS, debug_mode=DEBUG_MODE, warning_mode=WARNING_MODE, error_mode=ERROR_MODE):
+    """
+    Yields every item of a paginated Spotify endpoint.
+
+    The first page is read to learn `total`; the remaining offsets are then
+    requested concurrently and their items are yielded in order as soon as each
+    page arrives, so callers can start consuming before all pages are fetched.
+
+    Args:
+        url (str): The paginated endpoint (without offset/limit).
+        request_type (str): The type of request being made.
+        limit (int): Page size (Spotify allows 50 for most endpoints, 100 for playlist tracks).
+        max_workers (int): Maximum number of pages fetched in parallel.
+
+    Yields:
+        dict: Items from the `items` array of every page.
+    """
+    first_response = make_request(paginated_url(url, 0, limit), request_type)
+    if first_response is None or first_response.status_code != 200:
+        if debug_mode or error_mode:
+            gui.status(f"Failed to fetch the first page of {url}.", status="error")
+            logger.error(f"Failed to fetch the first page of {url}.")
+        return
+
+    first_page = first_response.json()
+    yield from first_page.get("items", [])
+
+    offsets = range(limit, first_page.get("total", 0), limit)
+    if not offsets:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(make_request, paginated_url(url, offset, limit), request_type) for offset in offsets]
+        for offset, future in zip(offsets, futures):
+            response = future.result()
+            if response is None or response.status_code != 200:
+                if debug_mode or warning_mode:
+                    gui.log(f"Skipping page at offset {offset} of {url}: no data received.", level="warn")
+                    logger.info(f"Skipping page at offset {offset} of {url}: no data received.")
+                continue
+            yield from response.json().get("items", [])
+
 # Example usage
 # Replace 'API_COMMANDS' with your actual API command dictionary
 # make_request(API_COMMANDS["Get Playlists"], "Get Playlists")
@@ -1,9 +1,49 @@
 from flask import Blueprint, request, jsonify
 from utils import execute_query_with_logging, get_gender_icon
+from threading import Lock
+import os
+import sys
+
+# The vector store and match index live next to the similarity scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "9-D Vector Similiarity Calculation"))
+from match_index import MATCH_INDEX_FILE, MatchIndex
+from vector_store import VectorStore
+from similarity_kernel import FEATURE_LABELS
 
 # Define the Blueprint for database-related routes
 database_bp = Blueprint('database', __name__)
 
+# Memory-mapped user vectors and the match index kept in line with the mapped version
+_vector_store = VectorStore.open()
+_match_index = None
+_match_index_version = None
+_match_index_lock = Lock()
+
+# Upper bound on the limit a /get_top_matches caller may ask for
+TOP_MATCHES_MAX_LIMIT = 100
+
+def get_match_index():
+    """
+    Returns the match index, synced with the current vector store version.
+
+    The store is reloaded only here. The index starts from the saved match_index.npz
+    when there is one and is then synced in place, so a new store version costs an
+    incremental update rather than a full rebuild.
+    """
+    global _match_index, _match_index_version
+    with _match_index_lock:
+        _vector_store.reload()
+        if _match_index is None:
+            if os.path.exists(MATCH_INDEX_FILE):
+                _match_index = MatchIndex.load(MATCH_INDEX_FILE)
+            else:
+                _match_index = MatchIndex.from_store(_vector_store)
+                _match_index_version = _vector_store.version
+        if _match_index_version != _vector_store.version:
+            _match_index.sync(_vector_store.user_ids.tolist(), _vector_store.vectors)
+            _match_index_version = _vector_store.version
+    return _match_index
+
 @database_bp.route('/get_all_matches', methods=['POST'])
 def get_all_matches():
     """Retrieve all matches for a user based on match rates."""
@@ -209,6 +249,92 @@ ORDER BY final_match_rate_percentage DESC;
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@database_bp.route('/get_top_matches', methods=['POST'])
+def get_top_matches():
+    """Retrieve a user's best matches from the match index instead of the pair table."""
+    payload = request.json
+    user_id = payload.get('user_id')
+    db_name = payload.get('db_name', 'primary')  # Default to the primary database
+
+    if not user_id:
+        return jsonify({"error": "User ID is required"}), 400
+    try:
+        limit = int(payload.get('limit', 5))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Limit must be an integer"}), 400
+    limit = max(1, min(limit, TOP_MATCHES_MAX_LIMIT))
+
+    index = get_match_index()
+    if len(index) == 0:
+        return jsonify({"error": "Vector store has not been built yet"}), 503
+
+    try:
+        matches = index.query(user_id, limit)
+    except KeyError:
+        return jsonify({"error": "User is not in the match index"}), 404
+    if not matches:
+        return jsonify([]), 200
+
+    match_user_ids = [match_user_id for match_user_id, _ in matches]
+    placeholders = ",".join(["?"] * len(match_user_ids))
+    query = f"""
+SELECT
+    u.user_id AS match_user_id,
+    u.display_name AS match_user_name,
+    u.profile_image_url AS match_user_image,
+    uc.personal_type AS match_user_type,
+    ptmd.description AS match_type_desc
+FROM
+    Users u
+LEFT JOIN
+    UserClusters uc ON u.user_id = uc.user_id
+LEFT JOIN
+    UserClusters me ON me.user_id = ?
+LEFT JOIN
+    personal_type_match ptmd
+ON
+    (me.personal_type = ptmd.type_1 AND uc.personal_type = ptmd.type_2) OR
+    (me.personal_type = ptmd.type_2 AND uc.personal_type = ptmd.type_1)
+WHERE
+    u.user_id IN ({placeholders});
+    """
+
+    try:
+        data, description = execute_query_with_logging(query, db_name, params=[user_id, *match_user_ids], fetch=True)
+        columns = [desc[0] for desc in description]
+        profiles = {row[0]: dict(zip(columns, row)) for row in data}
+
+        username_query = f"SELECT spotify_user_id, username FROM users WHERE spotify_user_id IN ({placeholders})"
+        data, _ = execute_query_with_logging(username_query, "flutter", params=match_user_ids, fetch=True)
+        usernames = {row[0]: row[1] for row in data}
+
+        # Keep the index order, best match first
+        result = []
+        for match_user_id, score in matches:
+            row = profiles.get(match_user_id, {"match_user_id": match_user_id})
+            row["final_match_rate_percentage"] = round(score * 100, 2)
+            row["matched_username"] = usernames.get(match_user_id)
+            result.append(row)
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@database_bp.route('/get_user_features', methods=['POST'])
+def get_user_features():
+    """Retrieve a user's normalized audio features from the vector store."""
+    payload = request.json
+    user_id = payload.get('user_id')
+
+    if not user_id:
+        return jsonify({"error": "User ID is required"}), 400
+
+    get_match_index()  # Maps the current store version
+    with _match_index_lock:
+        vector = _vector_store.get(user_id)
+    if vector is None:
+        return jsonify({"error": "User has no audio features yet"}), 404
+    return jsonify({"user_id": user_id, **dict(zip(FEATURE_LABELS, vector.tolist()))}), 200
+
 @database_bp.route('/get_recent', methods=['POST'])
 def get_recent():
     """Retrieve recent activity for a user based on user_id."""
@@ -0,0 +1,54 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The kernel lives next to the similarity scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "9-D Vector Similiarity Calculation"))
+from similarity_kernel import FEATURE_WEIGHTS, pairwise_iou, polar_to_cartesian, radar_area
+
+shapely_geometry = pytest.importorskip("shapely.geometry")
+
+N_USERS = 40
+SEED = 7
+
+
+def shapely_iou(a, b):
+    """Reference IoU of two radar polygons, computed with Shapely."""
+    polygon_a = shapely_geometry.Polygon(polar_to_cartesian(a))
+    polygon_b = shapely_geometry.Polygon(polar_to_cartesian(b))
+    union = polygon_a.union(polygon_b).area
+    return polygon_a.intersection(polygon_b).area / union if union > 0 else 0.0
+
+
+def shapely_iou_matrix(radii):
+    return np.array([[shapely_iou(a, b) for b in radii] for a in radii])
+
+
+@pytest.fixture
+def radii():
+    """Random weighted vectors plus a zero vector and two identical vectors."""
+    vectors = np.random.default_rng(SEED).random((N_USERS, len(FEATURE_WEIGHTS)))
+    vectors[0] = 0.0
+    vectors[2] = vectors[1]
+    return vectors * FEATURE_WEIGHTS
+
+
+def test_pairwise_iou_matches_shapely(radii):
+    np.testing.assert_allclose(pairwise_iou(radii), shapely_iou_matrix(radii), rtol=0, atol=1e-12)
+
+
+def test_pairwise_iou_edge_cases(radii):
+    iou = pairwise_iou(radii)
+    # A zero vector has no area, so it overlaps nothing, itself included
+    assert np.all(iou[0] == 0.0)
+    assert np.all(iou[:, 0] == 0.0)
+    # Identical vectors overlap completely
+    assert iou[1, 2] == pytest.approx(1.0)
+    np.testing.assert_allclose(np.diag(iou)[1:], 1.0)
+    np.testing.assert_allclose(iou, iou.T, atol=1e-15)
+
+
+def test_radar_area_matches_shapely(radii):
+    expected = [shapely_geometry.Polygon(polar_to_cartesian(vector)).area for vector in radii]
+    np.testing.assert_allclose(radar_area(radii), expected, rtol=0, atol=1e-15)